@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""An asyncio variant of the tempory node managers
+
+Blocking libcloud and fabric calls are run in an executor and the polling loops
+await instead of sleeping so that a single event loop can drive many tempory
+nodes at once::
+
+    >>> async with AsyncTemporyGCENode(driver, **kwargs) as nm:
+    >>>     await nm.run_in_executor(nm.fabric.run, 'echo hello')
+
+"""
+
+from .node_manager import NodeManagerCleanupError
+from .node_manager import NodeManagerError
+from .node_manager import NodeManagerErrorNoNode
+from .node_manager import TemporyEC2Node
+from .node_manager import TemporyGCENode
+from .node_manager import TemporyNode
+from .output_sink import RotatingLogSink
+from .readiness import SSHReadinessProbe
+from libcloud.compute.types import LibcloudError
+from libcloud.compute.types import NodeState
+
+import asyncio
+import functools
+import logging
+import time
+import traceback
+
+
+logger = logging.getLogger('aplinux.distribution')
+
+
+class AsyncTemporyNode(TemporyNode):
+    """A tempory node instance which is driven by asyncio and used with ``async with``
+
+    Attributes:
+        executor: The concurrent.futures executor used for blocking calls. If None the
+            event loop's default executor is used
+        poll_interval: The number of seconds between node state polls
+    """
+
+    def __init__(self, *args, executor=None, poll_interval=3, **kwargs):
+        """Initialize the async tempory node manager.
+
+        Args:
+            executor: The executor used to run blocking libcloud and fabric calls. Pass a
+                larger ThreadPoolExecutor when driving hundreds of nodes from one loop
+            poll_interval: The number of seconds between node state polls
+            *args, **kwargs: Passed to the synchronous node manager
+        """
+        super().__init__(*args, **kwargs)
+        self.executor = executor
+        self.poll_interval = poll_interval
+
+    async def run_in_executor(self, func, *args, **kwargs):
+        """Run a blocking callable in the executor and return its result"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def _get_attribute(self, name):
+        """Resolve a property which may make blocking driver calls"""
+        return await self.run_in_executor(getattr, self, name)
+
+    async def create(self):
+        """Starts the tempory node. Return once the node is considered running"""
+        assert self.name is not None and self.name.strip() != '', 'name must not be None or blank string'
+        existing_node = await self.run_in_executor(self._get_node_by_name, self.name)
+        assert existing_node is None, f'Node with the name {self.name} already exists'
+        size = await self._get_attribute('size')
+        image = await self._get_attribute('image')
+        logger.info(f'Creating tempory {size} node from {image}: {self.name}')
+        with self.span('create'):
+            with self.span('create_node'):
+                self.node = await self.run_in_executor(self.driver.create_node,
+                                                       name=self.name,
+                                                       size=size,
+                                                       image=image,
+                                                       **self.create_kwargs)
+            self._changed_at = time.monotonic()
+            with self.span('wait_until_running'):
+                await self.wait_until_running()
+            await self.wait_until_ready()
+            if self.poison_pill_minutes is not None:
+                await self.poison_pill(minutes=self.poison_pill_minutes)
+
+    async def wait_until_running(self, timeout=600):
+        """Wait until the node is running and has an ip address"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            node = await self.run_in_executor(self._get_node_by_name, self.name)
+            if node is not None:
+                self.node = node
+                if node.state == NodeState.RUNNING and (node.public_ips or node.private_ips):
+                    return
+            if loop.time() + self.poll_interval > deadline:
+                raise NodeManagerError(f'Node {self.name} failed to start within {timeout} seconds')
+            await asyncio.sleep(self.poll_interval)
+
+    async def refresh_node(self):
+        """Refresh the node from the node's driver"""
+        self.node = await self.run_in_executor(self._get_node_by_name, self.name)
+
+    async def _is_terminated(self):
+        """Refresh the node returning True if it has gone or has been terminated"""
+        await self.refresh_node()
+        return self.node is None or self.node.state == NodeState.TERMINATED
+
+    async def destroy(self, wait_policy=None):
+        """Destroy the node, waiting for it to be terminated
+
+        Args:
+            wait_policy: The BackoffPolicy used to poll for termination. Defaults to
+                destroy_wait_policy
+        """
+        logger.info(f'Destroying tempory node: {self.name}')
+        wait_policy = wait_policy or self.destroy_wait_policy
+
+        if self.node is None:
+            await self.refresh_node()
+
+        if self.node is None:
+            raise NodeManagerErrorNoNode('No node to destroy')
+
+        with self.span('destroy'):
+            # Atempt a destroy
+            destroy_error = None
+            self._changed_at = time.monotonic()
+            try:
+                with self.span('destroy_node'):
+                    await self.run_in_executor(self.node.destroy)
+            except LibcloudError as err:
+                destroy_error = err
+
+            # Check that the node has gorne - sometimes the operation is successful with a timeout error
+            with self.span('wait_until_terminated'):
+                terminated = await self._wait_until_terminated(wait_policy)
+            if terminated:
+                return
+
+            # if we have a destroy error then raise from that error
+            if destroy_error is not None:
+                raise NodeManagerError('Node failed to terminate') from destroy_error
+            else:
+                raise NodeManagerError('Node failed to terminate')
+
+    async def _wait_until_terminated(self, wait_policy):
+        """Poll on the wait_policy schedule returning True once the node has terminated"""
+        return await self._wait(wait_policy, self._is_terminated)
+
+    async def _wait(self, wait_policy, check):
+        """Await check on the wait_policy schedule returning True once it returns a true value"""
+        if await check():
+            return True
+        for delay in wait_policy.schedule():
+            await asyncio.sleep(delay)
+            if await check():
+                return True
+        return False
+
+    async def wait_until_ready(self, wait_policy=None, port=None, connect_timeout=3, tries=None, delay=None,
+                               backoff=None):
+        """Wait until the node is able to accept fabric run commands
+
+        Each attempt of the staged SSHReadinessProbe is run in the executor, the event loop
+        awaits the delays between them. The seconds taken by each stage are recorded in
+        ready_timings.
+
+        Args:
+            wait_policy: The BackoffPolicy used between attempts. Defaults to ready_wait_policy
+            port (int): The ssh port. Defaults to the port of the fabric config
+            connect_timeout (int): The socket timeout of the tcp and banner stages
+            tries (int): Deprecated, see TemporyNode.wait_until_ready
+            delay (float): Deprecated, see TemporyNode.wait_until_ready
+            backoff (float): Deprecated, see TemporyNode.wait_until_ready
+        """
+        wait_policy = self._ready_wait_policy(wait_policy, tries, delay, backoff)
+        port = port or self.fabric_config.port
+        probe = SSHReadinessProbe(self._ready_host, self._test_connect, port=port, timeout=connect_timeout)
+        with self.span('wait_until_ready'):
+            ready = await self._wait(wait_policy, lambda: self.run_in_executor(probe))
+        self.ready_timings = probe.timings
+        if not ready:
+            raise NodeManagerError(f'Node {self.name} failed the {probe.stage} readiness check') from probe.error
+        logger.info(f'Tempory node ready: {self.name} ' +
+                    ' '.join(f'{stage}={seconds:.2f}s' for stage, seconds in probe.timings.items()))
+
+    async def poison_pill(self, minutes=1440):
+        """Shedules a VM shutdown after a given number of minutes"""
+        await self.run_in_executor(super().poison_pill, minutes=minutes)
+
+    def __enter__(self):
+        raise TypeError(f'{type(self).__name__} must be used with "async with"')
+
+    def __exit__(self, exc_type, ex_value, ex_tb):
+        raise TypeError(f'{type(self).__name__} must be used with "async with"')
+
+    async def __aenter__(self):
+        """Enter async python context"""
+        try:
+            await self.create()
+        except (BaseException) as e:  # we can use BaseException since we are re-raising it
+            traceback.print_exc()
+
+            # sleep for a bit incase the destroy api is eventually consistant
+            await asyncio.sleep(3)
+            try:
+                await self.destroy()
+            except NodeManagerErrorNoNode:
+                pass
+            raise e
+        return self
+
+    async def __aexit__(self, exc_type, ex_value, ex_tb):
+        """Exit async context manager"""
+        if ex_value is not None:
+            traceback.print_exception(exc_type, ex_value, ex_tb)
+        if isinstance(self._output_sink, RotatingLogSink):
+            self._output_sink.close()
+        if self.defer_destroy:
+            if self.reaper is None:
+                from .reaper import NodeReaper
+                self.reaper = NodeReaper.default()
+            self.reaper.submit(self)
+            return
+        try:
+            await self.destroy()
+        except Exception as e:
+            raise NodeManagerCleanupError('An exception was raied during node deletion. Node left in unkonwn state') from e
+
+
+class AsyncTemporyGCENode(AsyncTemporyNode, TemporyGCENode):
+    """An asyncio Google Cloud Tempory Node"""
+
+    async def stop_and_create_image(self, image_name, labels=None):
+        """Create an image from a machiene. In GCE the machiene must be stopped
+
+        Args:
+            image_name: The name of the new image
+            labels: An optional dict of labels given to the image
+
+        Returns:
+            The new image
+        """
+        return await self.run_in_executor(super().stop_and_create_image, image_name, labels=labels)
+
+    async def start_node(self):
+        """Start the node again after stop_and_create_image, returning once it is ready
+
+        Stopping the node cancels its poison pill so it is scheduled again.
+        """
+        logger.info(f'Starting node: {self.name}')
+        with self.span('start_node'):
+            await self.run_in_executor(self.driver.ex_start_node, self.node)
+            await self.refresh_node()
+            await self.wait_until_ready()
+            if self.poison_pill_minutes is not None:
+                await self.poison_pill(minutes=self.poison_pill_minutes)
+
+
+class AsyncTemporyEC2Node(AsyncTemporyNode, TemporyEC2Node):
+    """An asyncio Amazon Web Services Elastic Compute Cloud (EC2) temporary node"""
+
+    async def create(self):
+        """Also add a key pair to access the EC2 instance"""
+        await self.run_in_executor(self.import_key_pair)
+        await super().create()
+
+        # The public IP address does not show up when the node is first fetched
+        logger.info('Refreshing node')
+        await self.refresh_node()
+
+    async def destroy(self, *args, **kwargs):
+        """Also clean up the key pair if it has been created"""
+        try:
+            await super().destroy(*args, **kwargs)
+        finally:
+            await self.run_in_executor(self.delete_key_pair)
@@ -0,0 +1,181 @@
+# -*- coding:utf-8 -*-
+
+from . import async_node_manager
+from . import node_manager
+from .output_sink import RotatingLogSink
+from .reaper import NodeReaper
+from .wait_policy import BackoffPolicy
+from libcloud.compute.types import NodeState
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+import asyncio
+
+
+class TestAsyncTemporyNode(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.driver = MagicMock()
+        self.driver.list_nodes.return_value = []
+        self.node_manager = async_node_manager.AsyncTemporyNode(self.driver,
+                                                                size='small',
+                                                                image='foo',
+                                                                key_pair=MagicMock(),
+                                                                poll_interval=0,
+                                                                colour='red')
+        self.node_manager.name = 'node-123'
+        self.node = MagicMock()
+        self.node.name = 'node-123'
+        self.node.public_ips = ['111.222.333.444']
+        self.node.private_ips = []
+
+    def test_sync_context_not_supported(self):
+        with self.assertRaises(TypeError):
+            with self.node_manager:
+                pass
+
+    async def test_create(self):
+        self.node.state = NodeState.RUNNING
+        self.driver.create_node.return_value = self.node
+        self.driver.list_nodes.side_effect = [[], [self.node]]
+        self.node_manager.wait_until_ready = AsyncMock()
+        await self.node_manager.create()
+        self.driver.create_node.assert_called_with(name='node-123',
+                                                   size='small',
+                                                   image='foo',
+                                                   colour='red')
+        self.assertEqual(self.node_manager.node, self.node)
+        self.node_manager.wait_until_ready.assert_awaited_with()
+
+    async def test_wait_until_running_timeout(self):
+        self.node.state = NodeState.PENDING
+        self.driver.list_nodes.return_value = [self.node]
+        with self.assertRaises(node_manager.NodeManagerError):
+            await self.node_manager.wait_until_running(timeout=0)
+
+    async def test_destroy(self):
+        self.node.state = NodeState.RUNNING
+        terminated = MagicMock()
+        terminated.name = 'node-123'
+        terminated.state = NodeState.TERMINATED
+        self.driver.list_nodes.side_effect = [[self.node], [terminated]]
+        self.node_manager.node = self.node
+        await self.node_manager.destroy()
+        self.node.destroy.assert_called_with()
+        self.assertEqual(self.node_manager.node, terminated)
+
+    async def test_destroy_failed(self):
+        self.node.state = NodeState.RUNNING
+        self.driver.list_nodes.return_value = [self.node]
+        self.node_manager.node = self.node
+        with self.assertRaises(node_manager.NodeManagerError):
+            await self.node_manager.destroy(wait_policy=BackoffPolicy(deadline=0))
+
+    async def test_destroy_no_node(self):
+        with self.assertRaises(node_manager.NodeManagerErrorNoNode):
+            await self.node_manager.destroy()
+
+    async def test_wait_until_ready(self):
+        self.node_manager.node = self.node
+        self.node_manager._test_connect = MagicMock()
+        with patch.object(async_node_manager, 'SSHReadinessProbe') as probe_class:
+            probe = probe_class.return_value
+            probe.side_effect = [False, True]
+            probe.timings = {'tcp': 1.0, 'banner': 0.5, 'auth': 0.25}
+            await self.node_manager.wait_until_ready(wait_policy=BackoffPolicy(fast_interval=0))
+        probe_class.assert_called_once_with(self.node_manager._ready_host, self.node_manager._test_connect, port=22,
+                                            timeout=3)
+        self.assertEqual(probe.call_count, 2)
+        self.assertEqual(self.node_manager.ready_timings, probe.timings)
+
+    async def test_wait_until_ready_fails(self):
+        self.node_manager.node = self.node
+        with patch.object(async_node_manager, 'SSHReadinessProbe') as probe_class:
+            probe_class.return_value.return_value = False
+            probe_class.return_value.stage = 'banner'
+            probe_class.return_value.error = OSError('no banner')
+            with self.assertRaisesRegex(node_manager.NodeManagerError, 'banner'):
+                await self.node_manager.wait_until_ready(wait_policy=BackoffPolicy(deadline=0))
+
+    async def test_context(self):
+        self.node_manager.create = AsyncMock()
+        self.node_manager.destroy = AsyncMock()
+        async with self.node_manager as nm:
+            self.assertEqual(nm, self.node_manager)
+            self.node_manager.create.assert_awaited_with()
+        self.node_manager.destroy.assert_awaited_with()
+
+    async def test_context_exit_with_error(self):
+        self.node_manager.create = AsyncMock()
+        self.node_manager.destroy = AsyncMock(side_effect=Exception())
+        with self.assertRaises(node_manager.NodeManagerCleanupError):
+            async with self.node_manager:
+                pass
+
+    async def test_context_defer_destroy(self):
+        self.node_manager.create = AsyncMock()
+        self.node_manager.destroy = AsyncMock()
+        self.node_manager.defer_destroy = True
+        self.node_manager.reaper = MagicMock()
+        sink = self.node_manager.output_sink = MagicMock(spec=RotatingLogSink)
+        async with self.node_manager:
+            pass
+        self.node_manager.reaper.submit.assert_called_once_with(self.node_manager)
+        self.node_manager.destroy.assert_not_awaited()
+        sink.close.assert_called_once_with()
+
+    async def test_reaper_awaits_destroy(self):
+        self.node_manager.destroy = AsyncMock()
+        node_reaper = NodeReaper(workers=1)
+        await asyncio.wrap_future(node_reaper.submit(self.node_manager))
+        self.node_manager.destroy.assert_awaited_once_with()
+
+
+class TestAsyncTemporyGCENode(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.driver = MagicMock()
+        self.node_manager = async_node_manager.AsyncTemporyGCENode(self.driver,
+                                                                   image='debian-9',
+                                                                   key_pair=MagicMock(),
+                                                                   poison_pill_minutes=30)
+        self.node_manager.node = MagicMock()
+
+    async def test_stop_and_create_image(self):
+        image = await self.node_manager.stop_and_create_image('aplinux-1', labels={'aplinux-layer': 'abc'})
+        self.assertEqual(image, self.driver.ex_create_image.return_value)
+        self.driver.ex_create_image.assert_called_once_with('aplinux-1', self.driver.ex_get_volume.return_value,
+                                                            wait_for_completion=True,
+                                                            ex_labels={'aplinux-layer': 'abc'})
+
+    async def test_start_node(self):
+        self.node_manager.refresh_node = AsyncMock()
+        self.node_manager.wait_until_ready = AsyncMock()
+        self.node_manager.poison_pill = AsyncMock()
+        await self.node_manager.start_node()
+        self.driver.ex_start_node.assert_called_once_with(self.node_manager.node)
+        self.node_manager.refresh_node.assert_awaited_once_with()
+        self.node_manager.wait_until_ready.assert_awaited_once_with()
+        self.node_manager.poison_pill.assert_awaited_once_with(minutes=30)
+
+
+class TestAsyncTemporyEC2Node(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.driver = MagicMock()
+        self.node_manager = async_node_manager.AsyncTemporyEC2Node(self.driver,
+                                                                   image='ami-9887c6e7',
+                                                                   size='t3.micro',
+                                                                   key_pair=MagicMock())
+
+    async def test_destroy_deletes_key_pair(self):
+        self.node_manager.node = MagicMock()
+        self.node_manager.node.state = NodeState.TERMINATED
+        self.driver.list_nodes.return_value = []
+        await self.node_manager.destroy()
+        self.driver.delete_key_pair.assert_called_with(self.node_manager.key_pair)
+
+    def test_image(self):
+        self.assertEqual(self.node_manager.image, self.driver.get_image.return_value)
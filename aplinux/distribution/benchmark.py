@@ -0,0 +1,294 @@
+# -*- coding:utf-8 -*-
+"""Offline benchmark of the tempory node lifecycle
+
+Node managers are run against a FakeNodeDriver and a LocalSSHServer, see testing.py, so
+that the cost of the lifecycle code itself can be measured without cloud credentials.
+For each node manager class and level of concurrency the create, wait_until_ready and
+destroy latencies and the node throughput are reported. Every run is appended to a
+history file and compared with the median of the last few runs in it, so that a single
+noisy run does not set the bar. Until there is a history the stored baseline is used::
+
+    $ python -m aplinux.distribution.benchmark --concurrency 1 10 100
+    $ python -m aplinux.distribution.benchmark --history-runs 10
+    $ python -m aplinux.distribution.benchmark --save-baseline
+
+The import time of the modules in IMPORT_BUDGETS is checked too, each is imported in a
+fresh interpreter and must neither exceed its budget nor load the heavy dependencies it
+defers::
+
+    $ python -m aplinux.distribution.benchmark --imports-only
+
+The exit status is 1 if any result regressed beyond the tolerance or exceeded its budget.
+"""
+
+from .instrumentation import Instrumentation
+from .key_provider import Ed25519KeyProvider
+from .key_provider import RSAKeyProvider
+from .node_manager import TemporyEC2Node
+from .node_manager import TemporyGCENode
+from .node_manager import TemporyNode
+from .node_pool import TemporyNodePool
+from .testing import FakeNodeDriver
+from .testing import LocalSSHServer
+from datetime import datetime
+from libcloud.compute.base import NodeImage
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+logger = logging.getLogger('aplinux.distribution')
+
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'benchmark_baseline.json')
+
+DEFAULT_HISTORY_PATH = os.path.join(os.environ.get('XDG_CACHE_HOME') or '~/.cache', 'aplinux',
+                                    'benchmark_history.jsonl')
+
+NODE_CLASSES = {'TemporyNode': TemporyNode, 'TemporyGCENode': TemporyGCENode, 'TemporyEC2Node': TemporyEC2Node}
+
+KEY_PROVIDERS = {'rsa': RSAKeyProvider, 'ed25519': Ed25519KeyProvider}
+
+DEFAULT_LATENCIES = {'api_latency': 0.01, 'create_latency': 0.05, 'boot_latency': 0.2, 'terminate_latency': 0.2}
+
+PHASES = ('generate_key', 'create', 'wait_until_ready', 'destroy')
+
+HEAVY_MODULES = ('code', 'fabric', 'libcloud', 'paramiko', 'scp')
+
+# module name to (seconds, the heavy modules it must not load)
+IMPORT_BUDGETS = {'aplinux.distribution.gce_invoke': (0.5, HEAVY_MODULES),
+                  'aplinux.distribution.node_manager': (1.0, ('code', 'fabric', 'scp'))}
+
+_IMPORT_SCRIPT = """
+import importlib, json, sys, time
+start = time.perf_counter()
+importlib.import_module(sys.argv[1])
+print(json.dumps({'seconds': time.perf_counter() - start, 'modules': sorted(sys.modules)}))
+"""
+
+
+def run_benchmark(node_class, concurrency, server, latencies=None, key_provider=None):
+    """Create and destroy concurrency nodes at once, returning the timings as a dict
+
+    Args:
+        node_class: The TemporyNode class to benchmark
+        concurrency: The number of nodes created and destroyed at once
+        server: The LocalSSHServer the nodes' ssh connections are made to
+        latencies: The FakeNodeDriver latency keyword arguments
+        key_provider: The KeyProvider used by the node managers, their default if None
+    """
+    driver = FakeNodeDriver(ip_address=server.host, **(latencies or DEFAULT_LATENCIES))
+    instrumentation = Instrumentation()
+    size = driver.list_sizes()[0]
+    image = NodeImage(id='benchmark', name='benchmark', driver=driver)
+    managers = [node_class(driver,
+                           name_prefix='benchmark-',
+                           size=size,
+                           image=image,
+                           fabric_config_defaults={'port': server.port},
+                           instrumentation=instrumentation,
+                           key_provider=key_provider)
+                for i in range(concurrency)]
+    for nm in managers:
+        nm.fabric_config.run.in_stream = False  # the benchmark is not interactive
+    pool = TemporyNodePool(managers, max_workers=concurrency, consistency_delay=0)
+    start = time.monotonic()
+    pool.create()
+    created = time.monotonic()
+    pool.destroy()
+    seconds = time.monotonic() - start
+    phases = {}
+    for phase in PHASES:
+        summary = instrumentation.summaries.get(phase)
+        if summary is not None:
+            phases[phase] = {'p50': summary.p50, 'p95': summary.p95, 'mean': summary.mean}
+    return {'node_class': node_class.__name__,
+            'concurrency': concurrency,
+            'create_seconds': created - start,
+            'seconds': seconds,
+            'throughput': concurrency / seconds,
+            'api_calls': sum(driver.calls.values()),
+            'phases': phases}
+
+
+def run_suite(concurrencies=(1, 10, 100), node_classes=None, latencies=None, key_provider=None):
+    """Run the benchmark for each node class and concurrency, returning a dict keyed by class/concurrency"""
+    node_classes = node_classes or list(NODE_CLASSES.values())
+    results = {}
+    with LocalSSHServer() as server:
+        for node_class in node_classes:
+            for concurrency in concurrencies:
+                logger.info(f'Benchmarking {node_class.__name__} with {concurrency} concurrent nodes')
+                result = run_benchmark(node_class, concurrency, server, latencies, key_provider)
+                results[f'{node_class.__name__}/{concurrency}'] = result
+    return results
+
+
+def compare(results, baseline, tolerance=0.25, slack=0.05):
+    """Return a list of descriptions of the results which regressed from the baseline
+
+    Args:
+        results: The results of run_suite
+        baseline: Earlier results of run_suite
+        tolerance: The allowed fractional increase in latency or decrease in throughput
+        slack: Seconds of latency increase which are always allowed, to ignore noise in tiny timings
+    """
+    regressions = []
+    for key, result in results.items():
+        expected = baseline.get(key)
+        if expected is None:
+            continue
+        if result['throughput'] < expected['throughput'] / (1 + tolerance):
+            regressions.append(f'{key} throughput {result["throughput"]:.2f} nodes/s '
+                               f'was {expected["throughput"]:.2f} nodes/s')
+        for phase, timings in result['phases'].items():
+            expected_timings = expected['phases'].get(phase)
+            if expected_timings is None:
+                continue
+            for statistic in ('p50', 'p95'):
+                if timings[statistic] > expected_timings[statistic] * (1 + tolerance) + slack:
+                    regressions.append(f'{key} {phase} {statistic} {timings[statistic]:.3f}s '
+                                       f'was {expected_timings[statistic]:.3f}s')
+    return regressions
+
+
+def load_history(path, runs=5):
+    """Return the results of the last runs recorded in a history file, oldest first"""
+    path = os.path.expanduser(path)
+    if runs <= 0 or not os.path.exists(path):
+        return []
+    with open(path) as fin:
+        entries = [json.loads(line) for line in fin if line.strip()]
+    return [entry['results'] for entry in entries[-runs:]]
+
+
+def record_history(path, results):
+    """Append the results of a run to a history file of one json object per line"""
+    path = os.path.expanduser(path)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'a') as fout:
+        fout.write(json.dumps({'time': datetime.now().isoformat(), 'results': results}, sort_keys=True) + '\n')
+
+
+def median_results(runs):
+    """Return the median throughput and phase timings of each benchmark over several results of run_suite"""
+    aggregate = {}
+    for key in sorted(set(key for results in runs for key in results)):
+        results = [results[key] for results in runs if key in results]
+        phases = {}
+        for phase in sorted(set(phase for result in results for phase in result['phases'])):
+            timings = [result['phases'][phase] for result in results if phase in result['phases']]
+            phases[phase] = {statistic: statistics.median(timing[statistic] for timing in timings)
+                             for statistic in ('p50', 'p95', 'mean')}
+        aggregate[key] = {'throughput': statistics.median(result['throughput'] for result in results),
+                          'runs': len(results),
+                          'phases': phases}
+    return aggregate
+
+
+def measure_import(module, repeat=3):
+    """Import module in repeat fresh interpreters, returning the fastest seconds and the modules it loaded"""
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')]))}
+    seconds = []
+    for i in range(repeat):
+        output = subprocess.run([sys.executable, '-c', _IMPORT_SCRIPT, module],
+                                env=env, check=True, capture_output=True, text=True).stdout
+        measurement = json.loads(output)
+        seconds.append(measurement['seconds'])
+    return min(seconds), set(measurement['modules'])
+
+
+def check_imports(budgets=None, repeat=3):
+    """Return a list of descriptions of the modules which exceeded their import budget
+
+    Args:
+        budgets: A dict of module name to (seconds, heavy modules it must not load). Defaults to IMPORT_BUDGETS
+        repeat: The number of imports to take the fastest of
+    """
+    violations = []
+    for module, (budget, forbidden) in (budgets or IMPORT_BUDGETS).items():
+        seconds, modules = measure_import(module, repeat)
+        logger.info(f'Importing {module} took {seconds:.3f}s')
+        if seconds > budget:
+            violations.append(f'{module} took {seconds:.3f}s to import, the budget is {budget:.3f}s')
+        for name in forbidden:
+            if name in modules:
+                violations.append(f'{module} imported {name}')
+    return violations
+
+
+def format_results(results):
+    """Return the results as a text table"""
+    lines = [f'{"benchmark":<22} {"nodes/s":>8} {"api calls":>9} ' +
+             ' '.join(f'{phase + " p50/p95":>27}' for phase in PHASES)]
+    for key, result in results.items():
+        timings = []
+        for phase in PHASES:
+            phase_timings = result['phases'].get(phase)
+            timings.append(f'{"-":>27}' if phase_timings is None else
+                           f'{phase_timings["p50"]:>13.3f}/{phase_timings["p95"]:<13.3f}')
+        lines.append(f'{key:<22} {result["throughput"]:>8.2f} {result["api_calls"]:>9} ' + ' '.join(timings))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmark of the tempory node lifecycle')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--node-class', choices=sorted(NODE_CLASSES), nargs='+', default=list(NODE_CLASSES))
+    parser.add_argument('--key-provider', choices=sorted(KEY_PROVIDERS), default=None,
+                        help='Defaults to the node managers\' own default')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help='Store the results as the new baseline')
+    parser.add_argument('--history', default=DEFAULT_HISTORY_PATH, help='The file every run is appended to')
+    parser.add_argument('--history-runs', type=int, default=5,
+                        help='Compare with the median of this many previous runs, 0 to use the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--imports-only', action='store_true', help='Only check the import time budgets')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    violations = check_imports()
+    for violation in violations:
+        print(f'IMPORT BUDGET {violation}')
+    if args.imports_only:
+        return 1 if violations else 0
+
+    key_provider = KEY_PROVIDERS[args.key_provider]() if args.key_provider else None
+    results = run_suite(args.concurrency, [NODE_CLASSES[name] for name in args.node_class], key_provider=key_provider)
+    print(format_results(results))
+    history = load_history(args.history, args.history_runs)
+    record_history(args.history, results)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as fout:
+            json.dump(results, fout, indent=2, sort_keys=True)
+        print(f'Saved baseline to {args.baseline}')
+        return 1 if violations else 0
+    if history:
+        print(f'Comparing with the median of the last {len(history)} runs in {args.history}')
+        reference = median_results(history)
+    elif os.path.exists(args.baseline):
+        print(f'Comparing with the baseline {args.baseline}')
+        with open(args.baseline) as fin:
+            reference = json.load(fin)
+    else:
+        print(f'No history at {args.history} or baseline at {args.baseline}')
+        return 1 if violations else 0
+    regressions = compare(results, reference, tolerance=args.tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    return 1 if regressions or violations else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
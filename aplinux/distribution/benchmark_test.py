@@ -0,0 +1,95 @@
+# -*- coding:utf-8 -*-
+
+from . import benchmark
+from .key_provider import Ed25519KeyProvider
+from unittest import TestCase
+from unittest.mock import patch
+
+import json
+import math
+import os
+import tempfile
+
+
+def result(throughput=5.0, p50=1.0, p95=2.0):
+    return {'throughput': throughput, 'api_calls': 6, 'phases': {'create': {'p50': p50, 'p95': p95, 'mean': p50}}}
+
+
+class TestBenchmark(TestCase):
+
+    def test_run_suite(self):
+        latencies = {'boot_latency': 0.01, 'terminate_latency': 0}
+        results = benchmark.run_suite(concurrencies=(2,), node_classes=[benchmark.TemporyEC2Node],
+                                      latencies=latencies, key_provider=Ed25519KeyProvider())
+        self.assertEqual(list(results), ['TemporyEC2Node/2'])
+        result = results['TemporyEC2Node/2']
+        self.assertEqual(result['concurrency'], 2)
+        self.assertGreater(result['throughput'], 0)
+        self.assertGreaterEqual(result['api_calls'], 12)  # list_nodes polls vary with timing
+        self.assertCountEqual(result['phases'], benchmark.PHASES)
+        self.assertIn('TemporyEC2Node/2', benchmark.format_results(results))
+
+    def test_compare(self):
+        baseline = {'TemporyNode/1': result()}
+        self.assertEqual(benchmark.compare({'TemporyNode/1': result(4.5, 1.2, 2.3)}, baseline), [])
+        self.assertEqual(benchmark.compare({'TemporyNode/10': result(0.1, 10, 20)}, baseline), [])
+        regressions = benchmark.compare({'TemporyNode/1': result(3.0, 1.5, 2.0)}, baseline)
+        self.assertEqual(regressions, ['TemporyNode/1 throughput 3.00 nodes/s was 5.00 nodes/s',
+                                       'TemporyNode/1 create p50 1.500s was 1.000s'])
+
+    def test_main(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'baseline.json')
+            history = ['--history', os.path.join(temp_dir, 'history.jsonl')]
+            with patch.object(benchmark, 'run_suite', return_value={'TemporyNode/1': result()}) as run_suite, \
+                    patch.object(benchmark, 'check_imports', return_value=[]) as check_imports:
+                with patch('builtins.print'):
+                    self.assertEqual(benchmark.main(['--concurrency', '1', '--baseline', path, '--save-baseline']
+                                                    + history), 0)
+                    with open(path) as fin:
+                        self.assertEqual(json.load(fin), {'TemporyNode/1': result()})
+                    self.assertEqual(benchmark.main(['--baseline', path] + history), 0)
+                    run_suite.return_value = {'TemporyNode/1': result(p50=3)}
+                    self.assertEqual(benchmark.main(['--baseline', path] + history), 1)
+                    check_imports.return_value = ['aplinux.distribution.gce_invoke imported paramiko']
+                    self.assertEqual(benchmark.main(['--imports-only']), 1)
+            self.assertEqual(run_suite.call_count, 3)
+            self.assertEqual(run_suite.call_args[0][0], [1, 10, 100])
+            self.assertEqual(len(benchmark.load_history(history[1], runs=10)), 3)
+
+    def test_history(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'aplinux', 'history.jsonl')
+            self.assertEqual(benchmark.load_history(path), [])
+            for p50 in (1.0, 5.0, 1.5, 1.0):
+                benchmark.record_history(path, {'TemporyNode/1': result(p50=p50)})
+            runs = benchmark.load_history(path, runs=3)
+            self.assertEqual([run['TemporyNode/1']['phases']['create']['p50'] for run in runs], [5.0, 1.5, 1.0])
+            self.assertEqual(benchmark.load_history(path, runs=0), [])
+
+            # a single noisy run does not move the median
+            median = benchmark.median_results(runs)['TemporyNode/1']
+            self.assertEqual(median['runs'], 3)
+            self.assertEqual(median['throughput'], 5.0)
+            self.assertEqual(median['phases']['create'], {'p50': 1.5, 'p95': 2.0, 'mean': 1.5})
+
+            with patch.object(benchmark, 'run_suite', return_value={'TemporyNode/1': result(p50=1.6)}), \
+                    patch.object(benchmark, 'check_imports', return_value=[]):
+                with patch('builtins.print') as print_:
+                    self.assertEqual(benchmark.main(['--baseline', os.path.join(temp_dir, 'missing.json'),
+                                                     '--history', path, '--history-runs', '3']), 0)
+            printed = [call[0][0] for call in print_.call_args_list]
+            self.assertTrue(any(line.startswith('Comparing with the median of the last 3 runs') for line in printed))
+            self.assertEqual(len(benchmark.load_history(path, runs=10)), 5)
+
+    def test_lazy_imports(self):
+        # only the deferred imports, the timings are checked by the benchmark's --imports-only
+        budgets = {module: (math.inf, forbidden) for module, (seconds, forbidden) in benchmark.IMPORT_BUDGETS.items()}
+        self.assertEqual(benchmark.check_imports(budgets, repeat=1), [])
+
+    def test_check_imports(self):
+        seconds, modules = benchmark.measure_import('aplinux.distribution.output_sink', repeat=1)
+        self.assertIn('gzip', modules)
+        with patch.object(benchmark, 'measure_import', return_value=(0.2, {'json', 'paramiko'})):
+            violations = benchmark.check_imports({'foo': (0.1, ('paramiko', 'scp'))})
+        self.assertEqual(violations, ['foo took 0.200s to import, the budget is 0.100s', 'foo imported paramiko'])
@@ -0,0 +1,244 @@
+# -*- coding:utf-8 -*-
+"""Layered image builds which resume from cached intermediate images
+
+A build is split into named steps. Each step is fingerprinted from the fingerprint of
+the step before it, the source of its function and its inputs. After a step the node
+is snapshotted to a layer image labelled with the fingerprint, so that a later build
+whose early steps are unchanged boots from the deepest matching layer and only runs
+the steps after it::
+
+    >>> steps = [BuildStep('packages', fabfile.install_packages, {'packages': c.packages}),
+    >>>          BuildStep('app', fabfile.install_app, {'app': file_digest('app.tar.gz')})]
+    >>> build = LayeredBuild(driver, steps, base_image='debian-9', size='n1-standard-1')
+    >>> build.build('aplinux-20190101')
+
+Only a step function's own source is fingerprinted, the files and configuration it
+depends on should be given as its inputs. Layers are evicted least recently used first
+once there are more than max_layers of them.
+"""
+
+from .node_manager import TemporyGCENode
+from collections import namedtuple
+
+import hashlib
+import inspect
+import json
+import logging
+import time
+
+
+logger = logging.getLogger('aplinux.distribution')
+
+
+LAYER_LABEL = 'aplinux-layer'  # the fingerprint of an intermediate layer image
+BUILD_LABEL = 'aplinux-build'  # the fingerprint of a published image, which is never evicted
+USED_LABEL = 'aplinux-layer-used'  # the unix time a layer was last created or built from
+
+FINGERPRINT_LENGTH = 40  # image names and label values are limited to 63 characters
+
+
+BuildStep = namedtuple('BuildStep', ['name', 'function', 'inputs', 'snapshot'])
+BuildStep.__new__.__defaults__ = (None, True)
+BuildStep.__doc__ = """A named build step
+
+function is called with the node's fabric connection. inputs is any json serializable
+value the step depends on. If snapshot is False then no layer is created after the step.
+"""
+
+
+def file_digest(*paths):
+    """Return the sha256 hex digest of the contents of the files, for use in step inputs"""
+    hasher = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as fin:
+            for chunk in iter(lambda: fin.read(65536), b''):
+                hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _function_source(function):
+    try:
+        return inspect.getsource(function)
+    except (OSError, TypeError):
+        code = getattr(function, '__code__', None)
+        return repr(function) if code is None else code.co_code.hex()
+
+
+def fingerprint(step, parent):
+    """Return the fingerprint of a step following the step with the parent fingerprint"""
+    hasher = hashlib.sha256()
+    for part in (parent, step.name, _function_source(step.function),
+                 json.dumps(step.inputs, sort_keys=True, default=str)):
+        hasher.update(part.encode('utf-8'))
+        hasher.update(b'\0')
+    return hasher.hexdigest()[:FINGERPRINT_LENGTH]
+
+
+class LayerCache(object):
+    """The layer images of a driver's project, found by their fingerprint labels
+
+    Attributes:
+        driver: The libcloud GCE driver
+        max_layers: The number of intermediate layer images kept by evict()
+    """
+
+    def __init__(self, driver, max_layers=20):
+        self.driver = driver
+        self.max_layers = max_layers
+
+    def list_images(self):
+        """Return the images of the driver's project, the public images are not listed"""
+        return self.driver.list_images(ex_project=self.driver.project)
+
+    def layers(self, images=None):
+        """Return a dict of fingerprint to the layer or published image with that fingerprint
+
+        Args:
+            images: The images from list_images(), listed if None
+        """
+        layers = {}
+        for image in self.list_images() if images is None else images:
+            labels = (image.extra or {}).get('labels') or {}
+            for label in (BUILD_LABEL, LAYER_LABEL):
+                if label in labels:
+                    layers[labels[label]] = image
+        return layers
+
+    def touch(self, image):
+        """Record that a layer has been used"""
+        labels = dict((image.extra or {}).get('labels') or {})
+        labels[USED_LABEL] = str(int(time.time()))
+        self.driver.ex_set_image_labels(image, labels)
+
+    def evict(self, keep=(), images=None):
+        """Delete the least recently used intermediate layers beyond max_layers
+
+        Args:
+            keep: Fingerprints whose layers are never deleted, such as those of the current build
+            images: The images from list_images(), listed if None
+        """
+        layers = []
+        kept = 0
+        for image in self.list_images() if images is None else images:
+            labels = (image.extra or {}).get('labels') or {}
+            if LAYER_LABEL not in labels:
+                continue
+            if labels[LAYER_LABEL] in keep:
+                kept += 1
+            else:
+                layers.append((int(labels.get(USED_LABEL, 0)), image))
+        layers.sort(key=lambda layer: layer[0], reverse=True)
+        evicted = [image for used, image in layers[max(0, self.max_layers - kept):]]
+        for image in evicted:
+            logger.info(f'Evicting the build layer image {image.name}')
+            try:
+                self.driver.ex_delete_image(image)
+            except Exception:
+                logger.exception(f'Failed to delete the build layer image {image.name}')
+        return evicted
+
+
+class LayeredBuild(object):
+    """Build an image from steps, starting from the deepest cached layer
+
+    Attributes:
+        driver: The libcloud GCE driver
+        steps: The BuildSteps in order
+        base_image: The image, or image name, the first step runs on
+        layer_prefix: The name prefix of the layer images
+        cache: The LayerCache
+        node_class: The TemporyGCENode class the build node is created with
+        node_kwargs: The node manager keyword arguments
+    """
+
+    def __init__(self, driver, steps, base_image, layer_prefix='aplinux-layer-', max_layers=20, cache=None,
+                 node_class=TemporyGCENode, **kwargs):
+        self.driver = driver
+        self.steps = list(steps)
+        self.base_image = base_image
+        self.layer_prefix = layer_prefix
+        self.cache = cache or LayerCache(driver, max_layers=max_layers)
+        self.node_class = node_class
+        self.node_kwargs = kwargs
+
+    def resolve_base_image(self):
+        """Return the base image, a name is resolved to the concrete image it currently refers to
+
+        Raises:
+            ValueError: If no image matches the base image name
+        """
+        if not isinstance(self.base_image, str):
+            return self.base_image
+        image = (self.node_kwargs.get('catalog') or self.driver).ex_get_image(self.base_image)
+        if image is None:
+            raise ValueError(f'No image matches the base image {self.base_image}')
+        return image
+
+    def fingerprints(self, base_image=None):
+        """Return the fingerprint of each step
+
+        The first step is fingerprinted from the name of the concrete base image, so that a new
+        image in the base image's family starts a new chain of layers.
+
+        Args:
+            base_image: The image from resolve_base_image(), resolved if None
+        """
+        fingerprints = []
+        parent = (base_image or self.resolve_base_image()).name
+        for step in self.steps:
+            parent = fingerprint(step, parent)
+            fingerprints.append(parent)
+        return fingerprints
+
+    def plan(self, images=None, base_image=None):
+        """Return (the index of the first step to run, the image to run it on)
+
+        Args:
+            images: The images from LayerCache.list_images(), listed if None
+            base_image: The image from resolve_base_image(), resolved if None
+        """
+        base_image = base_image or self.resolve_base_image()
+        layers = self.cache.layers(images)
+        fingerprints = self.fingerprints(base_image)
+        for index in reversed(range(len(self.steps))):
+            image = layers.get(fingerprints[index])
+            if image is not None:
+                return index + 1, image
+        return 0, base_image
+
+    def build(self, image_name):
+        """Run the steps which are not cached and create the image
+
+        If every step is cached then the image built from them is returned and no node is created.
+
+        Returns:
+            The built image
+        """
+        base_image = self.resolve_base_image()
+        images = list(self.cache.list_images())
+        fingerprints = self.fingerprints(base_image)
+        start, image = self.plan(images, base_image)
+        if start > 0:
+            logger.info(f'Resuming the build after step {self.steps[start - 1].name} from {image.name}')
+            self.cache.touch(image)
+        if start == len(self.steps):
+            logger.info(f'Every build step is cached in {image.name}')
+            return image
+
+        with self.node_class(self.driver, image=image, **self.node_kwargs) as nm:
+            for index in range(start, len(self.steps)):
+                step = self.steps[index]
+                logger.info(f'Running build step {step.name}')
+                with nm.span('build_step', step=step.name):
+                    step.function(nm.fabric)
+                labels = {USED_LABEL: str(int(time.time()))}
+                if index == len(self.steps) - 1:
+                    labels[BUILD_LABEL] = fingerprints[index]
+                    image = nm.stop_and_create_image(image_name, labels=labels)
+                elif step.snapshot:
+                    labels[LAYER_LABEL] = fingerprints[index]
+                    images.append(nm.stop_and_create_image(f'{self.layer_prefix}{fingerprints[index]}',
+                                                           labels=labels))
+                    nm.start_node()
+        self.cache.evict(keep=fingerprints, images=images)
+        return image
@@ -0,0 +1,150 @@
+# -*- coding:utf-8 -*-
+
+from . import build_cache
+from libcloud.compute.base import NodeImage
+from unittest import TestCase
+from unittest.mock import call
+from unittest.mock import MagicMock
+
+import os
+import tempfile
+
+
+def install_packages(connection):
+    connection.run('apt-get install -y nginx')
+
+
+def install_app(connection):
+    connection.run('tar -xzf app.tar.gz')
+
+
+def configure(connection):
+    connection.run('systemctl enable app')
+
+
+def make_image(name, **labels):
+    return NodeImage(id=name, name=name, driver=None, extra={'labels': labels})
+
+
+class TestFingerprint(TestCase):
+
+    def test_fingerprint(self):
+        step = build_cache.BuildStep('packages', install_packages, {'packages': ['nginx']})
+        fingerprint = build_cache.fingerprint(step, 'debian-9')
+        self.assertEqual(len(fingerprint), build_cache.FINGERPRINT_LENGTH)
+        self.assertEqual(build_cache.fingerprint(step, 'debian-9'), fingerprint)
+        self.assertNotEqual(build_cache.fingerprint(step, 'debian-10'), fingerprint)
+        self.assertNotEqual(build_cache.fingerprint(step._replace(inputs={'packages': ['apache']}), 'debian-9'),
+                            fingerprint)
+        self.assertNotEqual(build_cache.fingerprint(step._replace(function=install_app), 'debian-9'), fingerprint)
+        self.assertIsNotNone(build_cache.fingerprint(step._replace(function=print), 'debian-9'))
+
+    def test_file_digest(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'app.tar.gz')
+            with open(path, 'wb') as fout:
+                fout.write(b'app')
+            digest = build_cache.file_digest(path)
+            with open(path, 'wb') as fout:
+                fout.write(b'app 2')
+            self.assertNotEqual(build_cache.file_digest(path), digest)
+
+
+class TestLayerCache(TestCase):
+
+    def test_layers(self):
+        driver = MagicMock()
+        layer, published = make_image('layer', **{'aplinux-layer': 'a'}), make_image('app', **{'aplinux-build': 'b'})
+        driver.list_images.return_value = [layer, published, make_image('debian-9'), NodeImage('x', 'x', None)]
+        self.assertEqual(build_cache.LayerCache(driver).layers(), {'a': layer, 'b': published})
+        driver.list_images.assert_called_once_with(ex_project=driver.project)
+
+    def test_evict(self):
+        driver = MagicMock()
+        images = [make_image(f'layer-{i}', **{'aplinux-layer': str(i), 'aplinux-layer-used': str(i)})
+                  for i in range(5)]
+        driver.list_images.return_value = images + [make_image('app', **{'aplinux-build': 'b'})]
+        evicted = build_cache.LayerCache(driver, max_layers=3).evict(keep=['0'])
+        self.assertEqual(evicted, [images[2], images[1]])
+        driver.ex_delete_image.assert_has_calls([call(images[2]), call(images[1])])
+
+
+class TestLayeredBuild(TestCase):
+
+    def setUp(self):
+        self.driver = MagicMock()
+        self.driver.list_images.return_value = []
+        self.base_image = make_image('debian-9-stretch-v20190101')
+        self.driver.ex_get_image.return_value = self.base_image
+        self.node_class = MagicMock()
+        self.nm = self.node_class.return_value.__enter__.return_value
+        self.nm.stop_and_create_image.side_effect = lambda name, labels: make_image(name, **labels)
+        self.steps = [build_cache.BuildStep('packages', install_packages),
+                      build_cache.BuildStep('app', install_app, {'app': 'v1'}),
+                      build_cache.BuildStep('configure', configure)]
+
+    def layered_build(self, steps=None):
+        return build_cache.LayeredBuild(self.driver, steps or self.steps, 'debian-9', node_class=self.node_class,
+                                        size='small')
+
+    def test_build(self):
+        build = self.layered_build()
+        fingerprints = build.fingerprints()
+        image = build.build('aplinux-1')
+        self.node_class.assert_called_once_with(self.driver, image=self.base_image, size='small')
+        self.assertEqual(self.nm.fabric.run.call_count, 3)
+        names = [args[0] for args, kwargs in self.nm.stop_and_create_image.call_args_list]
+        self.assertEqual(names, [f'aplinux-layer-{fingerprints[0]}', f'aplinux-layer-{fingerprints[1]}', 'aplinux-1'])
+        self.assertEqual(self.nm.start_node.call_count, 2)
+        self.assertEqual(image.name, 'aplinux-1')
+        self.assertEqual(image.extra['labels']['aplinux-build'], fingerprints[2])
+        self.driver.list_images.assert_called_once_with(ex_project=self.driver.project)
+        self.driver.ex_delete_image.assert_not_called()
+
+    def test_resume(self):
+        build = self.layered_build(self.steps[:1] + [self.steps[1]._replace(inputs={'app': 'v2'})] + self.steps[2:])
+        fingerprints = build.fingerprints()
+        layer = make_image('aplinux-layer-0', **{'aplinux-layer': fingerprints[0]})
+        self.driver.list_images.return_value = [layer]
+        build.build('aplinux-2')
+        self.node_class.assert_called_once_with(self.driver, image=layer, size='small')
+        self.assertEqual(self.nm.fabric.run.call_args_list, [call('tar -xzf app.tar.gz'), call('systemctl enable app')])
+        self.driver.ex_set_image_labels.assert_called_once()
+        self.assertIn('aplinux-layer-used', self.driver.ex_set_image_labels.call_args[0][1])
+
+    def test_fully_cached(self):
+        build = self.layered_build()
+        published = make_image('aplinux-1', **{'aplinux-build': build.fingerprints()[-1]})
+        self.driver.list_images.return_value = [published]
+        self.assertIs(build.build('aplinux-2'), published)
+        self.node_class.assert_not_called()
+
+    def test_no_snapshot(self):
+        steps = [self.steps[0]._replace(snapshot=False)] + self.steps[1:]
+        self.layered_build(steps).build('aplinux-1')
+        self.assertEqual(self.nm.stop_and_create_image.call_count, 2)
+        self.assertEqual(self.nm.start_node.call_count, 1)
+
+    def test_base_image_resolved(self):
+        build = self.layered_build()
+        fingerprints = build.fingerprints()
+        self.driver.ex_get_image.assert_called_with('debian-9')
+        self.driver.ex_get_image.return_value = make_image('debian-9-stretch-v20190201')
+        self.assertNotEqual(build.fingerprints()[0], fingerprints[0])
+        catalog = MagicMock()
+        catalog.ex_get_image.return_value = self.base_image
+        build = build_cache.LayeredBuild(self.driver, self.steps, 'debian-9', node_class=self.node_class,
+                                         catalog=catalog)
+        self.assertEqual(build.fingerprints(), fingerprints)
+        catalog.ex_get_image.assert_called_once_with('debian-9')
+        self.driver.ex_get_image.return_value = None
+        with self.assertRaises(ValueError):
+            self.layered_build().build('aplinux-1')
+
+    def test_evict_counts_new_layers(self):
+        build = build_cache.LayeredBuild(self.driver, self.steps, 'debian-9', node_class=self.node_class,
+                                         max_layers=1)
+        old = make_image('aplinux-layer-old', **{'aplinux-layer': 'old', 'aplinux-layer-used': '1'})
+        self.driver.list_images.return_value = [old]
+        build.build('aplinux-1')
+        self.driver.ex_delete_image.assert_called_once_with(old)
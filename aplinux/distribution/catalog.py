@@ -0,0 +1,227 @@
+# -*- coding:utf-8 -*-
+"""A cache of a driver's sizes and images
+
+Every tempory node manager otherwise looks up its image and size with the driver, and
+``list_sizes`` in particular is slow on EC2. A Catalog offers the same lookup methods as
+the driver but keeps the results, indexed by id, name and family, for a time to live.
+It can be persisted to a json file which is shared by every process using the same path::
+
+    >>> catalog = Catalog.for_driver(driver, path='~/.cache/aplinux/gce/catalog.json')
+    >>> with TemporyGCENode(driver, catalog=catalog, image='debian-9', **kwargs) as nm:
+    >>>     nm.stop_and_create_image('aplinux-20190101')  # drops cached lookups such as 'aplinux-'
+
+Images and sizes read back from the file are rebuilt with the driver. Values in their
+extra dicts which json can not represent are stored as strings.
+"""
+
+from libcloud.compute.base import NodeImage
+from libcloud.compute.base import NodeSize
+
+import json
+import logging
+import os
+import threading
+import time
+
+
+logger = logging.getLogger('aplinux.distribution')
+
+
+class Catalog(object):
+    """A thread safe cache of a driver's sizes and images whose entries expire after ttl seconds
+
+    Concurrent lookups of an entry which is missing or expired make a single driver call.
+
+    Attributes:
+        driver: The libcloud driver which is looked up
+        ttl: The maximum age in seconds of a cached entry
+        path: An optional json file the catalog is persisted to and shared through
+        hits: The number of lookups answered from the cache
+        misses: The number of lookups which called the driver
+    """
+
+    _registry = {}
+    _registry_lock = threading.Lock()
+
+    @classmethod
+    def for_driver(cls, driver, ttl=3600, path=None):
+        """Return the catalog shared by every node manager using the given driver"""
+        with cls._registry_lock:
+            catalog = cls._registry.get(driver)
+            if catalog is None:
+                catalog = cls(driver, ttl=ttl, path=path)
+                cls._registry[driver] = catalog
+            return catalog
+
+    def __init__(self, driver, ttl=3600, path=None):
+        """Initialize the catalog
+
+        Args:
+            driver: The libcloud driver to look up
+            ttl: The maximum age in seconds of a cached entry
+            path: An optional json file to persist the catalog to, it is read whenever another
+                process has changed it
+        """
+        self.driver = driver
+        self.ttl = ttl
+        self.path = None if path is None else os.path.expanduser(path)
+        self.hits = 0
+        self.misses = 0
+        self._sizes = None  # (fetched, [NodeSize])
+        self._size_index = {}
+        self._images = {}  # (driver method, key) to (fetched, NodeImage)
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def _fresh(self, fetched):
+        return time.time() - fetched <= self.ttl
+
+    def _set_sizes(self, fetched, sizes):
+        self._sizes = (fetched, sizes)
+        self._size_index = {}
+        for size in reversed(sizes):  # the first size wins a shared name
+            self._size_index[size.name] = size
+            self._size_index[size.id] = size
+
+    def _set_image(self, method, key, fetched, image):
+        self._images[(method, key)] = (fetched, image)
+        if image is not None:
+            if method == 'ex_get_image_from_family':
+                method = 'ex_get_image'  # the image of a family is also a valid ex_get_image result
+            for image_key in (image.id, image.name):
+                self._images[(method, image_key)] = (fetched, image)
+
+    def list_sizes(self):
+        """Return the driver's sizes"""
+        with self._lock:
+            self._reload()
+            if self._sizes is not None and self._fresh(self._sizes[0]):
+                self.hits += 1
+                return list(self._sizes[1])
+            self.misses += 1
+            self._set_sizes(time.time(), self.driver.list_sizes())
+            self._save()
+            return list(self._sizes[1])
+
+    def get_size(self, size_id):
+        """Return the size with the given id or name, or None if the driver has no such size"""
+        self.list_sizes()
+        with self._lock:
+            return self._size_index.get(size_id)
+
+    def _image(self, method, key):
+        with self._lock:
+            self._reload()
+            entry = self._images.get((method, key))
+            if entry is not None and self._fresh(entry[0]):
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            image = getattr(self.driver, method)(key)
+            self._set_image(method, key, time.time(), image)
+            self._save()
+            return image
+
+    def get_image(self, image_id):
+        """Return the image with the given id, see driver.get_image"""
+        return self._image('get_image', image_id)
+
+    def ex_get_image(self, partial_name):
+        """Return the image with the given name, see GCENodeDriver.ex_get_image"""
+        return self._image('ex_get_image', partial_name)
+
+    def ex_get_image_from_family(self, image_family):
+        """Return the latest image of a family, see GCENodeDriver.ex_get_image_from_family"""
+        return self._image('ex_get_image_from_family', image_family)
+
+    def invalidate(self, image=None, family=None):
+        """Drop cached entries so that they are looked up again
+
+        Call it with the name, and any family, of a newly created image. ex_get_image resolves
+        a partial name to the latest matching image, so every cached ex_get_image lookup whose
+        key is a prefix of the new name is dropped, as are the lookups of its family.
+
+        Args:
+            image: An image id or name whose entries, and the partial name lookups it matches, are
+                dropped. If None, and no family is given, then every entry is dropped
+            family: An image family whose entries are dropped
+        """
+        with self._lock:
+            self._reload()
+            if image is None and family is None:
+                self._sizes = None
+                self._size_index = {}
+                self._images = {}
+            else:
+                def matches(method, key, cached_image):
+                    if image is not None and key == image:
+                        return True
+                    if image is not None and method == 'ex_get_image' and image.startswith(key):
+                        return True
+                    if family is not None and method == 'ex_get_image_from_family' and key == family:
+                        return True
+                    if cached_image is None:
+                        return False
+                    cached_family = (cached_image.extra or {}).get('family')
+                    return ((image is not None and image in (cached_image.id, cached_image.name, cached_family))
+                            or (family is not None and cached_family == family))
+                self._images = {(method, key): (fetched, cached_image)
+                                for (method, key), (fetched, cached_image) in self._images.items()
+                                if not matches(method, key, cached_image)}
+            self._save()
+
+    def _reload(self):
+        """Replace the entries with those of the file if another process has changed it. Called with the lock held"""
+        if self.path is None:
+            return
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path) as fin:
+                data = json.load(fin)
+        except (OSError, ValueError) as err:
+            logger.warning(f'Ignoring the unreadable catalog {self.path}: {err!r}')
+            return
+        self._mtime = mtime
+        self._sizes = None
+        self._size_index = {}
+        self._images = {}
+        if data.get('sizes') is not None:
+            sizes = [NodeSize(driver=self.driver, **size) for size in data['sizes']['sizes']]
+            self._set_sizes(data['sizes']['fetched'], sizes)
+        for entry in data.get('images', []):
+            image = entry['image']
+            if image is not None:
+                image = NodeImage(driver=self.driver, **image)
+            self._images[(entry['method'], entry['key'])] = (entry['fetched'], image)
+
+    def _save(self):
+        """Atomically write the entries to the file. Called with the lock held"""
+        if self.path is None:
+            return
+        sizes = None
+        if self._sizes is not None:
+            sizes = {'fetched': self._sizes[0],
+                     'sizes': [{'id': size.id, 'name': size.name, 'ram': size.ram, 'disk': size.disk,
+                                'bandwidth': size.bandwidth, 'price': size.price, 'extra': size.extra}
+                               for size in self._sizes[1]]}
+        images = [{'method': method,
+                   'key': key,
+                   'fetched': fetched,
+                   'image': None if image is None else {'id': image.id, 'name': image.name, 'extra': image.extra}}
+                  for (method, key), (fetched, image) in self._images.items()]
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f'{self.path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(temp_path, 'w') as fout:
+                json.dump({'sizes': sizes, 'images': images}, fout, default=str)
+            os.replace(temp_path, self.path)
+            self._mtime = os.stat(self.path).st_mtime_ns
+        except OSError as err:
+            logger.warning(f'Failed to write the catalog {self.path}: {err!r}')
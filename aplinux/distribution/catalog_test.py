@@ -0,0 +1,136 @@
+# -*- coding:utf-8 -*-
+
+from . import catalog
+from libcloud.compute.base import NodeImage
+from libcloud.compute.base import NodeSize
+from unittest import TestCase
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+import os
+import tempfile
+
+
+def make_driver():
+    driver = MagicMock()
+    driver.list_sizes.return_value = [NodeSize('t3.micro', 'micro', 1024, 8, None, 0.01, driver),
+                                      NodeSize('t3.large', 'large', 8192, 8, None, 0.08, driver)]
+    driver.get_image.side_effect = lambda image_id: NodeImage(image_id, f'name-{image_id}', driver)
+    driver.ex_get_image.side_effect = lambda name: NodeImage(f'id-{name}', name, driver)
+    driver.ex_get_image_from_family.side_effect = lambda family: NodeImage(f'id-{family}-2', f'{family}-2', driver,
+                                                                           extra={'family': family})
+    return driver
+
+
+class TestCatalog(TestCase):
+
+    def setUp(self):
+        self.driver = make_driver()
+        self.catalog = catalog.Catalog(self.driver)
+
+    def test_sizes(self):
+        self.assertEqual([size.id for size in self.catalog.list_sizes()], ['t3.micro', 't3.large'])
+        self.assertEqual(self.catalog.get_size('t3.large').ram, 8192)
+        self.assertEqual(self.catalog.get_size('micro').id, 't3.micro')
+        self.assertIsNone(self.catalog.get_size('t3.huge'))
+        self.driver.list_sizes.assert_called_once_with()
+        self.assertEqual((self.catalog.hits, self.catalog.misses), (3, 1))
+
+    def test_images(self):
+        image = self.catalog.get_image('ami-1')
+        self.assertIs(self.catalog.get_image('ami-1'), image)
+        self.driver.get_image.assert_called_once_with('ami-1')
+
+        image = self.catalog.ex_get_image_from_family('debian')
+        self.assertEqual(image.name, 'debian-2')
+        self.assertIs(self.catalog.ex_get_image('debian-2'), image)
+        self.assertIs(self.catalog.ex_get_image('id-debian-2'), image)
+        self.driver.ex_get_image.assert_not_called()
+
+    def test_ttl(self):
+        with patch('time.time', return_value=1000):
+            self.catalog.list_sizes()
+            self.catalog.ex_get_image('debian-1')
+        with patch('time.time', return_value=1000 + self.catalog.ttl + 1):
+            self.catalog.list_sizes()
+            self.catalog.ex_get_image('debian-1')
+        self.assertEqual(self.driver.list_sizes.call_count, 2)
+        self.assertEqual(self.driver.ex_get_image.call_count, 2)
+
+    def test_invalidate(self):
+        self.catalog.ex_get_image_from_family('debian')
+        self.catalog.ex_get_image('ubuntu')
+        self.catalog.list_sizes()
+        self.catalog.invalidate('debian')
+        self.catalog.ex_get_image_from_family('debian')
+        self.catalog.ex_get_image('ubuntu')
+        self.assertEqual(self.driver.ex_get_image_from_family.call_count, 2)
+        self.assertEqual(self.driver.ex_get_image.call_count, 1)
+        self.catalog.invalidate()
+        self.catalog.ex_get_image('ubuntu')
+        self.catalog.list_sizes()
+        self.assertEqual(self.driver.ex_get_image.call_count, 2)
+        self.assertEqual(self.driver.list_sizes.call_count, 2)
+
+    def test_invalidate_prefix(self):
+        images = {'aplinux-': 'aplinux-20260101'}
+        self.driver.ex_get_image.side_effect = lambda name: NodeImage(f'id-{images.get(name, name)}',
+                                                                      images.get(name, name), self.driver)
+        self.assertEqual(self.catalog.ex_get_image('aplinux-').name, 'aplinux-20260101')
+        self.catalog.ex_get_image('debian-9')
+        images['aplinux-'] = 'aplinux-20260102'
+        self.catalog.invalidate('aplinux-20260102')
+        self.assertEqual(self.catalog.ex_get_image('aplinux-').name, 'aplinux-20260102')
+        self.catalog.ex_get_image('debian-9')
+        self.assertEqual(self.driver.ex_get_image.call_count, 3)
+
+    def test_invalidate_family(self):
+        self.catalog.ex_get_image_from_family('debian')
+        self.catalog.ex_get_image('ubuntu')
+        self.catalog.invalidate(family='debian')
+        self.catalog.ex_get_image_from_family('debian')
+        self.catalog.ex_get_image('ubuntu')
+        self.assertEqual(self.driver.ex_get_image_from_family.call_count, 2)
+        self.assertEqual(self.driver.ex_get_image.call_count, 1)
+
+    def test_for_driver(self):
+        driver = make_driver()
+        self.assertIs(catalog.Catalog.for_driver(driver), catalog.Catalog.for_driver(driver))
+        self.assertIsNot(catalog.Catalog.for_driver(driver), catalog.Catalog.for_driver(make_driver()))
+
+
+class TestCatalogPersistence(TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.path = os.path.join(temp_dir.name, 'cache', 'catalog.json')
+
+    def test_shared(self):
+        first = catalog.Catalog(make_driver(), path=self.path)
+        first.list_sizes()
+        first.get_image('ami-1')
+        self.assertTrue(os.path.exists(self.path))
+
+        driver = make_driver()
+        second = catalog.Catalog(driver, path=self.path)
+        self.assertEqual(second.get_size('t3.large').price, 0.08)
+        image = second.get_image('ami-1')
+        self.assertEqual(image.name, 'name-ami-1')
+        self.assertIs(image.driver, driver)
+        driver.list_sizes.assert_not_called()
+        driver.get_image.assert_not_called()
+
+        # an invalidation by one process is seen by the other
+        second.invalidate('ami-1')
+        os.utime(self.path, ns=(0, 0))  # the mtime may not have ticked since the last write
+        first.get_image('ami-1')
+        self.assertEqual(first.driver.get_image.call_count, 2)
+
+    def test_unreadable(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as fout:
+            fout.write('not json')
+        driver = make_driver()
+        self.assertEqual(catalog.Catalog(driver, path=self.path).get_size('t3.micro').id, 't3.micro')
+        driver.list_sizes.assert_called_once_with()
@@ -1,12 +1,247 @@
 # -*- coding:utf-8 -*-
 
+from .output_sink import OutputTail
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextlib import ExitStack
+from contextlib import nullcontext
 from io import BytesIO
 from fabric import *
 from scp import SCPClient
-from uuid import uuid4
+
+import hashlib
+import os
+import posixpath
+import re
+import select
+import shlex
+import stat
+import tarfile
+import uuid
+
+
+class CommandError(Exception):
+    """A command run over a channel exited with a non zero status"""
+
+    stderr_tail = 1000  # the number of characters of stderr included in the message
+
+    def __init__(self, result):
+        message = f'Command exited with status {result.exited}: {result.command}'
+        stderr = (result.stderr or '').strip()
+        if stderr:
+            message = f'{message}\n{stderr[-self.stderr_tail:]}'
+        super().__init__(message)
+        self.result = result
+
+
+SyncResult = namedtuple('SyncResult', ['uploaded', 'deleted', 'unchanged'])
+
+
+def file_sha256(path):
+    """Return the sha256 hex digest of a local file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fin:
+        for chunk in iter(lambda: fin.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ChannelResult(object):
+    """The result of a command run on its own channel
+
+    Attributes:
+        command: The command which was run
+        stdout: The captured standard output
+        stderr: The captured standard error
+        exited: The exit status
+    """
+
+    def __init__(self, command, stdout, stderr, exited):
+        self.command = command
+        self.stdout = stdout
+        self.stderr = stderr
+        self.exited = exited
+
+    @property
+    def ok(self):
+        return self.exited == 0
+
+    def __repr__(self):
+        return f'<ChannelResult exited={self.exited} command={self.command!r}>'
+
+
+class CommandBatch(object):
+    """Run and sudo calls recorded to be run remotely as a single script
+
+    Each call returns a ChannelResult which is filled in once the batch has run. Every
+    command is run by the login shell, as a normal run would be, with its output framed by
+    marker lines so that the output and exit status of each command can be separated again.
+    As with run, a command is run in the directories of the connection's enclosing ``cd``
+    contexts, after the commands of its ``prefix`` contexts and with the run.env config
+    exported.
+
+    Attributes:
+        connection: The ConnectionWithSCP the batch is run on
+        user: If not None then run records commands run as this user with sudo
+        commands: A list of (command, warn, result) in the order they were recorded
+    """
+
+    def __init__(self, connection, user=None):
+        self.connection = connection
+        self.user = user
+        self.commands = []
+        self.marker = f'batch-{uuid.uuid4().hex}'
+
+    def _record(self, command, warn):
+        result = ChannelResult(command, None, None, None)
+        self.commands.append((command, warn, result))
+        return result
+
+    def run(self, command, warn=False, env=None):
+        """Record a command, returning its ChannelResult which is filled in when the batch runs
+
+        Args:
+            command: The command to run
+            warn: If False then a non zero exit status stops the batch and raises a CommandError
+            env: An optional dict of environment variables for the command, added to run.env
+        """
+        if self.user is not None:
+            return self.sudo(command, user=self.user, warn=warn, env=env)
+        return self._record(self.connection._prefix(command, env), warn)
+
+    def sudo(self, command, user=None, warn=False, env=None):
+        """Record a command run with sudo, which must not require a password
+
+        The command is run by a shell within sudo, after the cd and prefix contexts and with the
+        environment exported, so that compound commands, pipes and redirects are run with sudo too.
+        """
+        user_flags = f'-H -u {shlex.quote(user)} ' if user else ''
+        return self._record(f'sudo -n {user_flags}sh -c {shlex.quote(self.connection._prefix(command, env))}', warn)
+
+    @property
+    def script(self):
+        """The shell script which runs every recorded command"""
+        lines = []
+        for index, (command, warn, result) in enumerate(self.commands):
+            start = f"printf '\\n{self.marker} start {index}\\n'"
+            end = f"printf '\\n{self.marker} end {index} %d\\n' $s"
+            lines += [f'{start}; {start} >&2',
+                      f'"${{SHELL:-sh}}" -c {shlex.quote(command)} < /dev/null; s=$?',
+                      f'{end}; {end} >&2']
+            if not warn:
+                lines.append('[ $s -eq 0 ] || exit $s')
+        return '\n'.join(lines)
+
+    def _split(self, output):
+        """Return a dict of command index to (output, exit status) from framed output"""
+        pattern = re.compile(rf'{self.marker} start (\d+)\n(.*?)\n{self.marker} end \1 (\d+)\n', re.S)
+        return {int(match.group(1)): (match.group(2), int(match.group(3))) for match in pattern.finditer(output)}
+
+    def execute(self):
+        """Run the recorded commands and fill in their results
+
+        Commands after one which failed without warn are not run and keep an exit status of None.
+
+        Raises:
+            CommandError: With the result of the first command which failed without warn
+        """
+        if not self.commands:
+            return
+        script = self.script
+        commands, self.commands = self.commands, []
+        batch_result = self.connection._exec_channel(script, warn=True)
+        stdout = self._split(batch_result.stdout)
+        stderr = self._split(batch_result.stderr)
+        for index, (command, warn, result) in enumerate(commands):
+            if index in stdout:
+                result.stdout, result.exited = stdout[index]
+                result.stderr = stderr.get(index, ('', None))[0]
+                if not result.ok and not warn:
+                    raise CommandError(result)
+        if not stdout and batch_result.exited != 0:
+            raise CommandError(batch_result)  # the script failed before any command was run
+
+
+TAR_COMPRESSION_FLAGS = {None: '', 'gzip': '-z', 'zstd': '--zstd'}
+
+
+def tar_compression_flag(compression):
+    """Return the tar command line flag of a compression, raising ValueError if it is not supported"""
+    if compression not in TAR_COMPRESSION_FLAGS:
+        raise ValueError(f'Unsupported compression: {compression}')
+    return TAR_COMPRESSION_FLAGS[compression]
+
+
+class ChannelWriter(object):
+    """A write only binary file object over a channel's stdin
+
+    Attributes:
+        channel: The paramiko channel
+        error: The error raised by the channel if a write failed, such as when the command exited early
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.error = None
+
+    def write(self, data):
+        try:
+            self.channel.sendall(data)
+        except OSError as err:
+            self.error = err
+            raise
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+class ChannelReader(object):
+    """A read only binary file object over a channel's stdout"""
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.channel.recv(32768), b''))
+        return self.channel.recv(size)
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError('zstd compression requires the zstandard package') from None
+    return zstandard
+
+
+@contextmanager
+def tar_stream(fileobj, mode, compression='gzip'):
+    """Open a streaming tarfile over fileobj with mode 'r' or 'w' and the given compression"""
+    tar_compression_flag(compression)
+    if compression == 'zstd':
+        zstandard = _zstandard()
+        if mode == 'w':
+            with zstandard.ZstdCompressor().stream_writer(fileobj, closefd=False) as zfout:
+                with tarfile.open(fileobj=zfout, mode='w|') as tar:
+                    yield tar
+        else:
+            with zstandard.ZstdDecompressor().stream_reader(fileobj, closefd=False) as zfin:
+                with tarfile.open(fileobj=zfin, mode='r|') as tar:
+                    yield tar
+    else:
+        suffix = 'gz' if compression == 'gzip' else ''
+        with tarfile.open(fileobj=fileobj, mode=f'{mode}|{suffix}') as tar:
+            yield tar
+
 
 class ConnectionWithSCP(Connection):
 
+    channel_chunk_size = 32768
+    max_script_length = 65536  # of the scripts sync and sudo_write_many run, well below the 128KiB argument limit
+
     @property
     def scp(self):
         self.open()  # make sure we have an open connection
@@ -27,10 +262,496 @@ class ConnectionWithSCP(Connection):
         else:
             self.scp.put(src, dest)
 
+    def get(self, src, dest, recursive=False):
+        """Download a remote file, or a directory if recursive, over scp
+
+        See put for why scp is used over sftp. Each call uses its own scp channel so several
+        downloads can run at once over the same connection.
+        """
+        self.scp.get(src, dest, recursive=recursive)
+
+    def _prefix(self, command, env=None):
+        """Prefix a command as fabric does with the cd and prefix contexts, and export run.env and env"""
+        command = self._prefix_commands(command)
+        env = {**self.config.run.env, **(env or {})}
+        if env:
+            exports = ' '.join(f'{name}={shlex.quote(str(value))}' for name, value in sorted(env.items()))
+            command = f'export {exports} && {command}'
+        return command
+
+    @contextmanager
+    def _without_contexts(self):
+        """Clear the cd and prefix contexts for fabric's run and sudo of a command which already applies them"""
+        prefixes, cwds = self.command_prefixes, self.command_cwds
+        self._set(command_prefixes=[], command_cwds=[])
+        try:
+            yield
+        finally:
+            self._set(command_prefixes=prefixes, command_cwds=cwds)
+
+    def _read_channel(self, channel, out, err):
+        """Pass stdout and stderr chunks to out and err until the command exits"""
+        channel.fileno()  # create the pipe used by select for both stdout and stderr
+        while True:
+            if channel.recv_ready():
+                out(channel.recv(self.channel_chunk_size))
+            elif channel.recv_stderr_ready():
+                err(channel.recv_stderr(self.channel_chunk_size))
+            elif channel.exit_status_ready():
+                break
+            else:
+                select.select([channel], [], [], 1)
+
+        # output which arrived along with the exit status
+        while channel.recv_ready():
+            out(channel.recv(self.channel_chunk_size))
+        while channel.recv_stderr_ready():
+            err(channel.recv_stderr(self.channel_chunk_size))
+        return channel.recv_exit_status()
+
+    def _check_channel(self, channel, command, stdout=''):
+        """Wait for a channel's command to exit, raising CommandError on a non zero exit status"""
+        stderr = []
+        exited = self._read_channel(channel, lambda data: None, stderr.append)
+        result = ChannelResult(command, stdout, b''.join(stderr).decode('utf-8', 'replace'), exited)
+        if not result.ok:
+            raise CommandError(result)
+        return result
+
+    def put_tar(self, paths, remote_dir, compression='gzip', sudo=False):
+        """Upload files and directories as a single compressed tar stream
+
+        The archive is built and compressed on the fly while it is piped into ``tar -x`` on the
+        node, so it is never held in memory or written to local disk. Each path is extracted
+        into remote_dir under its base name.
+
+        Args:
+            paths: The local files and directories to upload
+            remote_dir: The remote directory, created if it does not exist
+            compression: One of None, 'gzip' or 'zstd' (requires the zstandard package)
+            sudo: If True then extract with passwordless sudo
+        """
+        quoted_dir = shlex.quote(remote_dir)
+        script = f'mkdir -p {quoted_dir} && tar -x {tar_compression_flag(compression)} -f - -C {quoted_dir}'
+        command = f'{"sudo -n " if sudo else ""}sh -c {shlex.quote(script)}'
+        if compression == 'zstd':
+            _zstandard()
+        self.open()
+        channel = self.transport.open_session()
+        try:
+            channel.exec_command(command)
+            writer = ChannelWriter(channel)
+            try:
+                with tar_stream(writer, 'w', compression) as tar:
+                    for path in paths:
+                        tar.add(path, arcname=os.path.basename(os.path.normpath(path)))
+            except OSError:
+                if writer.error is None:
+                    raise  # a local error such as a missing path, closing the channel ends the remote tar
+                self._check_channel(channel, command)  # the remote tar exited early, raise its error
+                raise
+            channel.shutdown_write()
+            return self._check_channel(channel, command)
+        finally:
+            channel.close()
+
+    def get_tar(self, remote_paths, local_dir, compression='gzip', sudo=False):
+        """Download remote files and directories as a single compressed tar stream
+
+        The archive is extracted as it is received. Each remote path is extracted into
+        local_dir under its base name.
+
+        Args:
+            remote_paths: The remote files and directories to download
+            local_dir: The local directory to extract into
+            compression: One of None, 'gzip' or 'zstd' (requires the zstandard package)
+            sudo: If True then archive with passwordless sudo
+        """
+        members = ' '.join(f'-C {shlex.quote(posixpath.dirname(path) or ".")} '
+                           f'{shlex.quote(posixpath.basename(path))}'
+                           for path in (posixpath.normpath(path) for path in remote_paths))
+        command = f'{"sudo -n " if sudo else ""}tar -c {tar_compression_flag(compression)} -f - {members}'
+        if compression == 'zstd':
+            _zstandard()
+        extract_kwargs = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
+        os.makedirs(local_dir, exist_ok=True)
+        self.open()
+        channel = self.transport.open_session()
+        try:
+            channel.exec_command(command)
+            try:
+                with tar_stream(ChannelReader(channel), 'r', compression) as tar:
+                    tar.extractall(local_dir, **extract_kwargs)
+            except (tarfile.TarError, EOFError, OSError):
+                self._check_channel(channel, command)  # raise the remote error if there is one
+                raise
+            return self._check_channel(channel, command)
+        finally:
+            channel.close()
+
+    def _send_stdin(self, channel, sources, out, err):
+        """Stream binary file objects into the channel's stdin, passing on its output meanwhile
+
+        Output is read as the input is sent, so that neither side blocks once its window is full.
+        Sending stops if the command exits, or closes its stdin, before reading all of its input.
+        Its exit status and stderr are then left for the caller to read.
+        """
+        channel.fileno()  # create the pipe used by select
+        try:
+            for fin in sources:
+                for chunk in iter(lambda: fin.read(self.channel_chunk_size), b''):
+                    while chunk:
+                        if channel.recv_ready():
+                            out(channel.recv(self.channel_chunk_size))
+                        elif channel.recv_stderr_ready():
+                            err(channel.recv_stderr(self.channel_chunk_size))
+                        elif channel.exit_status_ready():
+                            return
+                        elif channel.send_ready():
+                            chunk = chunk[channel.send(chunk):]
+                        else:
+                            select.select([channel], [], [], 0.01)
+            channel.shutdown_write()
+        except OSError:
+            pass  # the command closed its stdin, its exit status tells why
+
+    def exec_command(self, command, warn=False, out=None, err=None, stdin=None, env=None):
+        """Run a command on a new channel of the open transport
+
+        Unlike run this is safe to call from several threads at once, each call uses its own
+        channel multiplexed over the same ssh connection. As with run, the command is run after
+        the cd and prefix contexts and with run.env exported.
+
+        Args:
+            command: The command to run
+            warn: If False then raise a CommandError on a non zero exit status
+            out: An optional callable passed each stdout chunk as bytes instead of capturing it
+            err: An optional callable passed each stderr chunk as bytes instead of capturing it
+            stdin: An optional binary file object, or list of them, streamed to the command's stdin
+            env: An optional dict of environment variables for the command, added to run.env
+
+        Returns:
+            ChannelResult
+        """
+        return self._exec_channel(self._prefix(command, env), warn=warn, out=out, err=err, stdin=stdin)
+
+    def _exec_channel(self, command, warn=False, out=None, err=None, stdin=None):
+        """Run a command on a new channel as it is given, without the contexts, see exec_command"""
+        self.open()  # make sure we have an open connection
+        stdout = []
+        stderr = []
+        out = out or stdout.append
+        err = err or stderr.append
+        channel = self.transport.open_session()
+        try:
+            channel.exec_command(command)
+            if stdin is not None:
+                self._send_stdin(channel, stdin if isinstance(stdin, (list, tuple)) else [stdin], out, err)
+            exited = self._read_channel(channel, out, err)
+        finally:
+            channel.close()
+        result = ChannelResult(command,
+                               b''.join(stdout).decode('utf-8', 'replace'),
+                               b''.join(stderr).decode('utf-8', 'replace'),
+                               exited)
+        if not warn and not result.ok:
+            raise CommandError(result)
+        return result
+
+    def stream(self, command, sink=None, warn=False, tail_bytes=65536, stdin=None, env=None):
+        """Run a command passing its output to a sink as it arrives rather than buffering it
+
+        Only the last tail_bytes of stdout and stderr are kept in memory, so commands with a
+        very large output can be run without the memory use growing with the output. As with
+        run, the command is run after the cd and prefix contexts and with run.env exported.
+
+        Args:
+            command: The command to run
+            sink: An optional callable passed the stream name, 'stdout' or 'stderr', and each chunk
+                of bytes. For example a RotatingLogSink
+            warn: If False then raise a CommandError on a non zero exit status
+            tail_bytes: The number of bytes of stdout and stderr kept for the result
+            stdin: As for exec_command
+            env: An optional dict of environment variables for the command, added to run.env
+
+        Returns:
+            ChannelResult with the tails of stdout and stderr
+        """
+        return self._stream(self._prefix(command, env), sink=sink, warn=warn, tail_bytes=tail_bytes, stdin=stdin)
+
+    def _stream(self, command, sink=None, warn=False, tail_bytes=65536, stdin=None):
+        """Stream a command which is run as given, without the contexts"""
+        tail = OutputTail(sink, tail_bytes)
+        result = self._exec_channel(command, warn=True, out=tail.out, err=tail.err, stdin=stdin)
+        result.stdout = tail.stdout.getvalue().decode('utf-8', 'replace')
+        result.stderr = tail.stderr.getvalue().decode('utf-8', 'replace')
+        if not warn and not result.ok:
+            raise CommandError(result)
+        return result
+
+    def run_concurrent(self, commands, max_channels=4, warn=False):
+        """Run several commands at once on separate channels of the same connection
+
+        The ssh server limits the number of sessions per connection (MaxSessions is 10 by
+        default in OpenSSH) so max_channels should be kept below that.
+
+        The commands are prefixed with the cd and prefix contexts and run.env when they are
+        submitted, as with exec_command.
+
+        Args:
+            commands: An iterable of command strings
+            max_channels: The maximum number of commands run at once
+            warn: If False then the future of a command with a non zero exit status raises CommandError
+
+        Returns:
+            A list of concurrent.futures.Future of ChannelResult in the order of commands
+        """
+        return self._run_concurrent([self._prefix(command) for command in commands], max_channels, warn)
+
+    def _run_concurrent(self, commands, max_channels=4, warn=False):
+        """Run several commands as they are given, without the contexts, see run_concurrent"""
+        self.open()
+        executor = ThreadPoolExecutor(max_workers=max_channels)
+        futures = [executor.submit(self._exec_channel, command, warn=warn) for command in commands]
+        executor.shutdown(wait=False)
+        return futures
+
+    @contextmanager
+    def batch(self, user=None):
+        """Record run and sudo calls and run them as one remote script when the context exits
+
+        This saves a channel round trip per command. Output is only available once the batch
+        has run, and a failing command raises its CommandError when the context exits::
+
+            >>> with nm.fabric.batch() as batch:
+            >>>     batch.sudo('apt-get update')
+            >>>     version = batch.run('uname -r')
+            >>> version.stdout
+
+        Nothing is run if the body of the context raises an exception. If user is given then run
+        records commands run as that user with passwordless sudo.
+        """
+        batch = CommandBatch(self, user=user)
+        yield batch
+        batch.execute()
+
+    def _open_source(self, src):
+        """Return a context manager of a binary file object for a path or file object"""
+        if hasattr(src, 'read'):
+            return nullcontext(src)
+        return open(src, 'rb')
+
+    def _source_size(self, src):
+        """Return the number of bytes which remain to be read from a path or file object"""
+        if hasattr(src, 'read'):
+            position = src.tell()
+            size = src.seek(0, os.SEEK_END) - position
+            src.seek(position)
+            return size
+        return os.path.getsize(src)
+
+    _passwordless_sudo = None
+
+    @property
+    def passwordless_sudo(self):
+        """True if sudo can be used without a password, checked once per connection
+
+        It is False when a sudo password is configured, as the password is then expected to be needed.
+        """
+        if self._passwordless_sudo is None:
+            if self.config.sudo.password:
+                self._passwordless_sudo = False
+            else:
+                self._passwordless_sudo = self._exec_channel('sudo -n true', warn=True).ok
+        return self._passwordless_sudo
+
+    def _sudo_write_staged(self, src, dest):
+        """Upload to a temporary file and copy it over dest with sudo, which may prompt for a password"""
+        temp_dest = f'/tmp/{uuid.uuid4()}'
+        with self._open_source(src) as fin:
+            self.scp.putfo(fin, temp_dest, mode='0600')
+        script = f'cat {shlex.quote(temp_dest)} > {shlex.quote(dest)}; status=$?; rm -f {shlex.quote(temp_dest)}; ' \
+                 f'exit $status'
+        self.sudo(f'sh -c {shlex.quote(script)}')
+
     def sudo_write(self, src, dest):
         """An alternative to put that doesn't modify any existing meta or permissiosn info
         on an existing file
+
+        The content is streamed in chunks straight into ``sudo tee`` so it crosses the network
+        once and is never staged in a temporary file. If sudo needs a password the content is
+        uploaded to a temporary file which is copied over dest with sudo.
+        """
+        if not self.passwordless_sudo:
+            self._sudo_write_staged(src, dest)
+            return
+        with self._open_source(src) as fin:
+            self._exec_channel(f'sudo -n tee {shlex.quote(dest)} > /dev/null', stdin=fin)
+
+    def sudo_write_many(self, files):
+        """Write several files with sudo in a single remote command
+
+        The contents are concatenated onto the command's stdin and split again remotely with
+        GNU ``head -c``, so existing meta and permission info are kept as with sudo_write. If
+        sudo needs a password then each file is written as by sudo_write.
+
+        Args:
+            files: An iterable of (src, dest) where src is a path or binary file object
+        """
+        files = list(files)
+        if not files:
+            return
+        if not self.passwordless_sudo:
+            for src, dest in files:
+                self._sudo_write_staged(src, dest)
+            return
+        self._run_scripts([(f'head -c {self._source_size(src)} > {shlex.quote(dest)}', [src]) for src, dest in files],
+                          sudo=True)
+
+    def _run_script(self, script, sources=(), sudo=False):
+        """Run a shell script remotely with the sources concatenated onto its stdin"""
+        command = f'sh -c {shlex.quote(script)}'
+        if sudo:
+            command = f'sudo -n {command}'
+        with ExitStack() as stack:
+            stdin = [stack.enter_context(self._open_source(src)) for src in sources]
+            return self._exec_channel(command, stdin=stdin or None)
+
+    def _argument_clauses(self, command, arguments):
+        """Return clauses of the command with the arguments split between them so that each fits in a script"""
+        clauses = []
+        for argument in arguments:
+            if clauses and len(clauses[-1]) + 1 + len(argument) <= self.max_script_length // 2:
+                clauses[-1] = f'{clauses[-1]} {argument}'
+            else:
+                clauses.append(f'{command} {argument}')
+        return clauses
+
+    def _run_scripts(self, clauses, preamble=None, sudo=False):
+        """Run (clause, sources) pairs in as few scripts of clauses joined by && as fit in max_script_length
+
+        The script is a single argument of the remote ``sh -c`` and Linux limits the length of one
+        argument to 128KiB, so a long list of clauses is run as several scripts. Each starts with
+        the preamble and the first clause to fail stops the rest.
+        """
+        scripts = []
+        for clause, sources in clauses:
+            if scripts and len(scripts[-1][0]) + 4 + len(clause) <= self.max_script_length:
+                scripts[-1][0] = f'{scripts[-1][0]} && {clause}'
+                scripts[-1][1].extend(sources)
+            else:
+                scripts.append([clause if preamble is None else f'{preamble} && {clause}', list(sources)])
+        for script, sources in scripts:
+            self._run_script(script, sources, sudo=sudo)
+
+    def remote_hashes(self, remote_dir, sudo=False):
+        """Return a dict of relative path to sha256 hex digest for every file under remote_dir"""
+        quoted_dir = shlex.quote(remote_dir)
+        script = f'mkdir -p {quoted_dir} && cd {quoted_dir} && find . -type f -print0 | xargs -0 -r sha256sum'
+        result = self._run_script(script, sudo=sudo)
+        hashes = {}
+        for line in result.stdout.splitlines():
+            digest, path = line.split('  ', 1)
+            hashes[path[2:] if path.startswith('./') else path] = digest
+        return hashes
+
+    def sync(self, local_dir, remote_dir, delete=False, sudo=False):
+        """Make remote_dir match local_dir uploading only new or changed files
+
+        Remote content is hashed in a single command and every changed file is written, and
+        stale files optionally deleted, in a second command, split into several if the script
+        would exceed max_script_length.
+
+        Args:
+            local_dir: The local directory
+            remote_dir: The remote directory which is created if it does not exist
+            delete: If True then remove remote files which do not exist locally
+            sudo: If True then hash and write the remote files with passwordless sudo
+
+        Returns:
+            SyncResult of the relative paths uploaded, deleted and unchanged
         """
-        temp_dest = f'/tmp/{uuid4()}'
-        self.put(src, temp_dest)
-        self.sudo(f"cat '{temp_dest}' > '{dest}'; rm '{temp_dest}'")
\ No newline at end of file
+        local_files = {}
+        for dir_path, dir_names, file_names in os.walk(local_dir):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                relative_path = os.path.relpath(path, local_dir).replace(os.sep, '/')
+                local_files[relative_path] = path
+
+        remote_files = self.remote_hashes(remote_dir, sudo=sudo)
+        uploaded = sorted(relative_path for relative_path, path in local_files.items()
+                          if remote_files.get(relative_path) != file_sha256(path))
+        unchanged = sorted(set(local_files) - set(uploaded))
+        deleted = sorted(set(remote_files) - set(local_files)) if delete else []
+
+        directories = sorted(set(posixpath.dirname(path) for path in uploaded) - {''})
+        clauses = [(clause, []) for clause in self._argument_clauses('mkdir -p --', map(shlex.quote, directories))]
+        for relative_path in uploaded:
+            path = local_files[relative_path]
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+            quoted_path = shlex.quote(relative_path)
+            clauses.append((f'head -c {os.path.getsize(path)} > {quoted_path} && chmod {mode:o} {quoted_path}', [path]))
+        clauses += [(clause, []) for clause in self._argument_clauses('rm -f --', map(shlex.quote, deleted))]
+        if clauses:
+            self._run_scripts(clauses, preamble=f'cd {shlex.quote(remote_dir)}', sudo=sudo)
+        return SyncResult(uploaded, deleted, unchanged)
+
+
+class SudoAsUser(object):
+    """Run commands as another user over an existing connection using ``sudo -u``
+
+    Each command is run by a shell as the user, with the connection's cd and prefix contexts
+    applied within the shell, so that compound commands, pipes and redirects are run as the
+    user too. Methods of the connection which would act as the login user, such as get and
+    sync, raise AttributeError. Other attributes are taken from the wrapped connection.
+    """
+
+    login_user_methods = ('get', 'get_tar', 'put_tar', 'remote_hashes', 'scp', 'sftp', 'sudo_write', 'sudo_write_many',
+                          'sync')
+
+    def __init__(self, connection, user):
+        self.connection = connection
+        self.user = user
+
+    def _command(self, command, env=None):
+        """Return the command run by a shell as the user with passwordless sudo"""
+        return f'sudo -n -H -u {shlex.quote(self.user)} sh -c {shlex.quote(self.connection._prefix(command, env))}'
+
+    def run(self, command, env=None, **kwargs):
+        """Run a command as the user with fabric's sudo, which answers a password prompt"""
+        command = f'sh -c {shlex.quote(self.connection._prefix(command, env))}'
+        with self.connection._without_contexts():  # they are applied within the shell
+            return self.connection.sudo(command, user=self.user, **kwargs)
+
+    def sudo(self, command, **kwargs):
+        return self.connection.sudo(command, **kwargs)
+
+    def exec_command(self, command, env=None, **kwargs):
+        """Run a command as the user on its own channel, see ConnectionWithSCP.exec_command"""
+        return self.connection._exec_channel(self._command(command, env), **kwargs)
+
+    def stream(self, command, env=None, **kwargs):
+        """Stream a command run as the user, see ConnectionWithSCP.stream"""
+        return self.connection._stream(self._command(command, env), **kwargs)
+
+    def run_concurrent(self, commands, **kwargs):
+        """Run several commands as the user at once, see ConnectionWithSCP.run_concurrent"""
+        return self.connection._run_concurrent([self._command(command) for command in commands], **kwargs)
+
+    def batch(self):
+        """Record commands to be run as the user in one remote script, see ConnectionWithSCP.batch"""
+        return self.connection.batch(user=self.user)
+
+    def put(self, src, dest):
+        """Upload a local path or binary file object to dest as the user, a relative dest is in the user's home"""
+        mode = '644' if hasattr(src, 'read') else f'{stat.S_IMODE(os.stat(src).st_mode):o}'
+        quoted_dest = shlex.quote(dest)
+        script = f'cd && cat > {quoted_dest} && chmod {mode} {quoted_dest}'
+        with self.connection._open_source(src) as fin:
+            self.connection._exec_channel(f'sudo -n -H -u {shlex.quote(self.user)} sh -c {shlex.quote(script)}',
+                                          stdin=fin)
+
+    def __getattr__(self, name):
+        if name in self.login_user_methods:
+            raise AttributeError(f'{name} would act as the login user rather than {self.user}, use the connection')
+        return getattr(self.connection, name)
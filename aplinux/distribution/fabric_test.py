@@ -0,0 +1,628 @@
+# -*- coding:utf-8 -*-
+
+from . import fabric
+from io import BytesIO
+from unittest import skipUnless
+from unittest import TestCase
+from unittest.mock import ANY
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+import hashlib
+import importlib.util
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+
+class FakeChannel(object):
+    """A stand in for a paramiko channel which replays output"""
+
+    def __init__(self, stdout=b'', stderr=b'', exited=0, reads_stdin=False):
+        self.stdout = [stdout[i:i + 4] for i in range(0, len(stdout), 4)]
+        self.stderr = [stderr[i:i + 4] for i in range(0, len(stderr), 4)]
+        self.exited = exited
+        self.reads_stdin = reads_stdin
+        self.command = None
+        self.closed = False
+        self.sent = []
+        self.write_shutdown = False
+
+    def fileno(self):
+        return 0
+
+    def exec_command(self, command):
+        self.command = command
+
+    def recv_ready(self):
+        return bool(self.stdout)
+
+    def recv(self, size):
+        return self.stdout.pop(0)
+
+    def recv_stderr_ready(self):
+        return bool(self.stderr)
+
+    def recv_stderr(self, size):
+        return self.stderr.pop(0)
+
+    def exit_status_ready(self):
+        return self.write_shutdown or not self.reads_stdin
+
+    def recv_exit_status(self):
+        return self.exited
+
+    def send_ready(self):
+        return True
+
+    def send(self, data):
+        self.sent.append(data)
+        return len(data)
+
+    def sendall(self, data):
+        self.sent.append(data)
+
+    def shutdown_write(self):
+        self.write_shutdown = True
+
+    def close(self):
+        self.closed = True
+
+
+class TestConnectionWithSCPChannels(TestCase):
+
+    def setUp(self):
+        self.connection = fabric.ConnectionWithSCP('127.0.0.1')
+        self.connection.open = MagicMock()
+        self.transport = MagicMock()
+        self.connection.transport = self.transport
+        self.channels = {'sudo -n true': (b'', b'', 0)}
+        self.opened = []
+
+        def open_session():
+            channel = FakeChannel()
+            original_exec = channel.exec_command
+
+            def exec_command(command):
+                original_exec(command)
+                channel.__init__(*self.channels[command])
+                channel.command = command
+            channel.exec_command = exec_command
+            self.opened.append(channel)
+            return channel
+
+        self.transport.open_session.side_effect = open_session
+
+    def test_exec_command(self):
+        self.channels['uname'] = (b'Linux debian\n', b'warning\n', 0)
+        result = self.connection.exec_command('uname')
+        self.assertEqual(result.command, 'uname')
+        self.assertEqual(result.stdout, 'Linux debian\n')
+        self.assertEqual(result.stderr, 'warning\n')
+        self.assertEqual(result.exited, 0)
+        self.assertTrue(result.ok)
+
+    def test_exec_command_failed(self):
+        self.channels['false'] = (b'', b'oops', 1)
+        with self.assertRaises(fabric.CommandError) as cm:
+            self.connection.exec_command('false')
+        self.assertEqual(cm.exception.result.stderr, 'oops')
+        result = self.connection.exec_command('false', warn=True)
+        self.assertFalse(result.ok)
+
+    def test_exec_command_sinks(self):
+        self.channels['make'] = (b'compiling everything\n', b'', 0)
+        out = MagicMock()
+        result = self.connection.exec_command('make', out=out)
+        self.assertEqual(result.stdout, '')
+        self.assertEqual(b''.join(call[0][0] for call in out.call_args_list), b'compiling everything\n')
+
+    @patch('select.select')
+    def test_exec_command_waits_for_output(self, select):
+        channel = MagicMock()
+        channel.recv_ready.side_effect = [False, True, False, False]
+        channel.recv.return_value = b'done'
+        channel.recv_stderr_ready.return_value = False
+        channel.exit_status_ready.side_effect = [False, True]
+        channel.recv_exit_status.return_value = 0
+        self.transport.open_session.side_effect = None
+        self.transport.open_session.return_value = channel
+        result = self.connection.exec_command('sleep 1; echo done')
+        select.assert_called_once_with([channel], [], [], 1)
+        self.assertEqual(result.stdout, 'done')
+        channel.close.assert_called_with()
+
+    def test_run_concurrent(self):
+        for i in range(6):
+            self.channels[f'echo {i}'] = (f'{i}\n'.encode(), b'', 0)
+        self.channels['exit 3'] = (b'', b'', 3)
+        futures = self.connection.run_concurrent([f'echo {i}' for i in range(6)] + ['exit 3'], max_channels=3)
+        self.assertEqual([future.result(timeout=5).stdout for future in futures[:6]],
+                         [f'{i}\n' for i in range(6)])
+        self.assertIsInstance(futures[6].exception(timeout=5), fabric.CommandError)
+
+    def test_sudo_write(self):
+        self.connection.channel_chunk_size = 4
+        self.channels["sudo -n tee '/etc/my config' > /dev/null"] = (b'', b'', 0, True)
+        self.connection.sudo_write(BytesIO(b'0123456789'), '/etc/my config')
+        channel = self.opened[-1]
+        self.assertEqual(channel.sent, [b'0123', b'4567', b'89'])
+        self.assertTrue(channel.write_shutdown)
+
+    def test_sudo_write_file(self):
+        with tempfile.NamedTemporaryFile() as fout:
+            fout.write(b'hello')
+            fout.flush()
+            self.channels["sudo -n tee /etc/hello > /dev/null"] = (b'', b'', 0, True)
+            self.connection.sudo_write(fout.name, '/etc/hello')
+        self.assertEqual(self.opened[-1].sent, [b'hello'])
+
+    def test_sudo_write_failed(self):
+        self.channels["sudo -n tee /etc/hello > /dev/null"] = (b'', b'tee: /etc/hello: Read-only file system', 1)
+        with self.assertRaisesRegex(fabric.CommandError, 'Read-only file system'):
+            self.connection.sudo_write(BytesIO(b'hello'), '/etc/hello')
+        self.assertEqual(self.opened[-1].sent, [])  # the command exited before reading its input
+
+    def test_sudo_write_many(self):
+        src = BytesIO(b'skip-abc')
+        src.seek(5)
+        script = "head -c 3 > /etc/a && head -c 5 > '/etc/b c'"
+        self.channels[f'sudo -n sh -c {shlex.quote(script)}'] = (b'', b'', 0, True)
+        self.connection.sudo_write_many([(src, '/etc/a'), (BytesIO(b'defgh'), '/etc/b c')])
+        channel = self.opened[-1]
+        self.assertEqual(b''.join(channel.sent), b'abcdefgh')
+        self.assertTrue(channel.write_shutdown)
+
+    def test_sudo_write_password(self):
+        self.connection.config.sudo.password = 'secret'
+        self.connection.sudo = MagicMock()
+        with patch.object(fabric.ConnectionWithSCP, 'scp') as scp:
+            self.connection.sudo_write_many([(BytesIO(b'abc'), '/etc/a'), (BytesIO(b'def'), "/etc/b'c")])
+        self.assertEqual(self.opened, [])
+        self.assertEqual(scp.putfo.call_count, 2)
+        temp_dest = scp.putfo.call_args_list[1][0][1]
+        self.assertEqual(scp.putfo.call_args_list[1][1], {'mode': '0600'})
+        script = f"cat {temp_dest} > '/etc/b'\"'\"'c'; status=$?; rm -f {temp_dest}; exit $status"
+        self.connection.sudo.assert_called_with(f'sh -c {shlex.quote(script)}')
+
+    def test_sudo_write_no_passwordless_sudo(self):
+        self.channels['sudo -n true'] = (b'', b'sudo: a password is required', 1)
+        self.connection.sudo = MagicMock()
+        with patch.object(fabric.ConnectionWithSCP, 'scp') as scp:
+            self.connection.sudo_write(BytesIO(b'hello'), '/etc/hello')
+            self.connection.sudo_write(BytesIO(b'hello'), '/etc/hello')
+        self.assertEqual([channel.command for channel in self.opened], ['sudo -n true'])
+        self.assertEqual(scp.putfo.call_count, 2)
+        self.assertEqual(self.connection.sudo.call_count, 2)
+
+    def test_sudo_write_many_nothing(self):
+        self.connection.sudo_write_many([])
+        self.assertEqual(self.opened, [])
+
+    def test_get(self):
+        with patch.object(fabric.ConnectionWithSCP, 'scp') as scp:
+            self.connection.get('/var/log/build.log', 'artifacts/')
+            scp.get.assert_called_once_with('/var/log/build.log', 'artifacts/', recursive=False)
+
+
+class LocalChannel(object):
+    """A stand in for a paramiko channel which runs the command in a local shell"""
+
+    def __init__(self):
+        self.process = None
+        self.buffers = {'stdout': [], 'stderr': []}
+        self.lock = threading.Lock()
+        self.readers = []
+
+    def _pump(self, name, fin):
+        for chunk in iter(lambda: fin.read1(65536), b''):
+            with self.lock:
+                self.buffers[name].append(chunk)
+
+    def fileno(self):
+        return self.process.stdout.fileno()
+
+    def exec_command(self, command):
+        self.process = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE)
+        for name in self.buffers:
+            reader = threading.Thread(target=self._pump, args=(name, getattr(self.process, name)), daemon=True)
+            reader.start()
+            self.readers.append(reader)
+
+    def sendall(self, data):
+        self.process.stdin.write(data)
+
+    def send_ready(self):
+        return True
+
+    def send(self, data):
+        self.process.stdin.write(data)
+        return len(data)
+
+    def shutdown_write(self):
+        self.process.stdin.close()
+
+    def _ready(self, name):
+        with self.lock:
+            return bool(self.buffers[name])
+
+    def _recv(self, name, size):
+        while True:
+            with self.lock:
+                if self.buffers[name]:
+                    chunk = self.buffers[name].pop(0)
+                    if len(chunk) > size:
+                        self.buffers[name].insert(0, chunk[size:])
+                        chunk = chunk[:size]
+                    return chunk
+            if self.exit_status_ready():
+                return b''
+            time.sleep(0.001)
+
+    def recv_ready(self):
+        return self._ready('stdout')
+
+    def recv(self, size):
+        return self._recv('stdout', size)
+
+    def recv_stderr_ready(self):
+        return self._ready('stderr')
+
+    def recv_stderr(self, size):
+        return self._recv('stderr', size)
+
+    def exit_status_ready(self):
+        return self.process.poll() is not None and not any(reader.is_alive() for reader in self.readers)
+
+    def recv_exit_status(self):
+        return self.process.wait()
+
+    def close(self):
+        if not self.process.stdin.closed:
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+        self.process.wait()
+
+
+class LocalConnection(fabric.ConnectionWithSCP):
+    """A connection which runs commands in a local shell, used to test remote scripts"""
+
+    def open(self):
+        self.transport = MagicMock()
+        self.transport.open_session.side_effect = LocalChannel
+
+
+class TestConnectionWithSCPSync(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.local_dir = os.path.join(self.temp_dir.name, 'local')
+        self.remote_dir = os.path.join(self.temp_dir.name, 'remote dir')
+        self.connection = LocalConnection('127.0.0.1')
+        self.write(self.local_dir, 'app.conf', b'debug = false\n')
+        self.write(self.local_dir, 'bin/start', b'#!/bin/sh\necho start\n')
+        os.chmod(os.path.join(self.local_dir, 'bin/start'), 0o755)
+
+    def write(self, base, path, content):
+        path = os.path.join(base, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as fout:
+            fout.write(content)
+
+    def read(self, base, path):
+        with open(os.path.join(base, path), 'rb') as fin:
+            return fin.read()
+
+    def test_remote_hashes(self):
+        self.write(self.remote_dir, 'a/b c', b'hello')
+        self.assertEqual(self.connection.remote_hashes(self.remote_dir),
+                         {'a/b c': hashlib.sha256(b'hello').hexdigest()})
+
+    def test_sync(self):
+        result = self.connection.sync(self.local_dir, self.remote_dir)
+        self.assertEqual(result.uploaded, ['app.conf', 'bin/start'])
+        self.assertEqual(self.read(self.remote_dir, 'bin/start'), b'#!/bin/sh\necho start\n')
+        self.assertTrue(os.access(os.path.join(self.remote_dir, 'bin/start'), os.X_OK))
+
+        # only changed files are uploaded
+        self.write(self.local_dir, 'app.conf', b'debug = true\n')
+        self.write(self.remote_dir, 'stale.conf', b'old')
+        result = self.connection.sync(self.local_dir, self.remote_dir)
+        self.assertEqual(result.uploaded, ['app.conf'])
+        self.assertEqual(result.unchanged, ['bin/start'])
+        self.assertEqual(result.deleted, [])
+        self.assertEqual(self.read(self.remote_dir, 'app.conf'), b'debug = true\n')
+        self.assertTrue(os.path.exists(os.path.join(self.remote_dir, 'stale.conf')))
+
+        # stale files are optionally deleted
+        result = self.connection.sync(self.local_dir, self.remote_dir, delete=True)
+        self.assertEqual(result.uploaded, [])
+        self.assertEqual(result.deleted, ['stale.conf'])
+        self.assertFalse(os.path.exists(os.path.join(self.remote_dir, 'stale.conf')))
+
+    def test_sync_large_tree(self):
+        # the scripts of a single command would exceed the 128KiB limit of one argument
+        names = [f'{"d" * 100}/{i:04d}-{"f" * 120}' for i in range(1000)]
+        for name in names:
+            self.write(self.local_dir, name, name.encode())
+        stale = [f'{"s" * 150}-{i:04d}' for i in range(1000)]
+        for name in stale:
+            self.write(self.remote_dir, name, b'old')
+        self.connection._run_script = MagicMock(wraps=self.connection._run_script)
+        result = self.connection.sync(self.local_dir, self.remote_dir, delete=True)
+        self.assertEqual(len(result.uploaded), 1002)
+        self.assertEqual(result.deleted, stale)
+        self.assertGreater(self.connection._run_script.call_count, 3)
+        for script in (call[0][0] for call in self.connection._run_script.call_args_list[1:]):
+            self.assertLessEqual(len(script), self.connection.max_script_length)
+        self.assertEqual(self.read(self.remote_dir, names[-1]), names[-1].encode())
+        self.assertTrue(os.access(os.path.join(self.remote_dir, 'bin/start'), os.X_OK))
+        self.assertEqual(sorted(os.listdir(self.remote_dir)), ['app.conf', 'bin', 'd' * 100])
+
+    def test_sync_nothing_to_do(self):
+        self.connection.sync(self.local_dir, self.remote_dir)
+        self.connection._run_script = MagicMock(wraps=self.connection._run_script)
+        result = self.connection.sync(self.local_dir, self.remote_dir)
+        self.assertEqual(result.uploaded, [])
+        self.assertEqual(self.connection._run_script.call_count, 1)  # only the hashing command
+
+
+class TestConnectionWithSCPTar(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.base = self.temp_dir.name
+        self.connection = LocalConnection('127.0.0.1')
+        for path, content in (('src/app/main.py', b'print(1)\n'), ('src/app/lib/util.py', b'x = 1\n'),
+                              ('src/settings.ini', b'[main]\n')):
+            path = os.path.join(self.base, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as fout:
+                fout.write(content)
+
+    def read(self, *path):
+        with open(os.path.join(self.base, *path), 'rb') as fin:
+            return fin.read()
+
+    def test_put_and_get_tar(self):
+        for compression in (None, 'gzip'):
+            remote_dir = os.path.join(self.base, f'remote-{compression}')
+            self.connection.put_tar([os.path.join(self.base, 'src/app/'), os.path.join(self.base, 'src/settings.ini')],
+                                    remote_dir, compression=compression)
+            self.assertEqual(self.read(remote_dir, 'app/lib/util.py'), b'x = 1\n')
+            self.assertEqual(self.read(remote_dir, 'settings.ini'), b'[main]\n')
+
+            local_dir = os.path.join(self.base, f'fetched-{compression}')
+            self.connection.get_tar([os.path.join(remote_dir, 'app'), os.path.join(remote_dir, 'settings.ini')],
+                                    local_dir, compression=compression)
+            self.assertEqual(self.read(local_dir, 'app/main.py'), b'print(1)\n')
+            self.assertEqual(self.read(local_dir, 'settings.ini'), b'[main]\n')
+
+    def test_get_tar_missing(self):
+        with self.assertRaises(fabric.CommandError) as cm:
+            self.connection.get_tar([os.path.join(self.base, 'missing')], os.path.join(self.base, 'fetched'))
+        self.assertIn('missing', cm.exception.result.stderr)
+
+    def test_unsupported_compression(self):
+        self.connection.open = MagicMock()
+        with self.assertRaises(ValueError):
+            self.connection.put_tar([os.path.join(self.base, 'src')], self.base, compression='lz4')
+        with self.assertRaises(ValueError):
+            self.connection.get_tar([os.path.join(self.base, 'src')], self.base, compression='lz4')
+        self.connection.open.assert_not_called()
+
+    @skipUnless(importlib.util.find_spec('zstandard') and shutil.which('zstd'), 'requires zstandard and zstd')
+    def test_put_and_get_tar_zstd(self):
+        remote_dir = os.path.join(self.base, 'remote')
+        self.connection.put_tar([os.path.join(self.base, 'src/app')], remote_dir, compression='zstd')
+        self.assertEqual(self.read(remote_dir, 'app/lib/util.py'), b'x = 1\n')
+        local_dir = os.path.join(self.base, 'fetched')
+        self.connection.get_tar([os.path.join(remote_dir, 'app')], local_dir, compression='zstd')
+        self.assertEqual(self.read(local_dir, 'app/main.py'), b'print(1)\n')
+
+    def test_zstd_requires_zstandard(self):
+        self.connection.open = MagicMock()
+        with patch.dict('sys.modules', zstandard=None):
+            with self.assertRaisesRegex(ImportError, 'zstandard'):
+                self.connection.put_tar([os.path.join(self.base, 'src')], self.base, compression='zstd')
+        self.connection.open.assert_not_called()
+
+    def test_put_tar_remote_exits_early(self):
+        with open(os.path.join(self.base, 'src/large.bin'), 'wb') as fout:
+            fout.write(os.urandom(4 * 1024 * 1024))
+        remote_dir = os.path.join(self.base, 'src/settings.ini/remote')  # mkdir fails under a file
+        with self.assertRaises(fabric.CommandError) as cm:
+            self.connection.put_tar([os.path.join(self.base, 'src')], remote_dir, compression=None)
+        self.assertIn('settings.ini', cm.exception.result.stderr)
+        self.assertIn('settings.ini', str(cm.exception).splitlines()[-1])
+
+
+    def test_put_tar_missing_path(self):
+        remote_dir = os.path.join(self.base, 'remote')
+        with self.assertRaises(FileNotFoundError):
+            self.connection.put_tar([os.path.join(self.base, 'src/settings.ini'), os.path.join(self.base, 'missing')],
+                                    remote_dir, compression=None)
+
+
+class TestConnectionWithSCPBatch(TestCase):
+
+    def setUp(self):
+        self.connection = LocalConnection('127.0.0.1')
+
+    def test_batch(self):
+        with patch.object(self.connection, '_exec_channel', wraps=self.connection._exec_channel) as exec_channel:
+            with self.connection.batch() as batch:
+                first = batch.run('printf "no newline"')
+                second = batch.run('echo out; echo err >&2; exit 3', warn=True)
+                third = batch.run('cd /tmp && pwd')
+        exec_channel.assert_called_once()
+        self.assertEqual((first.stdout, first.stderr, first.exited), ('no newline', '', 0))
+        self.assertEqual((second.stdout, second.stderr, second.exited), ('out\n', 'err\n', 3))
+        self.assertFalse(second.ok)
+        self.assertEqual(third.stdout, '/tmp\n')
+
+    def test_batch_context(self):
+        self.connection.config.run.env = {'GREETING': 'hello world'}
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with self.connection.batch() as batch:
+                with self.connection.cd(temp_dir), self.connection.prefix('NAME=batch'):
+                    first = batch.run('pwd; echo "$GREETING $NAME $EXTRA"', env={'EXTRA': "it's"})
+                    sudo = batch.sudo('id', user='app')
+                second = batch.run('echo "$GREETING"')
+                plain_sudo = batch.sudo('id', user='app')
+                del batch.commands[3], batch.commands[1]  # sudo is not available to the test
+        self.assertEqual(first.stdout, f"{temp_dir}\nhello world batch it's\n")
+        self.assertEqual(second.stdout, 'hello world\n')
+        prefixed = f"export GREETING='hello world' && cd {temp_dir} && NAME=batch && id"
+        self.assertEqual(sudo.command, f'sudo -n -H -u app sh -c {shlex.quote(prefixed)}')
+        exported = "export GREETING='hello world' && id"
+        self.assertEqual(plain_sudo.command, f'sudo -n -H -u app sh -c {shlex.quote(exported)}')
+
+    def test_batch_fail_fast(self):
+        with self.assertRaises(fabric.CommandError) as cm:
+            with self.connection.batch() as batch:
+                first = batch.run('true')
+                second = batch.run('echo failed; exit 2')
+                third = batch.run('echo never')
+        self.assertEqual(cm.exception.result, second)
+        self.assertEqual(first.exited, 0)
+        self.assertEqual((second.stdout, second.exited), ('failed\n', 2))
+        self.assertIsNone(third.exited)
+
+    def test_batch_not_run_on_error(self):
+        with patch.object(self.connection, '_exec_channel') as exec_channel:
+            with self.assertRaises(ValueError):
+                with self.connection.batch() as batch:
+                    batch.run('echo hello')
+                    raise ValueError()
+        exec_channel.assert_not_called()
+
+    def test_batch_sudo(self):
+        batch = fabric.CommandBatch(self.connection)
+        batch.sudo('apt-get update')
+        batch.sudo('whoami > /tmp/me', user='build user')
+        self.assertEqual([command for command, warn, result in batch.commands],
+                         ["sudo -n sh -c 'apt-get update'", "sudo -n -H -u 'build user' sh -c 'whoami > /tmp/me'"])
+
+    def test_batch_user(self):
+        batch = fabric.CommandBatch(self.connection, user='app')
+        with self.connection.cd('/srv/app'):
+            batch.run('make | tee build.log')
+        self.assertEqual(batch.commands[0][0], "sudo -n -H -u app sh -c 'cd /srv/app && make | tee build.log'")
+
+
+class TestConnectionWithSCPStream(TestCase):
+
+    def test_exec_command_stdin(self):
+        connection = LocalConnection('127.0.0.1')
+        result = connection.exec_command('cat; echo done >&2', stdin=[BytesIO(b'a' * 1000000), BytesIO(b'b')])
+        self.assertEqual(result.stdout, 'a' * 1000000 + 'b')
+        self.assertEqual(result.stderr, 'done\n')
+
+    def test_exec_command_stdin_exits_early(self):
+        connection = LocalConnection('127.0.0.1')
+        with self.assertRaisesRegex(fabric.CommandError, 'denied') as cm:
+            connection.exec_command('echo denied >&2; exit 1', stdin=BytesIO(os.urandom(8 * 1024 * 1024)))
+        self.assertEqual(cm.exception.result.exited, 1)
+
+    def test_exec_command_context(self):
+        connection = LocalConnection('127.0.0.1')
+        connection.config.run.env = {'GREETING': 'hello'}
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with connection.cd(temp_dir), connection.prefix('NAME=channel'):
+                result = connection.exec_command('pwd; echo "$GREETING $NAME $EXTRA"', env={'EXTRA': 'world'})
+                futures = connection.run_concurrent(['pwd', 'echo "$GREETING"'], max_channels=2)
+            self.assertEqual(result.stdout, f'{temp_dir}\nhello channel world\n')
+            self.assertEqual([future.result(timeout=5).stdout for future in futures], [f'{temp_dir}\n', 'hello\n'])
+
+    def test_stream(self):
+        connection = LocalConnection('127.0.0.1')
+        chunks = []
+        result = connection.stream('head -c 100000 /dev/zero | tr "\\0" a; echo done >&2',
+                                   sink=lambda stream, data: chunks.append((stream, data)), tail_bytes=10)
+        self.assertEqual(result.stdout, 'a' * 10)
+        self.assertEqual(result.stderr, 'done\n')
+        self.assertEqual(sum(len(data) for stream, data in chunks if stream == 'stdout'), 100000)
+        self.assertEqual(b''.join(data for stream, data in chunks if stream == 'stderr'), b'done\n')
+
+    def test_stream_context(self):
+        connection = LocalConnection('127.0.0.1')
+        connection.config.run.env = {'GREETING': 'hello'}
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with connection.cd(temp_dir), connection.prefix('NAME=stream'):
+                result = connection.stream('pwd; echo "$GREETING $NAME $EXTRA"', env={'EXTRA': 'world'})
+        self.assertEqual(result.stdout, f'{temp_dir}\nhello stream world\n')
+
+    def test_stream_failed(self):
+        connection = LocalConnection('127.0.0.1')
+        with self.assertRaises(fabric.CommandError) as cm:
+            connection.stream('echo broken >&2; exit 1', tail_bytes=4)
+        self.assertEqual(cm.exception.result.stderr, 'ken\n')
+
+
+class TestSudoAsUser(TestCase):
+
+    def setUp(self):
+        self.connection = LocalConnection('127.0.0.1')
+        self.connection.config.run.env = {'LANG': 'C'}
+        self.sudo_as_user = fabric.SudoAsUser(self.connection, 'app user')
+
+    def test_run(self):
+        contexts = []
+        self.connection.sudo = MagicMock(side_effect=lambda *args, **kwargs: contexts.append(
+            (list(self.connection.command_cwds), list(self.connection.command_prefixes))))
+        with self.sudo_as_user.cd('/srv/app'), self.sudo_as_user.prefix('. venv/bin/activate'):
+            self.sudo_as_user.run('make | tee build.log', warn=True, env={'JOBS': 4})
+            self.assertEqual(self.connection.command_cwds, ['/srv/app'])
+        script = "export JOBS=4 LANG=C && cd /srv/app && . venv/bin/activate && make | tee build.log"
+        self.connection.sudo.assert_called_once_with(f'sh -c {shlex.quote(script)}', user='app user', warn=True)
+        self.assertEqual(contexts, [([], [])])  # fabric's sudo must not apply them outside the shell
+
+    def test_stream(self):
+        self.connection._stream = MagicMock()
+        command = "echo 'hi' > /home/app/out"
+        with self.sudo_as_user.cd('/home/app'):
+            self.sudo_as_user.stream(command, warn=True)
+        script = f'export LANG=C && cd /home/app && {command}'
+        self.connection._stream.assert_called_once_with(f"sudo -n -H -u 'app user' sh -c {shlex.quote(script)}",
+                                                        warn=True)
+
+    def test_exec_command(self):
+        self.connection._exec_channel = MagicMock()
+        self.connection._run_concurrent = MagicMock()
+        with self.sudo_as_user.cd('/srv/app'):
+            self.sudo_as_user.exec_command('pwd', warn=True)
+            self.sudo_as_user.run_concurrent(['pwd', 'id'], max_channels=2)
+        command = "sudo -n -H -u 'app user' sh -c 'export LANG=C && cd /srv/app && {}'"
+        self.connection._exec_channel.assert_called_once_with(command.format('pwd'), warn=True)
+        self.connection._run_concurrent.assert_called_once_with([command.format('pwd'), command.format('id')],
+                                                                max_channels=2)
+
+    def test_batch(self):
+        with patch.object(fabric.CommandBatch, 'execute'):
+            with self.sudo_as_user.batch() as batch:
+                batch.run('whoami')
+        self.assertEqual(batch.commands[0][0], "sudo -n -H -u 'app user' sh -c 'export LANG=C && whoami'")
+
+    def test_put(self):
+        self.connection._exec_channel = MagicMock()
+        with self.sudo_as_user.cd('/srv/app'):
+            self.sudo_as_user.put(BytesIO(b'hello'), 'my file')
+        script = "cd && cat > 'my file' && chmod 644 'my file'"
+        command = f"sudo -n -H -u 'app user' sh -c {shlex.quote(script)}"
+        self.connection._exec_channel.assert_called_once_with(command, stdin=ANY)
+
+    def test_login_user_methods(self):
+        for name in ('get', 'sync', 'sudo_write', 'put_tar'):
+            with self.assertRaisesRegex(AttributeError, 'app user'):
+                getattr(self.sudo_as_user, name)
+        self.assertEqual(self.sudo_as_user.host, '127.0.0.1')
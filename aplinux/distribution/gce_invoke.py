@@ -1,29 +1,81 @@
 # -*- coding:utf-8 -*-
+"""Invoke tasks building google cloud images on tempory nodes
+
+The node managers, libcloud and fabric are imported by the tasks which use them so that
+listing the tasks or running a trivial one does not pay for their import.
+"""
 
-from .node_manager import TemporyGCENode
 from invoke import task
 from datetime import datetime
 
-import code
 import json
 import logging
-import libcloud
+import os
+import threading
 
 
 logger = logging.getLogger('aplinux.distribution')
 
 
-def get_driver(c):
-    """Return the google cloud driver"""
-    service_account = json.load(open(c.google_cloud.service_account_key_file, 'r'))
+_drivers = {}
+_drivers_lock = threading.Lock()
+
+
+def credential_cache_dir(c):
+    """Return the directory access tokens are cached in, creating it readable only by the user
+
+    It is ``google_cloud.credential_cache_dir`` if configured, otherwise aplinux/gce in the
+    user's cache directory.
+    """
+    path = c.google_cloud.get('credential_cache_dir')
+    if not path:
+        path = os.path.join(os.environ.get('XDG_CACHE_HOME') or '~/.cache', 'aplinux', 'gce')
+    path = os.path.expanduser(path)
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    os.chmod(path, 0o700)
+    return path
+
+
+def _new_driver(c, key_file):
+    import libcloud.compute.providers
+    import libcloud.compute.types
+    with open(key_file, 'r') as fin:
+        service_account = json.load(fin)
+    credential_file = os.path.join(credential_cache_dir(c), f'token-{service_account["client_email"]}.json')
+    if os.path.exists(credential_file):
+        os.chmod(credential_file, 0o600)  # libcloud only sets the mode when it creates the file
     driver_factory = libcloud.compute.providers.get_driver(libcloud.compute.types.Provider.GCE)
     return driver_factory(service_account['client_email'],
-                          c.google_cloud.service_account_key_file,
+                          key_file,
                           datacenter=c.google_cloud.datacenter,
                           project=c.google_cloud.project_id,
+                          credential_file=credential_file,
                           timeout=300)
 
 
+def get_driver(c):
+    """Return the google cloud driver
+
+    Drivers are memoized per project, datacenter and service account key file so that the tasks
+    run by a process share a driver and its keep alive https connection. The access token is
+    cached on disk until it expires so that later processes skip the token exchange.
+    """
+    key_file = os.path.realpath(os.path.expanduser(c.google_cloud.service_account_key_file))
+    driver_key = (c.google_cloud.project_id, c.google_cloud.datacenter, key_file, os.stat(key_file).st_mtime_ns)
+    with _drivers_lock:
+        driver = _drivers.get(driver_key)
+        if driver is None:
+            driver = _drivers[driver_key] = _new_driver(c, key_file)
+    return driver
+
+
+def get_catalog(c, driver):
+    """Return the image and size catalog of the driver, persisted next to the cached access tokens"""
+    from .catalog import Catalog
+    path = os.path.join(credential_cache_dir(c), f'catalog-{c.google_cloud.project_id}.json')
+    return Catalog.for_driver(driver, path=path)
+
+
 def new_image_name(c):
     timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
     return f'{c.target_image_prefix}{timestamp}'
@@ -33,22 +85,45 @@ def new_image_name(c):
 def build(c):
     """Build an image"""
     import fabfile
+    from .node_manager import TemporyGCENode
     logger.info('Build a fresh new image.')
     driver = get_driver(c)
     kwargs = {**c.google_cloud.node_defaults, **c.build_node}
-    with TemporyGCENode(driver, fabric_config_defaults=c.fabric, **kwargs) as nm:
+    with TemporyGCENode(driver, fabric_config_defaults=c.fabric, catalog=get_catalog(c, driver), **kwargs) as nm:
         fabfile.build(nm.fabric)
         nm.stop_and_create_image(new_image_name(c))
 
 
+@task
+def layered_build(c):
+    """Build an image from fabfile.build_steps, resuming from the deepest cached layer"""
+    import fabfile
+    from .build_cache import BuildStep
+    from .build_cache import LayeredBuild
+    logger.info('Build an image from cached layers.')
+    kwargs = {**c.google_cloud.node_defaults, **c.build_node}
+    base_image = kwargs.pop('image', None)
+    if not base_image:
+        raise ValueError('layered_build needs a base image, set image in build_node or google_cloud.node_defaults')
+    driver = get_driver(c)
+    steps = [step if isinstance(step, BuildStep) else BuildStep(*step) for step in fabfile.build_steps(c)]
+    build = LayeredBuild(driver, steps, base_image,
+                         max_layers=c.get('build_cache_max_layers', 20),
+                         fabric_config_defaults=c.fabric,
+                         catalog=get_catalog(c, driver),
+                         **kwargs)
+    build.build(new_image_name(c))
+
+
 @task
 def init(c):
     """Run only init on an image"""
     import fabfile
+    from .node_manager import TemporyGCENode
     logger.info('Build a fresh new image.')
     driver = get_driver(c)
     kwargs = {**c.google_cloud.node_defaults, **c.build_node}
-    with TemporyGCENode(driver, fabric_config_defaults=c.fabric, **kwargs) as nm:
+    with TemporyGCENode(driver, fabric_config_defaults=c.fabric, catalog=get_catalog(c, driver), **kwargs) as nm:
         fabfile.init(nm.fabric)
         nm.stop_and_create_image(new_image_name(c))
 
@@ -57,10 +132,11 @@ def init(c):
 def update(c):
     """Update an image"""
     import fabfile
+    from .node_manager import TemporyGCENode
     logger.info('Build an updated image from the most recent image.')
     driver = get_driver(c)
     kwargs = {**c.google_cloud.node_defaults, **c.update_node}
-    with TemporyGCENode(driver, fabric_config_defaults=c.fabric, **kwargs) as nm:
+    with TemporyGCENode(driver, fabric_config_defaults=c.fabric, catalog=get_catalog(c, driver), **kwargs) as nm:
         fabfile.update(nm.fabric)
         nm.stop_and_create_image(new_image_name(c))
         
@@ -69,10 +145,11 @@ def update(c):
 def quick_update(c):
     """Quickly Update an image"""
     import fabfile
+    from .node_manager import TemporyGCENode
     logger.info('Build an quickly updated image from the most recent image.')
     driver = get_driver(c)
     kwargs = {**c.google_cloud.node_defaults, **c.update_node}
-    with TemporyGCENode(driver, fabric_config_defaults=c.fabric, **kwargs) as nm:
+    with TemporyGCENode(driver, fabric_config_defaults=c.fabric, catalog=get_catalog(c, driver), **kwargs) as nm:
         fabfile.quick_update(nm.fabric)
         nm.stop_and_create_image(new_image_name(c))
 
@@ -81,16 +158,18 @@ def quick_update(c):
 def update_ssl(c):
     """Update SSL certificates"""
     import fabfile
+    from .node_manager import TemporyGCENode
     logger.info('Update SSL certificate.')
     driver = get_driver(c)
     kwargs = {**c.google_cloud.node_defaults, **c.update_node}
-    with TemporyGCENode(driver, fabric_config_defaults=c.fabric, **kwargs) as nm:
+    with TemporyGCENode(driver, fabric_config_defaults=c.fabric, catalog=get_catalog(c, driver), **kwargs) as nm:
         fabfile.update_ssl(nm.fabric)
         nm.stop_and_create_image(new_image_name(c))
 
 
 @task
 def cli(c, tempory_node=False):
+    import code
     import fabfile
     import tasks
     driver = get_driver(c)
@@ -110,7 +189,8 @@ def cli(c, tempory_node=False):
             **c.google_cloud.node_defaults,
             **c.cli_node,
         }
-        with TemporyGCENode(driver, **kwargs) as nm:
+        from .node_manager import TemporyGCENode
+        with TemporyGCENode(driver, catalog=get_catalog(c, driver), **kwargs) as nm:
             local['nm'] = nm
             code.interact(banner=banner, local=local)
     else:
@@ -0,0 +1,82 @@
+# -*- coding:utf-8 -*-
+
+from . import gce_invoke
+from invoke import Config
+from invoke import Context
+from unittest import TestCase
+from unittest.mock import patch
+
+import json
+import os
+import stat
+import tempfile
+
+
+class TestGetDriver(TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = temp_dir.name
+        self.key_file = os.path.join(self.temp_dir, 'service_account.json')
+        with open(self.key_file, 'w') as fout:
+            json.dump({'client_email': 'builder@example.iam.gserviceaccount.com'}, fout)
+        self.cache_dir = os.path.join(self.temp_dir, 'cache')
+        patcher = patch.dict(gce_invoke._drivers, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def context(self, project_id='project'):
+        return Context(Config(overrides={'google_cloud': {'service_account_key_file': self.key_file,
+                                                          'credential_cache_dir': self.cache_dir,
+                                                          'datacenter': 'zone',
+                                                          'project_id': project_id}}))
+
+    @patch('libcloud.compute.providers.get_driver')
+    def test_get_driver(self, get_driver_factory):
+        driver_factory = get_driver_factory.return_value
+        driver = gce_invoke.get_driver(self.context())
+        self.assertIs(driver, driver_factory.return_value)
+        credential_file = os.path.join(self.cache_dir, 'token-builder@example.iam.gserviceaccount.com.json')
+        driver_factory.assert_called_once_with('builder@example.iam.gserviceaccount.com',
+                                               os.path.realpath(self.key_file),
+                                               datacenter='zone',
+                                               project='project',
+                                               credential_file=credential_file,
+                                               timeout=300)
+        self.assertEqual(stat.S_IMODE(os.stat(self.cache_dir).st_mode), 0o700)
+
+        # memoized per project, datacenter and key file
+        self.assertIs(gce_invoke.get_driver(self.context()), driver)
+        self.assertEqual(driver_factory.call_count, 1)
+        gce_invoke.get_driver(self.context(project_id='other'))
+        self.assertEqual(driver_factory.call_count, 2)
+
+    @patch('libcloud.compute.providers.get_driver')
+    def test_get_driver_secures_token(self, get_driver_factory):
+        os.makedirs(self.cache_dir, mode=0o755)
+        credential_file = os.path.join(self.cache_dir, 'token-builder@example.iam.gserviceaccount.com.json')
+        with open(credential_file, 'w') as fout:
+            fout.write('{}')
+        os.chmod(credential_file, 0o644)
+        gce_invoke.get_driver(self.context())
+        self.assertEqual(stat.S_IMODE(os.stat(self.cache_dir).st_mode), 0o700)
+        self.assertEqual(stat.S_IMODE(os.stat(credential_file).st_mode), 0o600)
+
+    def test_get_catalog(self):
+        driver = object()
+        catalog = gce_invoke.get_catalog(self.context(), driver)
+        self.assertIs(catalog.driver, driver)
+        self.assertEqual(catalog.path, os.path.join(self.cache_dir, 'catalog-project.json'))
+        self.assertIs(gce_invoke.get_catalog(self.context(), driver), catalog)
+
+
+class TestLayeredBuild(TestCase):
+
+    def test_no_base_image(self):
+        c = Context(Config(overrides={'google_cloud': {'node_defaults': {'size': 'n1-standard-1'}},
+                                      'build_node': {}}))
+        with patch.dict('sys.modules', fabfile=object()), patch.object(gce_invoke, 'get_driver') as get_driver:
+            with self.assertRaisesRegex(ValueError, 'base image'):
+                gce_invoke.layered_build(c)
+            get_driver.assert_not_called()
@@ -0,0 +1,231 @@
+# -*- coding:utf-8 -*-
+"""Hedged creation of a tempory node across candidate locations and sizes
+
+Creating a node sometimes takes minutes or fails because a zone is short on capacity.
+A HedgedCreate is given a ranked list of candidate node managers. It creates the first
+and, if that is not ready within hedge_after seconds or fails, it also creates the next.
+The first candidate to become ready is kept and the others are destroyed::
+
+    >>> hedged = HedgedCreate.from_options(TemporyGCENode, driver,
+    >>>                                    [{'location': 'us-central1-a'},
+    >>>                                     {'location': 'us-central1-b'},
+    >>>                                     {'location': 'us-east1-b', 'size': 'n1-standard-2'}],
+    >>>                                    hedge_after=90, image='debian-9', size='n1-standard-1')
+    >>> with hedged as nm:
+    >>>     nm.fabric.run('echo hello')
+    >>> hedged.events
+    [HedgeEvent(kind='start', index=0, ...), HedgeEvent(kind='start', index=1, ...), ...]
+
+"""
+
+from .node_manager import NodeManagerErrorNoNode
+from .node_pool import NodeManagerPoolError
+from collections import namedtuple
+
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger('aplinux.distribution')
+
+
+HedgeEvent = namedtuple('HedgeEvent', ['kind', 'index', 'name', 'elapsed', 'error'])
+HedgeEvent.__doc__ = """An event of a hedged create
+
+kind is one of 'start', 'fail', 'win' or 'cancel', index is the rank of the candidate and
+elapsed is the number of seconds since the hedged create started. error is the repr of the
+exception of a failed candidate.
+"""
+
+
+class _Candidate(object):
+    """A candidate node manager and the state of its creation"""
+
+    def __init__(self, index, node_manager):
+        self.index = index
+        self.node_manager = node_manager
+        self.done = threading.Event()
+        self.error = None
+        self.launched = None
+        self.cancelled = False
+        self.destroyed = False
+
+
+class HedgedCreate(object):
+    """Create a tempory node from whichever of a ranked list of candidates is ready first
+
+    Attributes:
+        candidates: The TemporyNode instances, in order of preference, which have not yet been created
+        hedge_after: The seconds to wait for the latest candidate to be ready before also creating the next
+        on_event: Optional callable called with each HedgeEvent
+        destroy_wait_policy: The BackoffPolicy losing candidates are destroyed with, or None for their own
+        reaper: The NodeReaper losing candidates are handed to, or None to destroy them on their own threads
+        consistency_delay: The seconds waited before destroying a candidate whose create failed
+        events: The HedgeEvents of the last create
+        winner: The node manager which was kept, or None
+    """
+
+    @classmethod
+    def from_options(cls, node_class, driver, options, hedge_after=60, on_event=None, destroy_wait_policy=None,
+                     reaper=None, consistency_delay=3, **kwargs):
+        """Return a HedgedCreate of node_class candidates
+
+        Args:
+            node_class: The TemporyNode class
+            driver: The libcloud driver
+            options: A ranked list of dicts of the keyword arguments which differ between the
+                candidates, such as location and size
+            hedge_after: See HedgedCreate
+            on_event: See HedgedCreate
+            destroy_wait_policy: See HedgedCreate
+            reaper: See HedgedCreate
+            consistency_delay: See HedgedCreate
+            **kwargs: The keyword arguments shared by the candidates
+        """
+        candidates = [node_class(driver, **{**kwargs, **option}) for option in options]
+        return cls(candidates, hedge_after=hedge_after, on_event=on_event, destroy_wait_policy=destroy_wait_policy,
+                   reaper=reaper, consistency_delay=consistency_delay)
+
+    def __init__(self, candidates, hedge_after=60, on_event=None, poll_interval=0.5, destroy_wait_policy=None,
+                 reaper=None, consistency_delay=3):
+        """Initialize the hedged create
+
+        Args:
+            candidates: The node managers in order of preference
+            hedge_after: The seconds to wait before creating the next candidate
+            on_event: A callable taking a HedgeEvent, called from the thread the event occured in
+            poll_interval: The seconds between checks of whether a cancelled candidate has a node to destroy
+            destroy_wait_policy: The BackoffPolicy losing candidates are destroyed with, waiting for them to
+                terminate. Defaults to each candidate's destroy_wait_policy
+            reaper: An optional NodeReaper which losing candidates are handed to instead
+            consistency_delay: Seconds to wait before destroying a candidate whose create failed, in
+                case the node was created and the provider list api is eventually consistant
+        """
+        self.candidates = list(candidates)
+        assert self.candidates, 'at least one candidate is required'
+        self.hedge_after = hedge_after
+        self.on_event = on_event
+        self.poll_interval = poll_interval
+        self.destroy_wait_policy = destroy_wait_policy
+        self.reaper = reaper
+        self.consistency_delay = consistency_delay
+        self.events = []
+        self.winner = None
+        self._start = None
+        self._condition = threading.Condition()
+
+    def _event(self, kind, candidate, error=None):
+        event = HedgeEvent(kind, candidate.index, candidate.node_manager.name, time.monotonic() - self._start,
+                           None if error is None else repr(error))
+        logger.info(f'Hedged create {kind} of candidate {event.index} {event.name} after {event.elapsed:.1f}s')
+        with self._condition:
+            self.events.append(event)
+        if self.on_event is not None:
+            try:
+                self.on_event(event)
+            except Exception:
+                logger.exception('Hedged create event callback failed')
+
+    def _run(self, candidate):
+        """Create a candidate in its own thread"""
+        try:
+            candidate.node_manager.create()
+        except BaseException as err:  # we can use BaseException since the candidate thread ends here
+            candidate.error = err
+        with self._condition:
+            candidate.done.set()
+            won = candidate.error is None and self.winner is None
+            if won:
+                self.winner = candidate.node_manager
+            lost = candidate.error is None and not won
+            cancelled = candidate.cancelled
+            self._condition.notify_all()
+        if won:
+            self._event('win', candidate)
+        elif not cancelled:  # a cancelled candidate is destroyed by _cancel
+            self._event('cancel' if lost else 'fail', candidate, candidate.error)
+            self._destroy(candidate)
+
+    def _destroy(self, candidate):
+        """Destroy the node of a losing or failed candidate if it has one, waiting for it to terminate"""
+        with self._condition:
+            if candidate.destroyed:
+                return
+            candidate.destroyed = True
+        if candidate.error is not None:
+            # a create which failed, for example by timing out, may still have created a node
+            time.sleep(self.consistency_delay)
+        if self.reaper is not None:
+            self.reaper.submit(candidate.node_manager)
+            return
+        try:
+            candidate.node_manager.destroy(wait_policy=self.destroy_wait_policy)
+        except NodeManagerErrorNoNode:
+            pass
+        except Exception:
+            logger.exception(f'Failed to destroy hedged create candidate {candidate.node_manager.name}')
+
+    def _cancel(self, candidate):
+        """Destroy a losing candidate as soon as its node exists, or once its create has ended"""
+        while candidate.node_manager.node is None and not candidate.done.wait(self.poll_interval):
+            pass
+        self._destroy(candidate)
+
+    def create(self):
+        """Create the candidates as needed, returning the node manager of the first to be ready
+
+        Raises:
+            NodeManagerPoolError: If every candidate failed. Its errors are those of the candidates
+        """
+        self._start = time.monotonic()
+        self.events = []
+        self.winner = None
+        launched = []
+        remaining = [_Candidate(index, nm) for index, nm in enumerate(self.candidates)]
+        with self._condition:
+            while self.winner is None:
+                running = [candidate for candidate in launched if not candidate.done.is_set()]
+                if remaining and (not running or time.monotonic() - launched[-1].launched >= self.hedge_after):
+                    candidate = remaining.pop(0)
+                    candidate.launched = time.monotonic()
+                    launched.append(candidate)
+                    self._condition.release()
+                    try:
+                        self._event('start', candidate)
+                        threading.Thread(target=self._run, args=(candidate,),
+                                         name=f'hedged-create-{candidate.node_manager.name}').start()
+                    finally:
+                        self._condition.acquire()
+                    continue
+                if not running:
+                    break
+                timeout = None
+                if remaining:
+                    timeout = max(0, launched[-1].launched + self.hedge_after - time.monotonic())
+                self._condition.wait(timeout)
+            losers = [candidate for candidate in launched if candidate.node_manager is not self.winner]
+            for candidate in losers:
+                candidate.cancelled = not candidate.done.is_set()
+
+        if self.winner is None:
+            errors = [candidate.error for candidate in launched]
+            raise NodeManagerPoolError(f'All {len(errors)} hedged create candidates failed', errors) from errors[-1]
+
+        for candidate in losers:
+            if candidate.cancelled:
+                self._event('cancel', candidate)
+                threading.Thread(target=self._cancel, args=(candidate,),
+                                 name=f'hedged-cancel-{candidate.node_manager.name}').start()
+        return self.winner
+
+    def destroy(self):
+        """Destroy the winning node"""
+        if self.winner is not None:
+            self.winner.destroy()
+
+    def __enter__(self):
+        return self.create()
+
+    def __exit__(self, exc_type, ex_value, ex_tb):
+        self.destroy()
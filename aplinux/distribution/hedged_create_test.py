@@ -0,0 +1,121 @@
+# -*- coding:utf-8 -*-
+
+from . import hedged_create
+from .node_pool import NodeManagerPoolError
+from .wait_policy import BackoffPolicy
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+import threading
+import time
+
+
+class FakeNodeManager(object):
+
+    def __init__(self, name, delay=0, error=None):
+        self.name = name
+        self.delay = delay
+        self.error = error
+        self.node = None
+        self.destroyed = threading.Event()
+        self.destroy_calls = 0
+        self.wait_policy = None
+
+    def create(self):
+        self.node = object()
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+
+    def destroy(self, wait_policy=None):
+        self.destroy_calls += 1
+        self.wait_policy = wait_policy
+        self.destroyed.set()
+
+
+class TestHedgedCreate(TestCase):
+
+    def kinds(self, hedged):
+        return [(event.kind, event.index) for event in hedged.events]
+
+    def test_first_wins(self):
+        first, second = FakeNodeManager('first'), FakeNodeManager('second')
+        hedged = hedged_create.HedgedCreate([first, second], hedge_after=10)
+        self.assertIs(hedged.create(), first)
+        self.assertEqual(self.kinds(hedged), [('start', 0), ('win', 0)])
+        self.assertIsNone(second.node)
+
+    def test_hedge(self):
+        slow, fast = FakeNodeManager('slow', delay=1), FakeNodeManager('fast', delay=0.01)
+        events = []
+        hedged = hedged_create.HedgedCreate([slow, fast], hedge_after=0.05, on_event=events.append,
+                                            poll_interval=0.01)
+        start = time.monotonic()
+        self.assertIs(hedged.create(), fast)
+        self.assertTrue(slow.destroyed.wait(0.5))
+        self.assertLess(time.monotonic() - start, 0.9)  # the loser is destroyed without waiting for its create
+        self.assertEqual(self.kinds(hedged), [('start', 0), ('start', 1), ('win', 1), ('cancel', 0)])
+        self.assertEqual(events, hedged.events)
+        self.assertGreaterEqual(hedged.events[1].elapsed, 0.05)
+        self.assertEqual(fast.destroy_calls, 0)
+
+    def test_failure_starts_next(self):
+        failing, second = FakeNodeManager('failing', error=RuntimeError('no capacity')), FakeNodeManager('second')
+        hedged = hedged_create.HedgedCreate([failing, second], hedge_after=10, consistency_delay=0.2)
+        start = time.monotonic()
+        self.assertIs(hedged.create(), second)
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(self.kinds(hedged)[:2], [('start', 0), ('fail', 0)])
+        self.assertEqual(hedged.events[1].error, "RuntimeError('no capacity')")
+        self.assertTrue(failing.destroyed.wait(5))
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)  # in case the failed create made a node after all
+        self.assertEqual(failing.destroy_calls, 1)
+
+    def test_destroy_wait_policy(self):
+        failing, second = FakeNodeManager('failing', error=RuntimeError('no capacity')), FakeNodeManager('second')
+        wait_policy = BackoffPolicy(deadline=30)
+        hedged = hedged_create.HedgedCreate([failing, second], hedge_after=10, destroy_wait_policy=wait_policy,
+                                            consistency_delay=0)
+        hedged.create()
+        self.assertTrue(failing.destroyed.wait(5))
+        self.assertIs(failing.wait_policy, wait_policy)
+
+    def test_reaper(self):
+        slow, fast = FakeNodeManager('slow', delay=1), FakeNodeManager('fast', delay=0.01)
+        reaper = MagicMock()
+        submitted = threading.Event()
+        reaper.submit.side_effect = lambda nm: submitted.set()
+        hedged = hedged_create.HedgedCreate([slow, fast], hedge_after=0.05, poll_interval=0.01, reaper=reaper)
+        self.assertIs(hedged.create(), fast)
+        self.assertTrue(submitted.wait(0.5))
+        reaper.submit.assert_called_once_with(slow)
+        self.assertEqual(slow.destroy_calls, 0)
+
+    def test_all_fail(self):
+        errors = [RuntimeError('a'), RuntimeError('b')]
+        hedged = hedged_create.HedgedCreate([FakeNodeManager('a', error=errors[0]),
+                                             FakeNodeManager('b', error=errors[1])], hedge_after=10,
+                                            consistency_delay=0)
+        with self.assertRaises(NodeManagerPoolError) as cm:
+            hedged.create()
+        self.assertEqual(cm.exception.errors, errors)
+        self.assertIsNone(hedged.winner)
+
+    def test_context(self):
+        nm = FakeNodeManager('nm')
+        with hedged_create.HedgedCreate([nm]) as winner:
+            self.assertIs(winner, nm)
+            self.assertEqual(nm.destroy_calls, 0)
+        self.assertEqual(nm.destroy_calls, 1)
+
+    def test_from_options(self):
+        node_class, driver = MagicMock(), MagicMock()
+        hedged = hedged_create.HedgedCreate.from_options(node_class, driver,
+                                                         [{'location': 'a'}, {'location': 'b', 'size': 'big'}],
+                                                         hedge_after=30, consistency_delay=5, image='debian',
+                                                         size='small')
+        self.assertEqual(hedged.hedge_after, 30)
+        self.assertEqual(hedged.consistency_delay, 5)
+        self.assertEqual(len(hedged.candidates), 2)
+        node_class.assert_any_call(driver, image='debian', size='small', location='a')
+        node_class.assert_any_call(driver, image='debian', size='big', location='b')
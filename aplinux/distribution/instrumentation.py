@@ -0,0 +1,215 @@
+# -*- coding:utf-8 -*-
+"""Timing of tempory node lifecycle phases
+
+Node managers record a span for each phase of a node's life, such as create_node,
+wait_until_ready or stop_and_create_image. Finished spans are passed to sinks and
+aggregated into per phase summaries::
+
+    >>> instrumentation = Instrumentation(sinks=[JSONLinesSink('spans.jsonl')])
+    >>> with TemporyGCENode(driver, instrumentation=instrumentation, **kwargs) as nm:
+    >>>     with nm.span('fabfile.build'):
+    >>>         fabfile.build(nm.fabric)
+    >>> instrumentation.summaries['wait_until_ready'].p95
+    42.1
+    >>> instrumentation.write_prometheus('/var/lib/node_exporter/aplinux.prom')
+
+A sink is any callable which takes a finished Span.
+"""
+
+from collections import deque
+from contextlib import contextmanager
+
+import json
+import logging
+import os
+import threading
+import time
+
+
+logger = logging.getLogger('aplinux.distribution')
+
+
+class Span(object):
+    """A timed phase
+
+    Attributes:
+        name: The phase name
+        start: The wall clock start time in seconds since the epoch
+        end: The wall clock end time or None while the span is running
+        duration: The monotonic duration in seconds or None while the span is running
+        attributes: A dict of metadata such as the node name and driver
+        error: The repr of the exception which ended the span, if any
+    """
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.start = time.time()
+        self.end = None
+        self.duration = None
+        self.error = None
+        self._start = time.monotonic()
+
+    def finish(self, error=None):
+        self.duration = time.monotonic() - self._start
+        self.end = self.start + self.duration
+        if error is not None:
+            self.error = repr(error)
+
+    def as_dict(self):
+        return {'name': self.name,
+                'start': self.start,
+                'end': self.end,
+                'duration': self.duration,
+                'error': self.error,
+                **self.attributes}
+
+    def __repr__(self):
+        return f'<Span {self.name} duration={self.duration} {self.attributes}>'
+
+
+class PhaseSummary(object):
+    """Aggregated durations of a phase
+
+    Attributes:
+        name: The phase name
+        count: The number of spans
+        errors: The number of spans which ended with an exception
+        total: The sum of the durations
+        durations: The most recent durations, used for percentiles
+    """
+
+    def __init__(self, name, max_samples=1000):
+        self.name = name
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.durations = deque(maxlen=max_samples)
+
+    def add(self, span):
+        self.count += 1
+        self.errors += span.error is not None
+        self.total += span.duration
+        self.min = span.duration if self.min is None else min(self.min, span.duration)
+        self.max = span.duration if self.max is None else max(self.max, span.duration)
+        self.durations.append(span.duration)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, percent):
+        """Return the duration below which percent of the recent durations fall"""
+        if not self.durations:
+            return None
+        durations = sorted(self.durations)
+        return durations[min(len(durations) - 1, int(len(durations) * percent / 100))]
+
+    @property
+    def p50(self):
+        return self.percentile(50)
+
+    @property
+    def p95(self):
+        return self.percentile(95)
+
+    def as_dict(self):
+        return {'name': self.name, 'count': self.count, 'errors': self.errors, 'total': self.total,
+                'mean': self.mean, 'min': self.min, 'max': self.max, 'p50': self.p50, 'p95': self.p95}
+
+
+class Instrumentation(object):
+    """Records spans, passes them to sinks and keeps per phase summaries
+
+    Attributes:
+        sinks: A list of callables passed each finished Span
+        summaries: A dict of phase name to PhaseSummary
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    @classmethod
+    def default(cls):
+        """Return the process wide instrumentation which node managers use when none is given"""
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+
+    def __init__(self, sinks=None):
+        self.sinks = list(sinks or [])
+        self.summaries = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Time the body of the context as a span with the given name and attributes"""
+        span = Span(name, attributes)
+        try:
+            yield span
+        except BaseException as err:  # we can use BaseException since we are re-raising it
+            span.finish(err)
+            self.record(span)
+            raise
+        span.finish()
+        self.record(span)
+
+    def record(self, span):
+        """Add a finished span to the summaries and pass it to the sinks"""
+        with self._lock:
+            summary = self.summaries.get(span.name)
+            if summary is None:
+                summary = self.summaries[span.name] = PhaseSummary(span.name)
+            summary.add(span)
+        logger.debug(f'{span.name} took {span.duration:.2f}s {span.attributes}')
+        for sink in self.sinks:
+            try:
+                sink(span)
+            except Exception:
+                logger.exception(f'Instrumentation sink {sink!r} failed')
+
+    def summary(self):
+        """Return a list of the phase summaries as dicts sorted by total time"""
+        with self._lock:
+            summaries = [summary.as_dict() for summary in self.summaries.values()]
+        return sorted(summaries, key=lambda summary: summary['total'], reverse=True)
+
+    def prometheus_text(self, prefix='aplinux_node_phase'):
+        """Return the summaries in the Prometheus text exposition format"""
+        lines = [f'# HELP {prefix}_seconds Duration of tempory node lifecycle phases',
+                 f'# TYPE {prefix}_seconds summary']
+        errors = [f'# HELP {prefix}_errors_total Tempory node lifecycle phases which raised an exception',
+                  f'# TYPE {prefix}_errors_total counter']
+        for summary in self.summary():
+            label = '{phase="%s"}' % summary['name'].replace('\\', '\\\\').replace('"', '\\"')
+            quantile = label[:-1] + ',quantile="%s"}'
+            lines += [f'{prefix}_seconds{quantile % "0.5"} {summary["p50"]}',
+                      f'{prefix}_seconds{quantile % "0.95"} {summary["p95"]}',
+                      f'{prefix}_seconds_sum{label} {summary["total"]}',
+                      f'{prefix}_seconds_count{label} {summary["count"]}']
+            errors.append(f'{prefix}_errors_total{label} {summary["errors"]}')
+        return '\n'.join(lines + errors) + '\n'
+
+    def write_prometheus(self, path, prefix='aplinux_node_phase'):
+        """Atomically write the summaries to a file for the node exporter textfile collector"""
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w') as fout:
+            fout.write(self.prometheus_text(prefix))
+        os.replace(temp_path, path)
+
+
+class JSONLinesSink(object):
+    """A sink which appends each span to a file as a line of json"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, span):
+        line = json.dumps(span.as_dict(), default=str)
+        with self._lock:
+            with open(self.path, 'a') as fout:
+                fout.write(line + '\n')
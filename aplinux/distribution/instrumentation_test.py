@@ -0,0 +1,93 @@
+# -*- coding:utf-8 -*-
+
+from . import instrumentation
+from unittest import TestCase
+from unittest.mock import patch
+
+import json
+import os
+import tempfile
+
+
+class TestInstrumentation(TestCase):
+
+    def setUp(self):
+        self.spans = []
+        self.instrumentation = instrumentation.Instrumentation(sinks=[self.spans.append])
+
+    def test_span(self):
+        with self.instrumentation.span('create_node', node='node-1') as span:
+            self.assertIsNone(span.duration)
+        self.assertEqual(self.spans, [span])
+        self.assertGreaterEqual(span.duration, 0)
+        self.assertEqual(span.end, span.start + span.duration)
+        self.assertEqual(span.as_dict()['node'], 'node-1')
+        self.assertIsNone(span.error)
+
+    def test_span_error(self):
+        with self.assertRaises(ValueError):
+            with self.instrumentation.span('create_node'):
+                raise ValueError('quota')
+        self.assertEqual(self.spans[0].error, "ValueError('quota')")
+        self.assertEqual(self.instrumentation.summaries['create_node'].errors, 1)
+
+    def test_failing_sink(self):
+        def sink(span):
+            raise RuntimeError()
+        self.instrumentation.sinks.insert(0, sink)
+        with self.instrumentation.span('destroy'):
+            pass
+        self.assertEqual(len(self.spans), 1)
+
+    @patch('time.monotonic')
+    def test_summary(self, monotonic):
+        for duration in range(1, 101):
+            monotonic.side_effect = [0, duration]
+            with self.instrumentation.span('wait_until_ready'):
+                pass
+        monotonic.side_effect = [0, 1000]
+        with self.instrumentation.span('create_image'):
+            pass
+        summary = self.instrumentation.summaries['wait_until_ready']
+        self.assertEqual((summary.count, summary.total, summary.min, summary.max), (100, 5050, 1, 100))
+        self.assertEqual(summary.mean, 50.5)
+        self.assertEqual(summary.p50, 51)
+        self.assertEqual(summary.p95, 96)
+        self.assertEqual([phase['name'] for phase in self.instrumentation.summary()],
+                         ['wait_until_ready', 'create_image'])
+
+        text = self.instrumentation.prometheus_text()
+        self.assertIn('aplinux_node_phase_seconds{phase="wait_until_ready",quantile="0.95"} 96', text)
+        self.assertIn('aplinux_node_phase_seconds_count{phase="create_image"} 1', text)
+        self.assertIn('aplinux_node_phase_errors_total{phase="create_image"} 0', text)
+
+    def test_default(self):
+        self.assertIs(instrumentation.Instrumentation.default(), instrumentation.Instrumentation.default())
+
+
+class TestSinks(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def test_json_lines_sink(self):
+        path = os.path.join(self.temp_dir.name, 'spans.jsonl')
+        recorder = instrumentation.Instrumentation(sinks=[instrumentation.JSONLinesSink(path)])
+        for name in ('create_node', 'destroy'):
+            with recorder.span(name, node='node-1'):
+                pass
+        with open(path) as fin:
+            lines = [json.loads(line) for line in fin]
+        self.assertEqual([line['name'] for line in lines], ['create_node', 'destroy'])
+        self.assertEqual(lines[0]['node'], 'node-1')
+
+    def test_write_prometheus(self):
+        path = os.path.join(self.temp_dir.name, 'aplinux.prom')
+        recorder = instrumentation.Instrumentation()
+        with recorder.span('destroy'):
+            pass
+        recorder.write_prometheus(path)
+        with open(path) as fin:
+            self.assertEqual(fin.read(), recorder.prometheus_text())
+        self.assertFalse(os.path.exists(path + '.tmp'))
@@ -0,0 +1,237 @@
+# -*- coding:utf-8 -*-
+"""SSH key generation for tempory nodes
+
+Node managers draw their key material from a key provider. Ed25519 keys are much
+cheaper to generate than RSA keys and a KeyPool generates keys on a background
+thread so that they are ready before a node manager needs one::
+
+    >>> key_provider = KeyPool(Ed25519KeyProvider(), size=8)
+    >>> nm = TemporyGCENode(driver, key_provider=key_provider, **kwargs)
+
+"""
+
+from collections import namedtuple
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+from cryptography.hazmat.primitives.serialization import Encoding
+from cryptography.hazmat.primitives.serialization import NoEncryption
+from cryptography.hazmat.primitives.serialization import PrivateFormat
+from io import StringIO
+from libcloud.compute.base import KeyPair
+from paramiko.ed25519key import Ed25519Key
+from paramiko.rsakey import RSAKey
+
+import logging
+import paramiko
+import queue
+import threading
+import time
+import uuid
+
+
+logger = logging.getLogger('aplinux.distribution')
+
+
+GeneratedKey = namedtuple('GeneratedKey', ['key_type', 'public_key_base64', 'private_key', 'fingerprint'])
+
+
+def load_private_key(private_key):
+    """Return a paramiko key object from a private key string of any supported type"""
+    if 'OPENSSH PRIVATE KEY' in private_key:
+        key_classes = (paramiko.Ed25519Key, paramiko.RSAKey, paramiko.ECDSAKey)
+    else:
+        key_classes = (paramiko.RSAKey, paramiko.ECDSAKey)
+    error = None
+    for key_class in key_classes:
+        try:
+            return key_class.from_private_key(StringIO(private_key))
+        except paramiko.SSHException as err:
+            error = err
+    raise error
+
+
+class KeyProvider(object):
+    """Base class of ssh key providers"""
+
+    def generate(self):
+        """Return a new GeneratedKey"""
+        raise NotImplementedError()
+
+
+class RSAKeyProvider(KeyProvider):
+    """Generate RSA keys"""
+
+    def __init__(self, bits=2048):
+        self.bits = bits
+
+    def generate(self):
+        key = RSAKey.generate(self.bits)
+        private_key_fout = StringIO()
+        key.write_private_key(private_key_fout)
+        return GeneratedKey(key_type='ssh-rsa',
+                            public_key_base64=key.get_base64(),
+                            private_key=private_key_fout.getvalue(),
+                            fingerprint=key.get_fingerprint())
+
+
+class Ed25519KeyProvider(KeyProvider):
+    """Generate Ed25519 keys"""
+
+    def generate(self):
+        # paramiko can neither generate nor write Ed25519 keys, so use cryptography directly
+        private_key = Ed25519PrivateKey.generate().private_bytes(Encoding.PEM,
+                                                                 PrivateFormat.OpenSSH,
+                                                                 NoEncryption()).decode('ascii')
+        key = Ed25519Key.from_private_key(StringIO(private_key))
+        return GeneratedKey(key_type='ssh-ed25519',
+                            public_key_base64=key.get_base64(),
+                            private_key=private_key,
+                            fingerprint=key.get_fingerprint())
+
+
+class KeyPoolError(Exception):
+    """The provider of a KeyPool has repeatedly failed to generate a key"""
+
+
+class KeyPool(KeyProvider):
+    """A provider which keeps a number of pre-generated keys from another provider ready
+
+    Keys are generated on a background daemon thread. If the pool is empty when a key is
+    requested then one is generated immediately rather than waiting for the pool. A failed
+    background generation is logged and retried with exponential backoff.
+
+    Attributes:
+        provider: The provider used to generate keys
+        size: The number of keys kept ready
+        retry_delay: The seconds before the first retry of a failed background generation
+        max_retry_delay: The upper bound of the delay between retries
+        max_failures: The number of consecutive background failures after which generate
+            raises a KeyPoolError when the pool is empty
+        failures: The number of consecutive background failures
+        last_error: The error of the last background failure, or None after a success
+    """
+
+    def __init__(self, provider=None, size=4, retry_delay=1, max_retry_delay=60, max_failures=3):
+        self.provider = provider or Ed25519KeyProvider()
+        self.size = size
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_failures = max_failures
+        self.failures = 0
+        self.last_error = None
+        self._keys = queue.Queue(maxsize=size)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._fill, name='key-pool', daemon=True)
+        self._thread.start()
+
+    def _fill(self):
+        """Keep the pool full"""
+        delay = self.retry_delay
+        while True:
+            try:
+                key = self.provider.generate()
+            except Exception as err:
+                with self._lock:
+                    self.failures += 1
+                    self.last_error = err
+                logger.exception(f'Failed to pre-generate an ssh key, retrying in {delay} seconds')
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+                continue
+            with self._lock:
+                self.failures = 0
+                self.last_error = None
+            delay = self.retry_delay
+            self._keys.put(key)
+
+    def generate(self):
+        """Return a pre-generated key, or generate one if the pool is empty
+
+        Raises:
+            KeyPoolError: If the pool is empty and the background generation has failed
+                max_failures times in a row
+        """
+        try:
+            return self._keys.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            failures, last_error = self.failures, self.last_error
+        if failures >= self.max_failures:
+            raise KeyPoolError(f'The key pool failed to generate {failures} keys in a row') from last_error
+        return self.provider.generate()
+
+
+class SharedKeyPair(object):
+    """A key pair shared by every node manager in a session
+
+    The key is generated once. For providers which need the public key registered, such as
+    EC2, it is imported on the first acquire and deleted when the last node manager releases
+    it, so a fleet of tempory nodes costs two key pair api calls rather than two per node::
+
+        >>> with SharedKeyPair(driver) as session:
+        >>>     managers = [TemporyEC2Node(driver, key_pair_session=session, **kwargs) for i in range(10)]
+
+    Attributes:
+        driver: The libcloud driver the key pair is imported with
+        name: The key pair name
+        user: The user name used as the public key comment
+        key_provider: The KeyProvider used to generate the key
+    """
+
+    def __init__(self, driver, name=None, user='admin', key_provider=None):
+        self.driver = driver
+        self.name = name or f'key-pair-session-{uuid.uuid4()}'
+        self.user = user
+        self.key_provider = key_provider or RSAKeyProvider()
+        self.count = 0
+        self.imported = False
+        self._key_pair = None
+        self._lock = threading.Lock()
+
+    @property
+    def key_pair(self):
+        """The shared libcloud key pair, generated on first use"""
+        with self._lock:
+            if self._key_pair is None:
+                key = self.key_provider.generate()
+                self._key_pair = KeyPair(self.name,
+                                         public_key=f'{key.key_type} {key.public_key_base64} {self.user}',
+                                         fingerprint=key.fingerprint,
+                                         driver=self.driver,
+                                         private_key=key.private_key)
+            return self._key_pair
+
+    def acquire(self, import_key=True):
+        """Take a reference to the key pair importing it into the driver if needed"""
+        key_pair = self.key_pair
+        with self._lock:
+            if import_key and not self.imported:
+                logger.info(f'Importing shared key pair: {self.name}')
+                self.driver.import_key_pair_from_string(key_pair.name, key_pair.public_key)
+                self.imported = True
+            self.count += 1
+        return key_pair
+
+    def release(self):
+        """Release a reference deleting the imported key pair when the last one is released"""
+        with self._lock:
+            self.count -= 1
+            if self.count <= 0:
+                self.count = 0
+                self._delete()
+
+    def _delete(self):
+        """Delete an imported key pair. Must be called with the lock held"""
+        if self.imported:
+            logger.info(f'Deleting shared key pair: {self.name}')
+            self.imported = False
+            self.driver.delete_key_pair(self._key_pair)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, ex_value, ex_tb):
+        """Make sure the key pair is deleted even if references were leaked"""
+        with self._lock:
+            self.count = 0
+            self._delete()
@@ -0,0 +1,123 @@
+# -*- coding:utf-8 -*-
+
+from . import key_provider
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+import paramiko
+import threading
+import time
+
+
+class TestKeyProviders(TestCase):
+
+    def test_rsa(self):
+        key = key_provider.RSAKeyProvider(bits=1024).generate()
+        self.assertEqual(key.key_type, 'ssh-rsa')
+        pkey = key_provider.load_private_key(key.private_key)
+        self.assertIsInstance(pkey, paramiko.RSAKey)
+        self.assertEqual(pkey.get_base64(), key.public_key_base64)
+        self.assertEqual(pkey.get_fingerprint(), key.fingerprint)
+
+    def test_ed25519(self):
+        key = key_provider.Ed25519KeyProvider().generate()
+        self.assertEqual(key.key_type, 'ssh-ed25519')
+        pkey = key_provider.load_private_key(key.private_key)
+        self.assertIsInstance(pkey, paramiko.Ed25519Key)
+        self.assertEqual(pkey.get_base64(), key.public_key_base64)
+
+    def test_load_private_key_invalid(self):
+        with self.assertRaises(paramiko.SSHException):
+            key_provider.load_private_key('not a key')
+
+
+class TestKeyPool(TestCase):
+
+    def test_generate(self):
+        provider = MagicMock()
+        provider.generate.side_effect = range(100)
+        pool = key_provider.KeyPool(provider, size=2)
+        deadline = time.monotonic() + 5
+        while not pool._keys.full() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(pool.generate(), 0)
+        self.assertEqual(pool.generate(), 1)
+
+    def test_generate_empty(self):
+        def generate():
+            if threading.current_thread().name == 'key-pool':
+                raise Exception('broken entropy')
+            return 'key'
+        provider = MagicMock()
+        provider.generate.side_effect = generate
+        pool = key_provider.KeyPool(provider, size=2, retry_delay=60)
+        self.assertEqual(pool.generate(), 'key')
+
+    def test_fill_retries(self):
+        provider = MagicMock()
+        provider.generate.side_effect = [Exception('broken entropy'), Exception('broken entropy')] + list(range(100))
+        pool = key_provider.KeyPool(provider, size=2, retry_delay=0)
+        deadline = time.monotonic() + 5
+        while not pool._keys.full() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(pool.generate(), 0)
+        self.assertEqual(pool.failures, 0)
+        self.assertIsNone(pool.last_error)
+
+    def test_repeated_failures(self):
+        fixed = threading.Event()
+        self.addCleanup(fixed.set)  # let the pool fill so the background thread stops retrying
+
+        def generate():
+            if not fixed.is_set():
+                raise Exception('broken entropy')
+            return 'key'
+        provider = MagicMock()
+        provider.generate.side_effect = generate
+        pool = key_provider.KeyPool(provider, size=2, retry_delay=0.001, max_retry_delay=0.001, max_failures=2)
+        deadline = time.monotonic() + 5
+        while pool.failures < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        with self.assertRaises(key_provider.KeyPoolError) as cm:
+            pool.generate()
+        self.assertEqual(str(cm.exception.__cause__), 'broken entropy')
+        self.assertTrue(pool._thread.is_alive())
+
+
+class TestSharedKeyPair(TestCase):
+
+    def setUp(self):
+        self.driver = MagicMock()
+        provider = MagicMock()
+        provider.generate.return_value = key_provider.GeneratedKey('ssh-ed25519', 'AAAA', 'private', 'finger')
+        self.session = key_provider.SharedKeyPair(self.driver, name='session-key', key_provider=provider)
+
+    def test_key_pair(self):
+        key_pair = self.session.key_pair
+        self.assertIs(self.session.key_pair, key_pair)
+        self.assertEqual(key_pair.name, 'session-key')
+        self.assertEqual(key_pair.public_key, 'ssh-ed25519 AAAA admin')
+        self.assertEqual(key_pair.private_key, 'private')
+
+    def test_reference_counting(self):
+        for i in range(3):
+            self.session.acquire()
+        self.driver.import_key_pair_from_string.assert_called_once_with('session-key', 'ssh-ed25519 AAAA admin')
+        self.session.release()
+        self.session.release()
+        self.driver.delete_key_pair.assert_not_called()
+        self.session.release()
+        self.driver.delete_key_pair.assert_called_once_with(self.session.key_pair)
+        self.assertFalse(self.session.imported)
+
+    def test_acquire_without_import(self):
+        self.session.acquire(import_key=False)
+        self.session.release()
+        self.driver.import_key_pair_from_string.assert_not_called()
+        self.driver.delete_key_pair.assert_not_called()
+
+    def test_context_cleans_up_leaked_references(self):
+        with self.session:
+            self.session.acquire()
+        self.driver.delete_key_pair.assert_called_once_with(self.session.key_pair)
+        self.assertEqual(self.session.count, 0)
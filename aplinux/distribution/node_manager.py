@@ -11,20 +11,23 @@ Creating a tempory instance such as::
 
 """
 
-from . import fabric
+from .instrumentation import Instrumentation
+from .key_provider import load_private_key
+from .key_provider import RSAKeyProvider
+from .output_sink import RotatingLogSink
+from .readiness import SSHReadinessProbe
+from .wait_policy import BackoffPolicy
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from io import StringIO
 from libcloud.compute.base import KeyPair
 from libcloud.compute.types import LibcloudError
 from libcloud.compute.types import NodeState
-from paramiko.rsakey import RSAKey
-from retry import retry
 
-import code
 import logging
 import os
-import paramiko
 import sys
+import threading
 import time
 import traceback
 import uuid
@@ -54,9 +57,11 @@ class TemporyNode(object):
         user: The user to connect with
         create_kwargs: The kwargs passed to the create_node method
         node: The libcloud node or None if it hasn't been created
+        node_poller: An optional NodeStatePoller used instead of calling list_nodes directly
     """
 
     _name = None
+    _changed_at = None  # the time.monotonic() of the last create_node or destroy, earlier node polls are stale
 
     @property
     def name(self):
@@ -76,7 +81,7 @@ class TemporyNode(object):
     def size(self):
         """the libcloud size value"""
         if self._size is None:
-            sizes = self.driver.list_sizes()
+            sizes = (self.catalog or self.driver).list_sizes()
             if len(sizes) > 0:
                 self._size = sizes[0]
         return self._size
@@ -100,25 +105,14 @@ class TemporyNode(object):
     def key_pair(self):
         """key pair object used for authentication. If None, then a akey_pair can be generated"""
         if self._key_pair is None:
-
-            # generate a key
-            key = RSAKey.generate(2048)
-            fingerprint = key.get_fingerprint()
-
-            # construct the public key
-            public_key_base64 = key.get_base64()
-            public_key = f'ssh-rsa {public_key_base64} {self.user}'
-
-            # construct the private key
-            private_key_fout = StringIO()
-            key.write_private_key(private_key_fout)
-            private_key = private_key_fout.getvalue()
-
+            with self.span('generate_key'):
+                key = self.key_provider.generate()
+            public_key = f'{key.key_type} {key.public_key_base64} {self.user}'
             self._key_pair = KeyPair(f'key-pair-{self.name}',
                                      public_key=public_key,
-                                     fingerprint=fingerprint,
+                                     fingerprint=key.fingerprint,
                                      driver=self.driver,
-                                     private_key=private_key)
+                                     private_key=key.private_key)
 
         return self._key_pair
 
@@ -142,40 +136,90 @@ class TemporyNode(object):
         """Allow for users to set the IP address specificly"""
         self._ip_address = value
 
+    _pkey = None
+
+    @property
+    def pkey(self):
+        """The paramiko key object parsed once from key_pair"""
+        if self._pkey is None:
+            self._pkey = load_private_key(self.key_pair.private_key)
+        return self._pkey
+
+    def _connect(self, user):
+        """Open a fabric connection to the node as the given user"""
+        from . import fabric
+        fabric_con = fabric.ConnectionWithSCP(self.ip_address,
+                                              user=user,
+                                              config=self.fabric_config,
+                                              connect_kwargs={'pkey': self.pkey, 'look_for_keys': False})
+        fabric_con.open()
+        fabric_con.transport.set_keepalive(self.fabric_keepalive)
+        return fabric_con
+
     _fabric = None
 
     @property
     def fabric(self):
         """Return a fabric connection object"""
-        if self._fabric is None and self.ip_address is not None:
-            fin_private_key = StringIO(self.key_pair.private_key)
-            pkey = paramiko.RSAKey.from_private_key(fin_private_key)
-            fabric_con = fabric.ConnectionWithSCP(self.ip_address,
-                                                  user=self.user,
-                                                  config=self.fabric_config,
-                                                  connect_kwargs={'pkey': pkey, 'look_for_keys': False})
-            fabric_con.open()
-            fabric_con.transport.set_keepalive(self.fabric_keepalive)
-            self._fabric = fabric_con
+        with self._fabric_lock:
+            if self._fabric is None and self.ip_address is not None:
+                self._fabric = self._connect(self.user)
         return self._fabric
 
     _fabric_sudo_user = None
 
     @property
     def fabric_sudo_user(self):
-        """Return a fabric connection object"""
-        if self._fabric_sudo_user is None and self.ip_address is not None:
-            fin_private_key = StringIO(self.key_pair.private_key)
-            pkey = paramiko.RSAKey.from_private_key(fin_private_key)
-            fabric_con = fabric.ConnectionWithSCP(self.ip_address,
-                                                  user=self.sudo_user,
-                                                  config=self.fabric_config,
-                                                  connect_kwargs={'pkey': pkey, 'look_for_keys': False})
-            fabric_con.open()
-            fabric_con.transport.set_keepalive(self.fabric_keepalive)
-            self._fabric_sudo_user = fabric_con
+        """Return a fabric connection object for sudo_user
+
+        When sudo_user is the same as user the primary connection is shared. When sudo_user_mode
+        is 'sudo' the commands are run over the primary connection with ``sudo -u``.
+        """
+        from . import fabric
+        with self._fabric_sudo_user_lock:
+            if self._fabric_sudo_user is None and self.ip_address is not None:
+                if self.sudo_user == self.user:
+                    self._fabric_sudo_user = self.fabric
+                elif self.sudo_user_mode == 'sudo':
+                    self._fabric_sudo_user = fabric.SudoAsUser(self.fabric, self.sudo_user)
+                else:
+                    self._fabric_sudo_user = self._connect(self.sudo_user)
         return self._fabric_sudo_user
 
+    def disconnect(self):
+        """Close the fabric connections, they are reopened on next use. For example after the node is restarted"""
+        # the locks are taken in the order fabric_sudo_user takes them
+        with self._fabric_sudo_user_lock, self._fabric_lock:
+            connections = [self._fabric, self._fabric_sudo_user]
+            self._fabric = None
+            self._fabric_sudo_user = None
+            self._ip_address = None
+        for connection in connections:
+            if connection is not None:
+                connection.close()
+
+    _output_sink = None
+
+    @property
+    def output_sink(self):
+        """The sink stream() passes command output to. A RotatingLogSink named after the node if log_dir is set"""
+        if self._output_sink is None and self.log_dir is not None:
+            self._output_sink = RotatingLogSink(os.path.join(self.log_dir, f'{self.name}.log'))
+        return self._output_sink
+
+    @output_sink.setter
+    def output_sink(self, value):
+        self._output_sink = value
+
+    def stream(self, command, sudo_user=False, warn=False):
+        """Run a command passing its output to output_sink keeping only its tail in memory
+
+        Returns:
+            ChannelResult with the tails of stdout and stderr
+        """
+        connection = self.fabric_sudo_user if sudo_user else self.fabric
+        return connection.stream(command, sink=self.output_sink, warn=warn)
+
     def invoke_shell(self, shell_command='/bin/bash -i -l', sudo_user=False):
         """Run an interactive shell for debugging purposes"""
         if sudo_user:
@@ -184,7 +228,10 @@ class TemporyNode(object):
             self.fabric.run(shell_command, pty=True)
 
     def __init__(self, driver, name_prefix=None, size=None, image=None, user='admin', sudo_user='admin', key_pair=None,
-                 poison_pill_minutes=None, fabric_config_defaults=None, fabric_keepalive=5, **kwargs):
+                 poison_pill_minutes=None, fabric_config_defaults=None, fabric_keepalive=5,
+                 node_poller=None, destroy_wait_policy=None, defer_destroy=False, reaper=None,
+                 key_provider=None, key_pair_session=None, ready_wait_policy=None, sudo_user_mode='connection',
+                 output_sink=None, log_dir=None, instrumentation=None, catalog=None, **kwargs):
         """Initialize the tempory node manager.
 
         Instances are later created with the create() method. They are given the name name_prefix
@@ -195,7 +242,26 @@ class TemporyNode(object):
             name_prefix: The desired name prefix for instances.
             size: The desired size. If None then the first from list_sizes is uesed
             user: The user used to create ssh connections with fabric
+            sudo_user: The user with sudo rights used for fabric_sudo_user
+            sudo_user_mode: Either 'connection' to open a separate connection as sudo_user, or 'sudo'
+                to run sudo_user commands over the primary connection with ``sudo -u``
             key_pair: The libcloud key_pair used for fabric connections. Auto generated if None
+            key_provider: The KeyProvider used to generate key_pair. Defaults to 2048 bit RSA keys
+            key_pair_session: A SharedKeyPair whose key pair is used instead of generating one
+            node_poller: A NodeStatePoller shared between node managers. If None then the driver
+                is queried directly each time the node is refreshed
+            destroy_wait_policy: The default BackoffPolicy used by destroy() to wait for termination
+            ready_wait_policy: The default BackoffPolicy used by wait_until_ready()
+            defer_destroy: If True then exiting the context hands the node to a NodeReaper
+                instead of waiting for it to terminate
+            reaper: The NodeReaper used when defer_destroy is set. Defaults to the process wide reaper
+            output_sink: The sink stream() passes command output to, see output_sink.py
+            log_dir: If output_sink is None, a directory where stream() writes the output to a
+                rotating log file named after the node
+            instrumentation: The Instrumentation which records the lifecycle phase spans. Defaults
+                to the process wide instrumentation
+            catalog: A Catalog used to look up the image and size. If None then the driver is
+                queried directly
             **kwargs: The extra arguments passed to driver.create_node()
         """
         # set attributes
@@ -203,24 +269,44 @@ class TemporyNode(object):
         self.name_prefix = name_prefix or 'tempory-node-'
         self.user = user
         self.sudo_user = sudo_user
+        self.sudo_user_mode = sudo_user_mode
         self.poison_pill_minutes = poison_pill_minutes
         self.create_kwargs = kwargs
+        self.node_poller = node_poller
+        self.destroy_wait_policy = destroy_wait_policy or BackoffPolicy()
+        self.ready_wait_policy = ready_wait_policy or BackoffPolicy(deadline=300, fast_polls=4, factor=1.5, max_delay=5)
+        self.ready_timings = {}
+        self.defer_destroy = defer_destroy
+        self.reaper = reaper
+        self.log_dir = log_dir
+        self.instrumentation = instrumentation or Instrumentation.default()
+        self.catalog = catalog
         self.node = None
 
-        # Setup fabric config
+        # Setup fabric config, fabric and scp are only imported once a node manager is made
+        from . import fabric
         fabric_config_defaults = fabric_config_defaults or {}
         fabric_config_defaults = {**fabric.config.Config.global_defaults(),
                                   **fabric_config_defaults}
         self.fabric_config = fabric.config.Config(defaults=fabric_config_defaults)
         self.fabric_keepalive = fabric_keepalive
+        self._fabric_lock = threading.Lock()
+        self._fabric_sudo_user_lock = threading.Lock()
 
         # set properties
+        self.key_provider = key_provider or RSAKeyProvider()
+        self.key_pair_session = key_pair_session
+        self.output_sink = output_sink
         self.size = size
         self.image = image
+        if key_pair is None and key_pair_session is not None:
+            key_pair = key_pair_session.key_pair
         self.key_pair = key_pair
 
     def _get_node_by_name(self, name):
         """Utility method used for testing if a node already exists or for refreshing the current node"""
+        if self.node_poller is not None:
+            return self.node_poller.get(name, since=self._changed_at)
         for node in self.driver.list_nodes():
             if node.name == name:
                 return node
@@ -231,22 +317,49 @@ class TemporyNode(object):
         assert self.name is not None and self.name.strip() != '', 'name must not be None or blank string'
         assert self._get_node_by_name(self.name) is None, f'Node with the name {self.name} already exists'
         logger.info(f'Creating tempory {self.size} node from {self.image}: {self.name}')
-        self.node = self.driver.create_node(name=self.name,
-                                            size=self.size,
-                                            image=self.image,
-                                            **self.create_kwargs)
-        self.driver.wait_until_running([self.node])
-        self.wait_until_ready()
-        if self.poison_pill_minutes is not None:
-            self.poison_pill(minutes=self.poison_pill_minutes)
+        with self.span('create'):
+            with self.span('create_node'):
+                self.node = self.driver.create_node(name=self.name,
+                                                    size=self.size,
+                                                    image=self.image,
+                                                    **self.create_kwargs)
+            self._changed_at = time.monotonic()
+            with self.span('wait_until_running'):
+                self.driver.wait_until_running([self.node])
+            self.wait_until_ready()
+            if self.poison_pill_minutes is not None:
+                self.poison_pill(minutes=self.poison_pill_minutes)
+
+    def span(self, name, **attributes):
+        """Return a context manager which times a phase of the node's life, see instrumentation.py"""
+        return self.instrumentation.span(name, node=self.name, driver=type(self.driver).__name__, **attributes)
 
     def refresh_node(self):
         """Refresh the node from the node's driver"""
         self.node = self._get_node_by_name(self.name)
 
-    def destroy(self):
-        """Destroy the node, waiting for it to be terminated"""
+    def _is_terminated(self):
+        """Refresh the node returning True if it has gone or has been terminated"""
+        self.refresh_node()
+        return self.node is None or self.node.state == NodeState.TERMINATED
+
+    def destroy(self, wait_policy=None, block=True):
+        """Destroy the node, waiting for it to be terminated
+
+        Args:
+            wait_policy: The BackoffPolicy used to poll for termination. Defaults to
+                destroy_wait_policy
+            block: If False then destroy in a background thread and return a
+                concurrent.futures.Future immediately
+
+        Returns:
+            A Future if block is False otherwise None
+        """
+        if not block:
+            return self.destroy_in_background(wait_policy)
+
         logger.info(f'Destroying tempory node: {self.name}')
+        wait_policy = wait_policy or self.destroy_wait_policy
 
         if self.node is None:
             self.refresh_node()
@@ -254,27 +367,41 @@ class TemporyNode(object):
         if self.node is None:
             raise NodeManagerErrorNoNode('No node to destroy')
 
-        # Atempt a destroy
-        destroy_error = None
-        try:
-            self.node.destroy()
-        except LibcloudError as err:
-            destroy_error = err
-
-        # Check that the node has gorne - sometimes the operation is successful with a timeout error
-        for i in range(60):
-            self.refresh_node()
-            if self.node is None:
-                return
-            if self.node.state == NodeState.TERMINATED:
+        with self.span('destroy'):
+            # Atempt a destroy
+            destroy_error = None
+            self._changed_at = time.monotonic()
+            try:
+                with self.span('destroy_node'):
+                    self.node.destroy()
+            except LibcloudError as err:
+                destroy_error = err
+
+            # Check that the node has gorne - sometimes the operation is successful with a timeout error
+            with self.span('wait_until_terminated'):
+                terminated = wait_policy.wait(self._is_terminated)
+            if terminated:
                 return
-            time.sleep(3)
 
-        # if we have a destroy error then raise from that error
-        if destroy_error is not None:
-            raise NodeManagerError('Node failed to terminate') from destroy_error
-        else:
-            raise NodeManagerError('Node failed to terminate')
+            # if we have a destroy error then raise from that error
+            if destroy_error is not None:
+                raise NodeManagerError('Node failed to terminate') from destroy_error
+            else:
+                raise NodeManagerError('Node failed to terminate')
+
+    def destroy_in_background(self, wait_policy=None):
+        """Destroy the node in a non daemon thread returning a concurrent.futures.Future"""
+        future = Future()
+
+        def run():
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(self.destroy(wait_policy=wait_policy))
+                except BaseException as err:  # we can use BaseException since it is passed on to the future
+                    future.set_exception(err)
+
+        threading.Thread(target=run, name=f'destroy-{self.name}').start()
+        return future
 
     def __enter__(self):
         """Enter python context"""
@@ -283,6 +410,7 @@ class TemporyNode(object):
         except (BaseException) as e:  # we can use BaseException since we are re-raising it
             traceback.print_exc()
             if os.isatty(sys.stdout.fileno()):
+                import code
                 code.interact(banner="About to destroy tempory instance due to erro. Interactive shell detected... nm is node manager",
                               local={'nm': self})
 
@@ -300,29 +428,75 @@ class TemporyNode(object):
         if ex_value is not None:
             traceback.print_exception(exc_type, ex_value, ex_tb)
             if os.isatty(sys.stdout.fileno()):
+                import code
                 code.interact(banner="About to destroy tempory instance due to erro. Interactive shell detected... nm is node manager",
                               local={'nm': self})
+        if isinstance(self._output_sink, RotatingLogSink):
+            self._output_sink.close()
+        if self.defer_destroy:
+            if self.reaper is None:
+                from .reaper import NodeReaper
+                self.reaper = NodeReaper.default()
+            self.reaper.submit(self)
+            return
         try:
             self.destroy()
         except Exception as e:
             raise NodeManagerCleanupError('An exception was raied during node deletion. Node left in unkonwn state') from e
 
-    def wait_until_ready(self, tries=10, delay=0.5, backoff=1.5):
+    def _test_connect(self):
+        """Run a command as both user and sudo_user concurrently, raising on failure"""
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(lambda: self.fabric.run('echo "hello"')),
+                       executor.submit(lambda: self.fabric_sudo_user.run('echo "hello again"'))]
+            for future in futures:
+                future.result()
+
+    def _ready_host(self):
+        """Return the ip address to probe, refreshing a node which does not have one yet"""
+        if self.ip_address is None and self.node is not None:
+            TemporyNode.refresh_node(self)  # the probe runs in a thread, also for the async node managers
+        return self.ip_address
+
+    def _ready_wait_policy(self, wait_policy, tries, delay, backoff):
+        """Return the wait policy of wait_until_ready, the retry arguments of earlier versions are mapped onto one"""
+        if wait_policy is None and (tries, delay, backoff) != (None, None, None):
+            wait_policy = BackoffPolicy.from_retry(tries=10 if tries is None else tries,
+                                                   delay=0.5 if delay is None else delay,
+                                                   backoff=1.5 if backoff is None else backoff)
+        return wait_policy or self.ready_wait_policy
+
+    def wait_until_ready(self, wait_policy=None, port=None, connect_timeout=3, tries=None, delay=None, backoff=None):
         """Wait until the node is able to accept fabric run commands
 
+        The ssh port is first probed with a plain tcp connection, then the ssh banner is read
+        and only then are authenticated fabric connections made. The seconds taken by each
+        stage are recorded in ready_timings. The ip address is looked up on each attempt.
+
         Args:
-            timeout (int): The number of seconds to wait until raising an exception
-            interval (int): The number of seconds between retry
+            wait_policy: The BackoffPolicy used between attempts. Defaults to ready_wait_policy
+            port (int): The ssh port. Defaults to the port of the fabric config
+            connect_timeout (int): The socket timeout of the tcp and banner stages
+            tries (int): Deprecated, with delay and backoff the retry schedule of earlier versions.
+                If any is given, and no wait_policy, then they are mapped onto a BackoffPolicy
+            delay (float): Deprecated, see tries
+            backoff (float): Deprecated, see tries
         """
-        @retry(tries=tries, delay=delay, backoff=backoff)
-        def test_connect():
-            self.fabric.run('echo "hello"')
-            self.fabric_sudo_user.run('echo "hello again"')
-        test_connect()
+        wait_policy = self._ready_wait_policy(wait_policy, tries, delay, backoff)
+        port = port or self.fabric_config.port
+        probe = SSHReadinessProbe(self._ready_host, self._test_connect, port=port, timeout=connect_timeout)
+        with self.span('wait_until_ready'):
+            ready = wait_policy.wait(probe)
+        self.ready_timings = probe.timings
+        if not ready:
+            raise NodeManagerError(f'Node {self.name} failed the {probe.stage} readiness check') from probe.error
+        logger.info(f'Tempory node ready: {self.name} ' +
+                    ' '.join(f'{stage}={seconds:.2f}s' for stage, seconds in probe.timings.items()))
 
     def poison_pill(self, minutes=1440):
         """Shedules a VM shutdown after a given number of minutes"""
-        self.fabric_sudo_user.sudo(f'shutdown -h +{minutes}')
+        with self.span('poison_pill'):
+            self.fabric_sudo_user.sudo(f'shutdown -h +{minutes}')
 
 
 class TemporyGCENode(TemporyNode):
@@ -333,7 +507,7 @@ class TemporyGCENode(TemporyNode):
         """if image has been a string then fetch the image from ex_get_image"""
         super_image = super().image
         if isinstance(super_image, str):
-            driver_image = self.driver.ex_get_image(super_image)
+            driver_image = (self.catalog or self.driver).ex_get_image(super_image)
             self.image = driver_image
         return super().image
 
@@ -349,14 +523,42 @@ class TemporyGCENode(TemporyNode):
         items.append({'key': 'ssh-keys',
 	              'value': ssh_keys})
 
-    def stop_and_create_image(self, image_name):
-        """Create an image from a machiene. In GCE the machiene must be stopped"""
+    def stop_and_create_image(self, image_name, labels=None):
+        """Create an image from a machiene. In GCE the machiene must be stopped
+
+        Args:
+            image_name: The name of the new image
+            labels: An optional dict of labels given to the image
+
+        Returns:
+            The new image
+        """
         driver = self.driver
         logger.info('Stopping node')
-        driver.ex_stop_node(self.node)
+        self.disconnect()
+        with self.span('stop_node'):
+            driver.ex_stop_node(self.node)
         volume = driver.ex_get_volume(self.name)
         logger.info(f'Creating snapshot: {image_name}')
-        driver.ex_create_image(image_name, volume, wait_for_completion=True)
+        label_kwargs = {} if labels is None else {'ex_labels': labels}
+        with self.span('create_image', image_name=image_name):
+            image = driver.ex_create_image(image_name, volume, wait_for_completion=True, **label_kwargs)
+        if self.catalog is not None:
+            self.catalog.invalidate(image_name)
+        return image
+
+    def start_node(self):
+        """Start the node again after stop_and_create_image, returning once it is ready
+
+        Stopping the node cancels its poison pill so it is scheduled again.
+        """
+        logger.info(f'Starting node: {self.name}')
+        with self.span('start_node'):
+            self.driver.ex_start_node(self.node)
+            self.refresh_node()
+            self.wait_until_ready()
+            if self.poison_pill_minutes is not None:
+                self.poison_pill(minutes=self.poison_pill_minutes)
 
 
 class TemporyEC2Node(TemporyNode):
@@ -382,38 +584,55 @@ class TemporyEC2Node(TemporyNode):
         super().__init__(*args, **kwargs)
         self.create_kwargs.setdefault('ex_keyname', self.key_pair.name)
 
+    _key_pair_acquired = False
+
+    def import_key_pair(self):
+        """Import the key pair, or take a reference to the shared session key pair"""
+        if self.key_pair_session is not None:
+            self.key_pair_session.acquire()
+            self._key_pair_acquired = True
+        else:
+            logger.info(f'Importing temporary key pair: {self.key_pair.name}')
+            with self.span('import_key_pair'):
+                self.driver.import_key_pair_from_string(
+                    self.key_pair.name,
+                    self.key_pair.public_key,
+                )
+
+    def delete_key_pair(self):
+        """Delete the key pair, or release the reference to the shared session key pair"""
+        if self.key_pair_session is not None:
+            if self._key_pair_acquired:
+                self._key_pair_acquired = False
+                self.key_pair_session.release()
+        elif self._key_pair:
+            logger.info(f'Deleting temporary key pair: {self.key_pair.name}')
+            self.driver.delete_key_pair(self.key_pair)
+
     def create(self):
         """Also add a key pair to access the EC2 instance"""
-        logger.info(f'Importing temporary key pair: {self.key_pair.name}')
-        self.driver.import_key_pair_from_string(
-            self.key_pair.name,
-            self.key_pair.public_key,
-        )
+        self.import_key_pair()
         super().create()
 
-        # About 50% of the time, got a paramiko.ssh_exception.NoValidConnectionsError:
-        # [Errno None] Unable to connect to port 22 on 3.80.6.237
-        time.sleep(3)
-
         # The public IP address does not show up when the node is first fetched
         logger.info('Refreshing node')
         self.refresh_node()
 
-    def destroy(self):
+    def destroy(self, wait_policy=None, block=True):
         """Also clean up the key pair if it has been created"""
+        if not block:
+            return self.destroy_in_background(wait_policy)
         try:
-            super().destroy()
+            super().destroy(wait_policy=wait_policy)
         finally:
-            if self._key_pair:
-                logger.info(f'Deleting temporary key pair: {self.key_pair.name}')
-                self.driver.delete_key_pair(self.key_pair)
+            self.delete_key_pair()
 
     @TemporyNode.image.getter
     def image(self):
         """if image is a string then fetch the image from get_image"""
         super_image = super().image
         if isinstance(super_image, str):
-            driver_image = self.driver.get_image(super_image)
+            driver_image = (self.catalog or self.driver).get_image(super_image)
             self.image = driver_image
         return super().image
 
@@ -423,6 +642,11 @@ class TemporyEC2Node(TemporyNode):
         driver-provided list of sizes"""
         super_size = super().size
         if isinstance(super_size, str):
+            if self.catalog is not None:
+                catalog_size = self.catalog.get_size(super_size)
+                if catalog_size is not None:
+                    self.size = catalog_size
+                return super().size
             driver_sizes = self.driver.list_sizes()
             filtered_sizes = [_ for _ in driver_sizes if _.id == super_size]
             if filtered_sizes:
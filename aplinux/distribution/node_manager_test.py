@@ -1,6 +1,9 @@
 # -*- coding:utf-8 -*-
 
 from . import node_manager
+from .instrumentation import Instrumentation
+from .key_provider import GeneratedKey
+from .wait_policy import BackoffPolicy
 from libcloud.compute.base import KeyPair
 from libcloud.compute.types import NodeState
 from unittest import TestCase
@@ -8,6 +11,8 @@ from unittest.mock import MagicMock
 from unittest.mock import Mock
 from unittest.mock import patch
 
+import time
+
 
 class TestTemporyNodeInit(TestCase):
 
@@ -33,8 +38,8 @@ class TestTemporyNodeInit(TestCase):
         self.assertIsNone(nm.fabric)
         self.assertIsNone(nm.ip_address)
 
-    @patch('aplinux.distribution.node_manager.StringIO')
-    @patch('aplinux.distribution.node_manager.RSAKey')
+    @patch('aplinux.distribution.key_provider.StringIO')
+    @patch('aplinux.distribution.key_provider.RSAKey')
     def test_key_pair_generation(self, RSAKey, StringIO):  # noqa: N803 arg name should be lower case
         driver = MagicMock()
         nm = node_manager.TemporyNode(driver)
@@ -59,6 +64,15 @@ class TestTemporyNodeInit(TestCase):
         key.write_private_key.assert_called_with(private_key_fout)
         self.assertEqual(key_pair.private_key, private_key_fout.getvalue.return_value)
 
+    def test_key_pair_from_provider(self):
+        key_provider = MagicMock()
+        key_provider.generate.return_value = GeneratedKey('ssh-ed25519', 'AAAA', 'private', 'finger')
+        nm = node_manager.TemporyNode(MagicMock(), key_provider=key_provider)
+        nm.name = 'foo'
+        self.assertEqual(nm.key_pair.public_key, 'ssh-ed25519 AAAA admin')
+        self.assertEqual(nm.key_pair.private_key, 'private')
+        self.assertEqual(nm.key_pair.fingerprint, 'finger')
+
 
 class TestSimpleTemporyNodePreStart(TestCase):
 
@@ -80,6 +94,7 @@ class TestSimpleTemporyNodePreStart(TestCase):
 
     def test_tempory_node_create(self):
         self.node_manager.name = 'node-123'
+        self.node_manager.wait_until_ready = MagicMock()
         self.node_manager.create()
         self.driver.create_node.assert_called_with(name='node-123',
                                                    size='small',
@@ -89,6 +104,23 @@ class TestSimpleTemporyNodePreStart(TestCase):
         self.assertEqual(self.node_manager.node, expected_node)
         self.driver.wait_until_running.assert_called_with([expected_node])
 
+    def test_tempory_node_create_spans(self):
+        spans = []
+        self.node_manager.instrumentation = Instrumentation(sinks=[spans.append])
+        self.node_manager.name = 'node-123'
+        self.node_manager.wait_until_ready = MagicMock()
+        self.node_manager.create()
+        self.assertEqual([span.name for span in spans], ['create_node', 'wait_until_running', 'create'])
+        self.assertEqual(spans[0].attributes, {'node': 'node-123', 'driver': 'MagicMock'})
+
+    def test_tempory_node_create_failed_span(self):
+        instrumentation = self.node_manager.instrumentation = Instrumentation()
+        self.driver.create_node.side_effect = ValueError('quota')
+        with self.assertRaises(ValueError):
+            self.node_manager.create()
+        self.assertEqual(instrumentation.summaries['create_node'].errors, 1)
+        self.assertEqual(instrumentation.summaries['create'].errors, 1)
+
     def test_context_enter(self):
         self.node_manager.create = MagicMock()
         result = self.node_manager.__enter__()
@@ -126,6 +158,13 @@ class TestSimpleTemporyNodeRunning(TestCase):
         return_node = self.node_manager._get_node_by_name('foo-123')
         self.assertEqual(return_node, expected_node)
 
+    def test_get_node_by_name_with_poller(self):
+        self.node_manager.node_poller = MagicMock()
+        return_node = self.node_manager._get_node_by_name('foo-123')
+        self.node_manager.node_poller.get.assert_called_with('foo-123', since=None)
+        self.assertEqual(return_node, self.node_manager.node_poller.get.return_value)
+        self.driver.list_nodes.assert_not_called()
+
     def test_refresh_node(self):
         self.node_manager._get_node_by_name = MagicMock(return_value='123')
         self.node_manager.refresh_node()
@@ -144,8 +183,8 @@ class TestSimpleTemporyNodeRunning(TestCase):
 
         self.node_manager.refresh_node.side_effect = refresh1
         self.node_manager.destroy()
-        self.node.destroy.aseert_called_with()
-        sleep.assert_called_with(3)
+        self.node.destroy.assert_called_with()
+        sleep.assert_called_with(0.5)
         self.node_manager.refresh_node.assert_called_with()
 
     @patch('time.sleep')
@@ -161,8 +200,8 @@ class TestSimpleTemporyNodeRunning(TestCase):
 
         self.node_manager.refresh_node.side_effect = refresh1
         self.node_manager.destroy()
-        self.node.destroy.aseert_called_with()
-        sleep.assert_called_with(3)
+        self.node.destroy.assert_called_with()
+        sleep.assert_called_with(0.5)
         self.node_manager.refresh_node.assert_called_with()
 
     @patch('time.sleep')
@@ -170,11 +209,24 @@ class TestSimpleTemporyNodeRunning(TestCase):
         self.node.state = NodeState.RUNNING
         self.node_manager.refresh_node = Mock()
         with self.assertRaises(node_manager.NodeManagerError):
-            self.node_manager.destroy()
-        self.node.destroy.aseert_called_with()
-        sleep.assert_called_with(3)
+            self.node_manager.destroy(wait_policy=BackoffPolicy(deadline=0.01))
+        self.node.destroy.assert_called_with()
+        sleep.assert_called()
         self.node_manager.refresh_node.assert_called_with()
 
+    def test_destroy_non_blocking(self):
+        self.node.state = NodeState.TERMINATED
+        self.node_manager.refresh_node = Mock()
+        future = self.node_manager.destroy(block=False)
+        self.assertIsNone(future.result(timeout=5))
+        self.node.destroy.assert_called_with()
+
+    def test_destroy_non_blocking_error(self):
+        self.node_manager.node = None
+        self.node_manager.refresh_node = Mock()
+        future = self.node_manager.destroy(block=False)
+        self.assertIsInstance(future.exception(timeout=5), node_manager.NodeManagerErrorNoNode)
+
     def test_context_exit(self):
         self.node_manager.destroy = MagicMock()
         self.node_manager.__exit__(None, None, None)
@@ -187,6 +239,51 @@ class TestSimpleTemporyNodeRunning(TestCase):
         with self.assertRaises(node_manager.NodeManagerCleanupError):
             self.node_manager.__exit__(None, None, None)
 
+    @patch('aplinux.distribution.node_manager.SSHReadinessProbe')
+    def test_wait_until_ready(self, SSHReadinessProbe):  # noqa: N803 arg name should be lower case
+        probe = SSHReadinessProbe.return_value
+        probe.timings = {'tcp': 1.0, 'banner': 0.1, 'auth': 0.5}
+        wait_policy = MagicMock()
+        wait_policy.wait.return_value = True
+        self.node_manager.wait_until_ready(wait_policy=wait_policy)
+        SSHReadinessProbe.assert_called_with(self.node_manager._ready_host, self.node_manager._test_connect, port=22,
+                                             timeout=3)
+        wait_policy.wait.assert_called_with(probe)
+        self.assertEqual(self.node_manager.ready_timings, probe.timings)
+
+    @patch('aplinux.distribution.node_manager.SSHReadinessProbe')
+    def test_wait_until_ready_retry_arguments(self, SSHReadinessProbe):  # noqa: N803 arg name should be lower case
+        self.node_manager.ready_wait_policy = MagicMock()
+        with patch.object(node_manager.BackoffPolicy, 'wait', autospec=True, return_value=True) as wait:
+            self.node_manager.wait_until_ready(tries=3, delay=1, backoff=2)
+        wait_policy = wait.call_args[0][0]
+        self.assertEqual((wait_policy.deadline, wait_policy.initial_delay, wait_policy.factor), (3, 1, 2))
+        self.node_manager.ready_wait_policy.wait.assert_not_called()
+
+    def test_ready_host(self):
+        self.node_manager.node.public_ips = []
+        self.node_manager.node.private_ips = []
+        refreshed = MagicMock(public_ips=['10.1.2.3'], private_ips=[])
+        self.node_manager._get_node_by_name = MagicMock(return_value=refreshed)
+        self.assertEqual(self.node_manager._ready_host(), '10.1.2.3')  # an ec2 node gets its ip once refreshed
+        self.assertEqual(self.node_manager._ready_host(), '10.1.2.3')
+        self.node_manager._get_node_by_name.assert_called_once_with(self.node_manager.name)
+
+    @patch('aplinux.distribution.node_manager.SSHReadinessProbe')
+    def test_wait_until_ready_failed(self, SSHReadinessProbe):  # noqa: N803 arg name should be lower case
+        SSHReadinessProbe.return_value.error = OSError('Connection refused')
+        wait_policy = MagicMock()
+        wait_policy.wait.return_value = False
+        with self.assertRaises(node_manager.NodeManagerError):
+            self.node_manager.wait_until_ready(wait_policy=wait_policy)
+
+    def test_test_connect(self):
+        self.node_manager._fabric = MagicMock()
+        self.node_manager._fabric_sudo_user = MagicMock()
+        self.node_manager._test_connect()
+        self.node_manager._fabric.run.assert_called_with('echo "hello"')
+        self.node_manager._fabric_sudo_user.run.assert_called_with('echo "hello again"')
+
     def test_ip_address(self):
         self.assertEqual(self.node_manager.ip_address, '111.222.333.444')
 
@@ -198,17 +295,61 @@ class TestSimpleTemporyNodeRunning(TestCase):
         self.node_manager.ip_address = None
         self.assertEqual(self.node_manager.ip_address, '111.222.333.444')
 
-    @patch('fabric.Connection')
-    @patch('paramiko.RSAKey')
-    def test_fabric(self, RSAKey, Connection):  # noqa: N803 arg name should be lower case
+    @patch('aplinux.distribution.fabric.ConnectionWithSCP')
+    @patch('aplinux.distribution.node_manager.load_private_key')
+    def test_fabric(self, load_private_key, ConnectionWithSCP):  # noqa: N803 arg name should be lower case
         self.key_pair.private_key = 'abc'
-        pkey = RSAKey.from_private_key.return_value
+        pkey = load_private_key.return_value
         connection = self.node_manager.fabric
-        Connection.assert_called_with(self.node_manager.ip_address,
-                                      user='centos',
-                                      connect_kwargs={'pkey': pkey,
-                                                      'look_for_keys': False})
-        self.assertEqual(connection, Connection.return_value)
+        ConnectionWithSCP.assert_called_with(self.node_manager.ip_address,
+                                             user='centos',
+                                             config=self.node_manager.fabric_config,
+                                             connect_kwargs={'pkey': pkey,
+                                                             'look_for_keys': False})
+        self.assertEqual(connection, ConnectionWithSCP.return_value)
+        connection.transport.set_keepalive.assert_called_with(5)
+        self.assertIs(self.node_manager.fabric, connection)
+
+    @patch('aplinux.distribution.fabric.ConnectionWithSCP')
+    @patch('aplinux.distribution.node_manager.load_private_key')
+    def test_fabric_sudo_user(self, load_private_key, ConnectionWithSCP):  # noqa: N803 arg name should be lower case
+        ConnectionWithSCP.side_effect = lambda *args, **kwargs: MagicMock()
+        connection = self.node_manager.fabric_sudo_user
+        self.assertIsNot(connection, self.node_manager.fabric)
+        self.assertEqual(ConnectionWithSCP.call_args_list[0][1]['user'], 'admin')
+        load_private_key.assert_called_once_with(self.key_pair.private_key)
+
+    @patch('aplinux.distribution.fabric.ConnectionWithSCP')
+    @patch('aplinux.distribution.node_manager.load_private_key')
+    def test_fabric_sudo_user_shared(self, load_private_key, ConnectionWithSCP):  # noqa: N803
+        self.node_manager.sudo_user = 'centos'
+        self.assertIs(self.node_manager.fabric_sudo_user, self.node_manager.fabric)
+        ConnectionWithSCP.assert_called_once()
+
+    @patch('aplinux.distribution.fabric.ConnectionWithSCP')
+    @patch('aplinux.distribution.node_manager.load_private_key')
+    def test_fabric_sudo_user_sudo_mode(self, load_private_key, ConnectionWithSCP):  # noqa: N803
+        self.node_manager.sudo_user_mode = 'sudo'
+        connection = self.node_manager.fabric_sudo_user
+        ConnectionWithSCP.assert_called_once()
+        self.node_manager.fabric._prefix.side_effect = lambda command, env=None: command
+        connection.run('whoami')
+        self.node_manager.fabric.sudo.assert_called_with('sh -c whoami', user='admin')
+        connection.sudo('shutdown -h +5')
+        self.node_manager.fabric.sudo.assert_called_with('shutdown -h +5')
+        connection.stream('make install', warn=True)
+        self.node_manager.fabric._stream.assert_called_with("sudo -n -H -u admin sh -c 'make install'", warn=True)
+
+    def test_stream(self):
+        self.node_manager.log_dir = '/var/log/builds'
+        self.node_manager.name = 'build-1'
+        sink = self.node_manager.output_sink
+        self.assertIsInstance(sink, node_manager.RotatingLogSink)
+        self.assertEqual(sink.path, '/var/log/builds/build-1.log')
+        self.assertIs(self.node_manager.output_sink, sink)
+        with patch.object(node_manager.TemporyNode, 'fabric') as fabric:
+            self.node_manager.stream('make')
+            fabric.stream.assert_called_once_with('make', sink=sink, warn=False)
 
 
 class TestTemporyGCENode(TestCase):
@@ -232,6 +373,65 @@ class TestTemporyGCENode(TestCase):
         self.driver.ex_get_image.assert_called_with('foo-bar-7-')
         self.assertEqual(image, expected_image)
 
+    def test_image_catalog(self):
+        catalog = MagicMock()
+        nm = node_manager.TemporyGCENode(self.driver, image='foo-bar-7-', key_pair=self.key_pair, catalog=catalog)
+        self.assertEqual(nm.image, catalog.ex_get_image.return_value)
+        catalog.ex_get_image.assert_called_once_with('foo-bar-7-')
+        self.driver.ex_get_image.assert_not_called()
+
+    def test_stop_and_create_image_invalidates_catalog(self):
+        catalog = MagicMock()
+        nm = node_manager.TemporyGCENode(self.driver, image='foo-bar-7-', key_pair=self.key_pair, catalog=catalog)
+        nm.stop_and_create_image('foo-bar-8')
+        self.driver.ex_create_image.assert_called_once_with('foo-bar-8', self.driver.ex_get_volume.return_value,
+                                                            wait_for_completion=True)
+        catalog.invalidate.assert_called_once_with('foo-bar-8')
+
+    def test_stop_and_create_image_labels(self):
+        fabric = self.node_manager._fabric = MagicMock()
+        image = self.node_manager.stop_and_create_image('foo-bar-8', labels={'aplinux-layer': 'abc'})
+        self.assertEqual(image, self.driver.ex_create_image.return_value)
+        self.driver.ex_create_image.assert_called_once_with('foo-bar-8', self.driver.ex_get_volume.return_value,
+                                                            wait_for_completion=True,
+                                                            ex_labels={'aplinux-layer': 'abc'})
+        fabric.close.assert_called_once_with()
+        self.assertIsNone(self.node_manager._fabric)
+
+    def test_start_node(self):
+        self.node_manager.node = MagicMock()
+        self.node_manager.refresh_node = MagicMock()
+        self.node_manager.wait_until_ready = MagicMock()
+        self.node_manager.start_node()
+        self.driver.ex_start_node.assert_called_once()
+        self.node_manager.refresh_node.assert_called_once_with()
+        self.node_manager.wait_until_ready.assert_called_once_with()
+
+    def test_start_node_poison_pill(self):
+        nm = node_manager.TemporyGCENode(self.driver, image='foo-bar-7-', key_pair=self.key_pair,
+                                         poison_pill_minutes=30)
+        nm.node = MagicMock()
+        nm.refresh_node = MagicMock()
+        nm.wait_until_ready = MagicMock()
+        nm.poison_pill = MagicMock()
+        nm.start_node()
+        nm.poison_pill.assert_called_once_with(minutes=30)
+        self.node_manager.poison_pill = MagicMock()
+        self.node_manager.node = MagicMock()
+        self.node_manager.refresh_node = MagicMock()
+        self.node_manager.wait_until_ready = MagicMock()
+        self.node_manager.start_node()
+        self.node_manager.poison_pill.assert_not_called()
+
+    def test_disconnect_lock_order(self):
+        locks = MagicMock()
+        self.node_manager._fabric_sudo_user_lock = locks.sudo_user
+        self.node_manager._fabric_lock = locks.fabric
+        self.node_manager.disconnect()
+        # the same order as fabric_sudo_user, which uses fabric with its lock held
+        self.assertEqual([name for name, args, kwargs in locks.mock_calls if name.endswith('__enter__')],
+                         ['sudo_user.__enter__', 'fabric.__enter__'])
+
 
 class TestTemporyEC2Node(TestCase):
 
@@ -279,18 +479,44 @@ class TestTemporyEC2Node(TestCase):
             ['test group', 'test group2'],
         )
 
-    @patch('time.sleep', return_value=None)
-    def test_create(self, patched_time_sleep):
+    def test_create(self):
+        self.node_manager.wait_until_ready = MagicMock()
         self.node_manager.create()
         self.driver.import_key_pair_from_string.assert_called()
+        self.node_manager.wait_until_ready.assert_called_with()
+
+    def test_create_with_poller(self):
+        poller = self.node_manager.node_poller = MagicMock()
+        poller.get.return_value = None
+        self.node_manager.wait_until_ready = MagicMock()
+        self.driver.create_node.side_effect = lambda **kwargs: created.append(time.monotonic()) or MagicMock()
+        created = []
+        self.node_manager.create()
+        # the refresh after the create must not be answered by a poll made before the node existed
+        since = poller.get.call_args[1]['since']
+        self.assertGreaterEqual(since, created[0])
 
     @patch('builtins.super')
     def test_destroy(self, super):
         self.node_manager.key_pair = MagicMock()
         self.node_manager.destroy()
-        super().destroy.assert_called_with()
+        super().destroy.assert_called_with(wait_policy=None)
         self.driver.delete_key_pair.assert_called()
 
+    def test_key_pair_session(self):
+        session = MagicMock()
+        new_node_manager = node_manager.TemporyEC2Node(self.driver, key_pair_session=session,
+                                                       **self.node_manager_kwargs)
+        self.assertEqual(new_node_manager.key_pair, session.key_pair)
+        self.assertEqual(new_node_manager.create_kwargs['ex_keyname'], session.key_pair.name)
+        new_node_manager.import_key_pair()
+        session.acquire.assert_called_with()
+        new_node_manager.delete_key_pair()
+        new_node_manager.delete_key_pair()
+        session.release.assert_called_once_with()
+        self.driver.import_key_pair_from_string.assert_not_called()
+        self.driver.delete_key_pair.assert_not_called()
+
     def test_image(self):
         expected_image = self.driver.get_image.return_value
         image = self.node_manager.image
@@ -302,3 +528,13 @@ class TestTemporyEC2Node(TestCase):
         size = self.node_manager.size
         self.driver.list_sizes.assert_called()
         self.assertEqual(size, expected_size)
+
+    def test_size_catalog(self):
+        catalog = MagicMock()
+        catalog.get_size.return_value = self.t3_node
+        nm = node_manager.TemporyEC2Node(self.driver, catalog=catalog, **self.node_manager_kwargs)
+        self.assertEqual(nm.size, self.t3_node)
+        self.assertEqual(nm.image, catalog.get_image.return_value)
+        catalog.get_size.assert_called_once_with('t3.micro')
+        catalog.get_image.assert_called_once_with('ami-9887c6e7')
+        self.driver.list_sizes.assert_not_called()
@@ -0,0 +1,163 @@
+# -*- coding:utf-8 -*-
+"""A shared index of a driver's nodes
+
+Many tempory node managers waiting on their own node would otherwise each call
+``driver.list_nodes()``. A NodeStatePoller coalesces those requests so that a
+single ``list_nodes`` call is made per poll interval no matter how many node
+managers are waiting::
+
+    >>> poller = NodeStatePoller.for_driver(driver)
+    >>> managers = [TemporyGCENode(driver, node_poller=poller, **kwargs) for i in range(50)]
+    >>> poller.close()  # once the driver is no longer used
+
+"""
+
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger('aplinux.distribution')
+
+
+class NodeStatePoller(object):
+    """A thread safe index of a driver's nodes by name which is refreshed at most once per interval
+
+    Attributes:
+        driver: The libcloud driver which is polled
+        interval: The maximum age in seconds of the index before it is refreshed
+        tick_count: The number of list_nodes calls which have been made
+    """
+
+    _registry = {}
+    _registry_lock = threading.Lock()
+
+    @classmethod
+    def for_driver(cls, driver, interval=3):
+        """Return the poller shared by every node manager using the given driver"""
+        with cls._registry_lock:
+            poller = cls._registry.get(driver)
+            if poller is None:
+                poller = cls(driver, interval=interval)
+                cls._registry[driver] = poller
+            return poller
+
+    def __init__(self, driver, interval=3):
+        """Initialize the poller
+
+        Args:
+            driver: The libcloud driver to poll
+            interval: The maximum age in seconds of the node index before a poll is made
+        """
+        self.driver = driver
+        self.interval = interval
+        self.tick_count = 0
+        self._nodes = {}
+        self._updated = None
+        self._polled = None
+        self._refreshing = False
+        self._subscribers = {}
+        self._condition = threading.Condition()
+
+    def refresh(self):
+        """Poll the driver once, update the index and notify subscribers of state transitions"""
+        polled = time.monotonic()
+        try:
+            index = {node.name: node for node in self.driver.list_nodes()}
+            with self._condition:
+                previous = self._nodes
+                first_tick = self._updated is None
+                self._nodes = index
+                self._updated = time.monotonic()
+                self._polled = polled
+                self.tick_count += 1
+                subscribers = {name: list(callbacks) for name, callbacks in self._subscribers.items()}
+        finally:
+            with self._condition:
+                self._refreshing = False
+                self._condition.notify_all()
+
+        for name, callbacks in subscribers.items():
+            old_node = previous.get(name)
+            new_node = index.get(name)
+            old_state = None if old_node is None else old_node.state
+            new_state = None if new_node is None else new_node.state
+            if first_tick or old_state is not new_state or (old_node is None) != (new_node is None):
+                for callback in callbacks:
+                    try:
+                        callback(name, old_state, new_node)
+                    except Exception:
+                        logger.exception(f'Node state subscriber for {name} failed')
+
+    def get(self, name, max_age=None, since=None):
+        """Return the node with the given name or None if it does not exist
+
+        Only one thread polls the driver when the index is older than max_age, other callers
+        wait for that poll to complete and share its result.
+
+        Args:
+            name: The node name
+            max_age: The maximum acceptable age of the index in seconds. Defaults to the interval
+            since: An optional time.monotonic() value. Only an index from a poll started after it is used,
+                for example so that a node is not read from a poll made before it was destroyed
+        """
+        max_age = self.interval if max_age is None else max_age
+        with self._condition:
+            while True:
+                if (self._updated is not None and time.monotonic() - self._updated <= max_age
+                        and (since is None or self._polled >= since)):
+                    return self._nodes.get(name)
+                if not self._refreshing:
+                    self._refreshing = True
+                    break
+                self._condition.wait()
+        self.refresh()
+        with self._condition:
+            return self._nodes.get(name)
+
+    def wait_for(self, name, predicate, timeout=None):
+        """Wait until predicate(node) is true for the named node, returning the node
+
+        The node passed to the predicate is None if the node does not exist.
+
+        Raises:
+            TimeoutError: If the predicate is not satisfied before the timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            node = self.get(name)
+            if predicate(node):
+                return node
+            wait = self.interval
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f'Timed out waiting on the state of node {name}')
+                wait = min(wait, remaining)
+            with self._condition:
+                self._condition.wait(wait)
+
+    def close(self):
+        """Remove the poller from the for_driver registry, so that it and its driver can be garbage collected
+
+        The poller can still be used by node managers which hold it.
+        """
+        with self._registry_lock:
+            if self._registry.get(self.driver) is self:
+                del self._registry[self.driver]
+        with self._condition:
+            self._subscribers = {}
+
+    def subscribe(self, name, callback):
+        """Call callback(name, previous_state, node) whenever the named node changes state"""
+        with self._condition:
+            self._subscribers.setdefault(name, []).append(callback)
+
+    def unsubscribe(self, name, callback):
+        """Remove a callback registered with subscribe"""
+        with self._condition:
+            callbacks = self._subscribers.get(name, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+            if not callbacks:
+                self._subscribers.pop(name, None)
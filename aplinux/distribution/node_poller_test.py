@@ -0,0 +1,120 @@
+# -*- coding:utf-8 -*-
+
+from . import node_poller
+from concurrent.futures import ThreadPoolExecutor
+from libcloud.compute.types import NodeState
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+import threading
+import time
+
+
+def mock_node(name, state=NodeState.RUNNING):
+    node = MagicMock()
+    node.name = name
+    node.state = state
+    return node
+
+
+class TestNodeStatePoller(TestCase):
+
+    def setUp(self):
+        self.driver = MagicMock()
+        self.node_a = mock_node('a')
+        self.node_b = mock_node('b')
+        self.driver.list_nodes.return_value = [self.node_a, self.node_b]
+        self.poller = node_poller.NodeStatePoller(self.driver, interval=60)
+
+    def test_for_driver(self):
+        poller = node_poller.NodeStatePoller.for_driver(self.driver)
+        self.assertIs(node_poller.NodeStatePoller.for_driver(self.driver), poller)
+        self.assertIsNot(node_poller.NodeStatePoller.for_driver(MagicMock()), poller)
+        poller.close()
+        self.assertNotIn(self.driver, node_poller.NodeStatePoller._registry)
+        self.assertIsNot(node_poller.NodeStatePoller.for_driver(self.driver), poller)
+        node_poller.NodeStatePoller.for_driver(self.driver).close()
+
+    def test_get(self):
+        self.assertEqual(self.poller.get('a'), self.node_a)
+        self.assertEqual(self.poller.get('b'), self.node_b)
+        self.assertIsNone(self.poller.get('c'))
+        self.driver.list_nodes.assert_called_once_with()
+        self.assertEqual(self.poller.tick_count, 1)
+
+    def test_get_max_age(self):
+        self.poller.get('a')
+        self.poller.get('a', max_age=0)
+        self.assertEqual(self.driver.list_nodes.call_count, 2)
+
+    def test_get_since(self):
+        self.poller.get('a')
+        since = time.monotonic()
+        self.poller.get('a')
+        self.assertEqual(self.driver.list_nodes.call_count, 1)
+        self.poller.get('a', since=since)
+        self.poller.get('a', since=since)
+        self.assertEqual(self.driver.list_nodes.call_count, 2)
+
+    def test_get_coalesces_concurrent_polls(self):
+        release = threading.Event()
+
+        def slow_list_nodes():
+            release.wait(5)
+            return [self.node_a]
+
+        self.driver.list_nodes.side_effect = slow_list_nodes
+        with ThreadPoolExecutor(max_workers=20) as executor:
+            futures = [executor.submit(self.poller.get, 'a') for i in range(20)]
+            release.set()
+            results = [future.result() for future in futures]
+        self.assertEqual(results, [self.node_a] * 20)
+        self.driver.list_nodes.assert_called_once_with()
+
+    def test_get_error(self):
+        self.driver.list_nodes.side_effect = [Exception('rate limited'), [self.node_a]]
+        with self.assertRaises(Exception):
+            self.poller.get('a')
+        self.assertEqual(self.poller.get('a'), self.node_a)
+
+    def test_get_bad_listing(self):
+        self.driver.list_nodes.side_effect = [[object()], [self.node_a]]
+        with self.assertRaises(AttributeError):
+            self.poller.get('a')
+        self.assertEqual(self.poller.get('a'), self.node_a)
+
+    def test_subscribe(self):
+        callback = MagicMock()
+        self.poller.subscribe('a', callback)
+        self.poller.refresh()
+        callback.assert_called_once_with('a', None, self.node_a)
+
+        # no transition, no callback
+        self.poller.refresh()
+        self.assertEqual(callback.call_count, 1)
+
+        terminated = mock_node('a', NodeState.TERMINATED)
+        self.driver.list_nodes.return_value = [terminated]
+        self.poller.refresh()
+        callback.assert_called_with('a', NodeState.RUNNING, terminated)
+
+        self.driver.list_nodes.return_value = []
+        self.poller.refresh()
+        callback.assert_called_with('a', NodeState.TERMINATED, None)
+
+        self.poller.unsubscribe('a', callback)
+        self.driver.list_nodes.return_value = [self.node_a]
+        self.poller.refresh()
+        self.assertEqual(callback.call_count, 3)
+
+    def test_wait_for(self):
+        self.poller.interval = 0
+        terminated = mock_node('a', NodeState.TERMINATED)
+        self.driver.list_nodes.side_effect = [[self.node_a], [self.node_a], [terminated]]
+        node = self.poller.wait_for('a', lambda node: node.state == NodeState.TERMINATED)
+        self.assertEqual(node, terminated)
+        self.assertEqual(self.driver.list_nodes.call_count, 3)
+
+    def test_wait_for_timeout(self):
+        with self.assertRaises(TimeoutError):
+            self.poller.wait_for('a', lambda node: node is None, timeout=0)
@@ -0,0 +1,147 @@
+# -*- coding:utf-8 -*-
+"""Create and destroy a group of tempory nodes concurrently
+
+Creating a pool of tempory instances such as::
+
+    >>> managers = [TemporyGCENode(driver, **kwargs) for i in range(4)]
+    >>> with TemporyNodePool(managers, max_workers=4) as pool:
+    >>>     for nm in pool:
+    >>>         nm.fabric.run('echo hello')
+
+"""
+
+from .node_manager import NodeManagerCleanupError
+from .node_manager import NodeManagerError
+from .node_manager import NodeManagerErrorNoNode
+from concurrent.futures import as_completed
+from concurrent.futures import ThreadPoolExecutor
+
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger('aplinux.distribution')
+
+
+class NodeManagerPoolError(NodeManagerError):
+    """One or more nodes in a pool failed to be created"""
+
+    def __init__(self, message, errors):
+        super().__init__(message)
+        self.errors = errors
+
+
+class TemporyNodePool(object):
+    """A group of tempory node managers which are created and destroyed together
+
+    Attributes:
+        node_managers: The TemporyNode instances managed by this pool
+        max_workers: The maximum number of nodes created or destroyed at once
+        on_ready: Optional callable called with each node manager as soon as it is ready
+        ready: The node managers which have been created, in the order they became ready
+    """
+
+    def __init__(self, node_managers, max_workers=None, on_ready=None, consistency_delay=3):
+        """Initialize the pool
+
+        Args:
+            node_managers: An iterable of TemporyNode instances which have not yet been created
+            max_workers: The maximum number of concurrent create/destroy operations. Defaults to
+                the number of node managers
+            on_ready: A callable taking a node manager, called from a worker thread as soon as
+                that node is ready
+            consistency_delay: Seconds to wait before cleaning up after a failed create, in case
+                the provider list api is eventually consistant
+        """
+        self.node_managers = list(node_managers)
+        self.max_workers = max_workers or max(len(self.node_managers), 1)
+        self.on_ready = on_ready
+        self.consistency_delay = consistency_delay
+        self.ready = []
+        self._started = []
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        return iter(self.node_managers)
+
+    def __len__(self):
+        return len(self.node_managers)
+
+    def __getitem__(self, index):
+        return self.node_managers[index]
+
+    def _create_one(self, nm):
+        """Create a single node manager recording that it has been started"""
+        with self._lock:
+            self._started.append(nm)
+        nm.create()
+        with self._lock:
+            self.ready.append(nm)
+        if self.on_ready is not None:
+            self.on_ready(nm)
+        return nm
+
+    def create(self):
+        """Create all the nodes concurrently. Return once every node is ready
+
+        If any node fails to be created, the creation of nodes which have not yet started is
+        cancelled and every started node is destroyed before a NodeManagerPoolError is raised.
+        """
+        logger.info(f'Creating a pool of {len(self)} tempory nodes with {self.max_workers} workers')
+        errors = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self._create_one, nm): nm for nm in self.node_managers}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except BaseException as err:  # we can use BaseException since we are re-raising it
+                    logger.error(f'Failed to create tempory node {futures[future].name}: {err!r}')
+                    errors.append(err)
+                    for pending in futures:
+                        pending.cancel()
+
+        if errors:
+            time.sleep(self.consistency_delay)
+            try:
+                self.destroy()
+            except NodeManagerCleanupError:
+                logger.exception('Failed to clean up the tempory node pool after a create error')
+            raise NodeManagerPoolError(f'{len(errors)} of {len(self)} tempory nodes failed to be created',
+                                       errors) from errors[0]
+
+    def _destroy_one(self, nm):
+        """Destroy a single node manager ignoring nodes that never came into existence"""
+        try:
+            nm.destroy()
+        except NodeManagerErrorNoNode:
+            pass
+
+    def destroy(self):
+        """Destroy every started node concurrently, raising NodeManagerCleanupError on any failure"""
+        with self._lock:
+            started = list(self._started)
+        logger.info(f'Destroying a pool of {len(started)} tempory nodes')
+        errors = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self._destroy_one, nm): nm for nm in started}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as err:
+                    logger.error(f'Failed to destroy tempory node {futures[future].name}: {err!r}')
+                    errors.append(err)
+        with self._lock:
+            self._started = []
+            self.ready = []
+        if errors:
+            raise NodeManagerCleanupError(f'{len(errors)} tempory nodes were left in an unknown state') from errors[0]
+
+    def __enter__(self):
+        """Enter python context creating all nodes"""
+        self.create()
+        return self
+
+    def __exit__(self, exc_type, ex_value, ex_tb):
+        """Exit context manager destroying all nodes"""
+        self.destroy()
@@ -0,0 +1,69 @@
+# -*- coding:utf-8 -*-
+
+from . import node_manager
+from . import node_pool
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+
+def mock_node_manager(name):
+    nm = MagicMock()
+    nm.name = name
+    return nm
+
+
+class TestTemporyNodePool(TestCase):
+
+    def setUp(self):
+        self.node_managers = [mock_node_manager(f'node-{i}') for i in range(3)]
+        self.pool = node_pool.TemporyNodePool(self.node_managers, max_workers=2, consistency_delay=0)
+
+    def test_init(self):
+        self.assertEqual(self.pool.node_managers, self.node_managers)
+        self.assertEqual(self.pool.max_workers, 2)
+        self.assertEqual(len(self.pool), 3)
+        self.assertEqual(list(self.pool), self.node_managers)
+        self.assertEqual(self.pool[1], self.node_managers[1])
+
+    def test_default_max_workers(self):
+        pool = node_pool.TemporyNodePool(self.node_managers)
+        self.assertEqual(pool.max_workers, 3)
+
+    def test_context(self):
+        on_ready = MagicMock()
+        self.pool.on_ready = on_ready
+        with self.pool as pool:
+            self.assertEqual(pool, self.pool)
+            self.assertCountEqual(pool.ready, self.node_managers)
+            for nm in self.node_managers:
+                nm.create.assert_called_with()
+                nm.destroy.assert_not_called()
+        for nm in self.node_managers:
+            nm.destroy.assert_called_with()
+            on_ready.assert_any_call(nm)
+        self.assertEqual(self.pool.ready, [])
+
+    def test_create_failure_cleans_up(self):
+        self.node_managers[1].create.side_effect = Exception('no capacity')
+        with self.assertRaises(node_pool.NodeManagerPoolError) as cm:
+            self.pool.create()
+        self.assertEqual(len(cm.exception.errors), 1)
+        # every node manager that was started must have been destroyed
+        for nm in self.node_managers:
+            if nm.create.called:
+                nm.destroy.assert_called_with()
+
+    def test_create_failure_without_node(self):
+        self.node_managers[0].create.side_effect = Exception('quota')
+        self.node_managers[0].destroy.side_effect = node_manager.NodeManagerErrorNoNode()
+        with self.assertRaises(node_pool.NodeManagerPoolError):
+            self.pool.create()
+        self.node_managers[0].destroy.assert_called_with()
+
+    def test_destroy_failure(self):
+        self.pool.create()
+        self.node_managers[2].destroy.side_effect = Exception('timeout')
+        with self.assertRaises(node_manager.NodeManagerCleanupError):
+            self.pool.destroy()
+        for nm in self.node_managers:
+            nm.destroy.assert_called_with()
@@ -0,0 +1,131 @@
+# -*- coding:utf-8 -*-
+"""Bounded memory handling of remote command output
+
+Rather than holding the whole output of a command in memory it is passed chunk by
+chunk to a sink, such as a rotating log file, and only a bounded tail is kept for
+error reporting::
+
+    >>> with RotatingLogSink('logs/build.log.gz', compress=True) as sink:
+    >>>     result = nm.fabric.stream('make -j8', sink=sink)
+    >>> result.stdout  # at most the last 64 KiB
+
+A sink is any callable taking the stream name, 'stdout' or 'stderr', and a chunk of bytes.
+"""
+
+from collections import deque
+
+import gzip
+import logging
+import os
+import threading
+
+
+logger = logging.getLogger('aplinux.distribution')
+
+
+class TailBuffer(object):
+    """Keep the last max_bytes of the data appended to it"""
+
+    def __init__(self, max_bytes=65536):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._chunks = deque()
+
+    def append(self, data):
+        self._chunks.append(data)
+        self.size += len(data)
+        while self.size - len(self._chunks[0]) >= self.max_bytes:
+            self.size -= len(self._chunks.popleft())
+
+    def getvalue(self):
+        return b''.join(self._chunks)[-self.max_bytes:]
+
+
+class RotatingLogSink(object):
+    """A sink writing output to a log file which is rotated when it reaches max_bytes
+
+    Rotated files are renamed with a numeric suffix, path.1 being the most recent, and only
+    backup_count of them are kept.
+
+    Attributes:
+        path: The log file path
+        max_bytes: The number of uncompressed bytes written to a file before it is rotated
+        backup_count: The number of rotated files kept
+        compress: If True then the files are written gzip compressed
+    """
+
+    def __init__(self, path, max_bytes=64 * 2 ** 20, backup_count=3, compress=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.compress = compress
+        self._fout = None
+        self._written = 0
+        self._lock = threading.Lock()
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._fout = gzip.open(self.path, 'ab') if self.compress else open(self.path, 'ab')
+        self._written = 0
+
+    def _rotate(self):
+        self._fout.close()
+        self._fout = None
+        for index in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{index}'):
+                os.replace(f'{self.path}.{index}', f'{self.path}.{index + 1}')
+        if self.backup_count > 0:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+
+    def __call__(self, stream, data):
+        with self._lock:
+            if self._fout is None:
+                self._open()
+            self._fout.write(data)
+            self._written += len(data)
+            if self._written >= self.max_bytes:
+                self._rotate()
+
+    def close(self):
+        with self._lock:
+            if self._fout is not None:
+                self._fout.close()
+                self._fout = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, ex_value, ex_tb):
+        self.close()
+
+
+class OutputTail(object):
+    """Pass command output to a sink keeping the tail of stdout and stderr
+
+    The out and err methods are suitable for the out and err arguments of
+    ConnectionWithSCP.exec_command.
+
+    Attributes:
+        sink: An optional sink the output is passed to
+        stdout: The TailBuffer of stdout
+        stderr: The TailBuffer of stderr
+    """
+
+    def __init__(self, sink=None, tail_bytes=65536):
+        self.sink = sink
+        self.stdout = TailBuffer(tail_bytes)
+        self.stderr = TailBuffer(tail_bytes)
+
+    def out(self, data):
+        self.stdout.append(data)
+        if self.sink is not None:
+            self.sink('stdout', data)
+
+    def err(self, data):
+        self.stderr.append(data)
+        if self.sink is not None:
+            self.sink('stderr', data)
@@ -0,0 +1,59 @@
+# -*- coding:utf-8 -*-
+
+from . import output_sink
+from unittest import TestCase
+
+import gzip
+import os
+import tempfile
+
+
+class TestTailBuffer(TestCase):
+
+    def test_tail(self):
+        tail = output_sink.TailBuffer(max_bytes=10)
+        for i in range(100):
+            tail.append(b'%03d' % i)
+        self.assertEqual(tail.getvalue(), b'6097098099')
+        self.assertLessEqual(tail.size, 13)
+
+    def test_large_chunk(self):
+        tail = output_sink.TailBuffer(max_bytes=4)
+        tail.append(b'abcdefgh')
+        self.assertEqual(tail.getvalue(), b'efgh')
+
+
+class TestRotatingLogSink(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.path = os.path.join(self.temp_dir.name, 'logs', 'node.log')
+
+    def test_rotate(self):
+        with output_sink.RotatingLogSink(self.path, max_bytes=10, backup_count=2) as sink:
+            for chunk in (b'a' * 10, b'b' * 10, b'c' * 10, b'd' * 5):
+                sink('stdout', chunk)
+        self.assertCountEqual(os.listdir(os.path.dirname(self.path)), ['node.log', 'node.log.1', 'node.log.2'])
+        for suffix, content in (('', b'd' * 5), ('.1', b'c' * 10), ('.2', b'b' * 10)):
+            with open(self.path + suffix, 'rb') as fin:
+                self.assertEqual(fin.read(), content)
+
+    def test_compress(self):
+        with output_sink.RotatingLogSink(self.path, compress=True) as sink:
+            sink('stdout', b'hello ')
+            sink('stderr', b'world')
+        with gzip.open(self.path, 'rb') as fin:
+            self.assertEqual(fin.read(), b'hello world')
+
+
+class TestOutputTail(TestCase):
+
+    def test_output_tail(self):
+        chunks = []
+        tail = output_sink.OutputTail(lambda stream, data: chunks.append((stream, data)), tail_bytes=3)
+        tail.out(b'hello')
+        tail.err(b'oops')
+        self.assertEqual(chunks, [('stdout', b'hello'), ('stderr', b'oops')])
+        self.assertEqual(tail.stdout.getvalue(), b'llo')
+        self.assertEqual(tail.stderr.getvalue(), b'ops')
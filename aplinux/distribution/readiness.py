@@ -0,0 +1,107 @@
+# -*- coding:utf-8 -*-
+"""Staged ssh readiness checks
+
+Rather than paying for a full ssh handshake on every attempt, a node is probed in
+stages. A cheap tcp connect to the ssh port, then the ssh banner is read and only
+then is an authenticated connection attempted::
+
+    >>> probe = SSHReadinessProbe('10.0.0.1', authenticate=test_connect)
+    >>> BackoffPolicy(deadline=300).wait(probe)
+    True
+    >>> probe.timings
+    {'tcp': 21.3, 'banner': 0.01, 'auth': 0.9}
+
+"""
+
+import logging
+import socket
+import time
+
+
+logger = logging.getLogger('aplinux.distribution')
+
+
+class ReadinessError(Exception):
+    """A readiness stage did not pass"""
+
+
+def read_ssh_banner(sock, max_lines=20):
+    """Read the ssh identification string from a connected socket
+
+    Servers may send other lines before the identification string, these are skipped.
+    """
+    fin = sock.makefile('rb')
+    try:
+        for i in range(max_lines):
+            line = fin.readline(256)
+            if not line:
+                break
+            if line.startswith(b'SSH-'):
+                return line.strip().decode('ascii', 'replace')
+    finally:
+        fin.close()
+    raise ReadinessError('No ssh banner received')
+
+
+class SSHReadinessProbe(object):
+    """A callable which makes one readiness attempt, returning True once every stage has passed
+
+    Stages which have passed are not repeated on later attempts.
+
+    Attributes:
+        host: The host to probe, or a callable returning it which is called on each attempt, for a
+            node whose ip address is not known until it has been refreshed
+        port: The ssh port
+        timeout: The socket timeout used for the tcp and banner stages
+        authenticate: A callable which raises an exception if an authenticated command fails
+        stage: The stage to be attempted next, one of tcp, banner, auth or None when ready
+        timings: The seconds each stage took to pass, measured from the end of the previous stage
+        banner: The ssh banner read from the server
+        error: The last error raised by a stage
+    """
+
+    def __init__(self, host, authenticate, port=22, timeout=3):
+        self.host = host
+        self.authenticate = authenticate
+        self.port = port
+        self.timeout = timeout
+        self.stage = 'tcp'
+        self.timings = {}
+        self.banner = None
+        self.error = None
+        self._mark = None
+
+    def _passed(self, stage, next_stage):
+        now = time.monotonic()
+        self.timings[stage] = now - self._mark
+        self._mark = now
+        self.stage = next_stage
+
+    def _host(self):
+        return self.host() if callable(self.host) else self.host
+
+    def _probe_socket(self, host):
+        if host is None:
+            raise ReadinessError('No ip address to probe')
+        with socket.create_connection((host, self.port), timeout=self.timeout) as sock:
+            if self.stage == 'tcp':
+                self._passed('tcp', 'banner')
+            self.banner = read_ssh_banner(sock)
+            self._passed('banner', 'auth')
+
+    def __call__(self):
+        if self._mark is None:
+            self._mark = time.monotonic()
+        host = None
+        try:
+            host = self._host()
+            if self.stage in ('tcp', 'banner'):
+                self._probe_socket(host)
+            if self.stage == 'auth':
+                self.authenticate()
+                self._passed('auth', None)
+            return True
+        except Exception as err:
+            self.error = err
+            logger.debug(f'{host}:{self.port} not ready at the {self.stage} stage: {err!r}')
+            return False
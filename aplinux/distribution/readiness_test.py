@@ -0,0 +1,93 @@
+# -*- coding:utf-8 -*-
+
+from . import readiness
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+import socket
+import threading
+
+
+class BannerServer(object):
+    """A local tcp server which sends a banner to every connection"""
+
+    def __init__(self, banner):
+        self.banner = banner
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.port = self.sock.getsockname()[1]
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, addr = self.sock.accept()
+            except OSError:
+                return
+            with conn:
+                conn.sendall(self.banner)
+
+    def close(self):
+        self.sock.close()
+
+
+class TestSSHReadinessProbe(TestCase):
+
+    def test_ready(self):
+        server = BannerServer(b'Welcome\r\nSSH-2.0-OpenSSH_9.2\r\n')
+        self.addCleanup(server.close)
+        authenticate = MagicMock()
+        probe = readiness.SSHReadinessProbe('127.0.0.1', authenticate, port=server.port)
+        self.assertTrue(probe())
+        authenticate.assert_called_once_with()
+        self.assertEqual(probe.banner, 'SSH-2.0-OpenSSH_9.2')
+        self.assertEqual(list(probe.timings), ['tcp', 'banner', 'auth'])
+        self.assertIsNone(probe.stage)
+
+    def test_no_banner(self):
+        server = BannerServer(b'HTTP/1.1 400 Bad Request\r\n')
+        self.addCleanup(server.close)
+        authenticate = MagicMock()
+        probe = readiness.SSHReadinessProbe('127.0.0.1', authenticate, port=server.port)
+        self.assertFalse(probe())
+        self.assertEqual(probe.stage, 'banner')
+        self.assertIsInstance(probe.error, readiness.ReadinessError)
+        authenticate.assert_not_called()
+
+    def test_connection_refused(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        probe = readiness.SSHReadinessProbe('127.0.0.1', MagicMock(), port=port)
+        self.assertFalse(probe())
+        self.assertEqual(probe.stage, 'tcp')
+        self.assertIsInstance(probe.error, OSError)
+
+    def test_auth_retried_without_reprobing(self):
+        server = BannerServer(b'SSH-2.0-OpenSSH_9.2\r\n')
+        self.addCleanup(server.close)
+        authenticate = MagicMock(side_effect=[Exception('auth failed'), None])
+        probe = readiness.SSHReadinessProbe('127.0.0.1', authenticate, port=server.port)
+        self.assertFalse(probe())
+        self.assertEqual(probe.stage, 'auth')
+        server.close()
+        self.assertTrue(probe())
+        self.assertEqual(authenticate.call_count, 2)
+
+    def test_no_ip_address(self):
+        probe = readiness.SSHReadinessProbe(None, MagicMock())
+        self.assertFalse(probe())
+        self.assertIsInstance(probe.error, readiness.ReadinessError)
+
+    def test_host_resolved_on_each_attempt(self):
+        server = BannerServer(b'SSH-2.0-OpenSSH_9.2\r\n')
+        self.addCleanup(server.close)
+        host = MagicMock(side_effect=[None, '127.0.0.1'])
+        probe = readiness.SSHReadinessProbe(host, MagicMock(), port=server.port)
+        self.assertFalse(probe())
+        self.assertIsInstance(probe.error, readiness.ReadinessError)
+        self.assertTrue(probe())
+        self.assertEqual(host.call_count, 2)
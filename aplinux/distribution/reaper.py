@@ -0,0 +1,169 @@
+# -*- coding:utf-8 -*-
+"""Background teardown of tempory nodes
+
+A node manager created with ``defer_destroy=True`` hands itself to a NodeReaper
+when its context exits instead of waiting for the node to terminate::
+
+    >>> with TemporyGCENode(driver, defer_destroy=True, **kwargs) as nm:
+    >>>     fabfile.build(nm.fabric)
+    >>>     nm.stop_and_create_image(image_name)
+    >>> # returns immediately, the node is terminated in the background
+
+Outstanding teardowns are waited on when the process exits. Teardowns which are
+still outstanding (or failed) are recorded in an optional json journal so that
+they can be cleaned up later.
+"""
+
+from .node_manager import NodeManagerErrorNoNode
+from concurrent.futures import Future
+from concurrent.futures import wait
+from datetime import datetime
+
+import asyncio
+import atexit
+import inspect
+import json
+import logging
+import os
+import queue
+import threading
+import weakref
+
+
+logger = logging.getLogger('aplinux.distribution')
+
+
+_reapers = weakref.WeakSet()  # every NodeReaper, waited on by the single exit handler
+
+
+@atexit.register
+def _wait_for_reapers():
+    """Wait for the outstanding teardowns of every reaper when the process exits"""
+    for reaper in list(_reapers):
+        reaper._atexit()
+
+
+class NodeReaper(object):
+    """Destroys tempory nodes on background worker threads
+
+    Attributes:
+        workers: The number of worker threads
+        journal_path: If not None, a json file which records outstanding and failed teardowns
+        exit_timeout: The number of seconds to wait for outstanding teardowns at process exit.
+            If None then wait until they complete
+        on_error: An optional callable called with (node_manager, error) when a teardown fails
+        errors: A list of (node name, error) for failed teardowns
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    @classmethod
+    def default(cls):
+        """Return the process wide reaper, creating it if needed"""
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls(journal_path=os.environ.get('APLINUX_REAPER_JOURNAL'))
+            return cls._default
+
+    def __init__(self, workers=4, journal_path=None, exit_timeout=None, on_error=None):
+        self.workers = workers
+        self.journal_path = journal_path
+        self.exit_timeout = exit_timeout
+        self.on_error = on_error
+        self.errors = []
+        self._queue = queue.Queue()
+        self._pending = {}
+        self._failed = {}
+        self._threads = []
+        self._lock = threading.Lock()
+        _reapers.add(self)
+
+    @property
+    def outstanding(self):
+        """The names of nodes which have not yet finished being destroyed"""
+        with self._lock:
+            return sorted(self._pending)
+
+    def submit(self, nm):
+        """Queue a node manager to be destroyed, returning a concurrent.futures.Future"""
+        future = Future()
+        with self._lock:
+            self._pending[nm.name] = (nm, future, datetime.now().isoformat())
+            self._write_journal()
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f'node-reaper-{len(self._threads)}', daemon=True)
+                self._threads.append(thread)
+                thread.start()
+        logger.info(f'Deferred destroying tempory node: {nm.name}')
+        self._queue.put((nm, future))
+        return future
+
+    def _work(self):
+        """Worker thread loop"""
+        while True:
+            nm, future = self._queue.get()
+            error = None
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = nm.destroy()
+                    if inspect.iscoroutine(result):  # an AsyncTemporyNode
+                        asyncio.run(result)
+                except NodeManagerErrorNoNode:
+                    pass
+                except BaseException as err:  # we can use BaseException since it is passed on to the future
+                    error = err
+                    logger.error(f'Deferred destroy of tempory node {nm.name} failed: {err!r}')
+                    if self.on_error is not None:
+                        try:
+                            self.on_error(nm, err)
+                        except Exception:
+                            logger.exception('Reaper on_error callback failed')
+            with self._lock:
+                _, _, submitted = self._pending.pop(nm.name)
+                if error is not None:
+                    self.errors.append((nm.name, error))
+                    self._failed[nm.name] = (nm, submitted, repr(error))
+                self._write_journal()
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+            self._queue.task_done()
+
+    def _journal_entry(self, nm, submitted, error=None):
+        node = nm.node
+        return {'name': nm.name,
+                'id': None if node is None else node.id,
+                'driver': type(nm.driver).__name__,
+                'submitted': submitted,
+                'error': error}
+
+    def _write_journal(self):
+        """Atomically rewrite the journal. Must be called with the lock held"""
+        if self.journal_path is None:
+            return
+        entries = [self._journal_entry(nm, submitted) for nm, _, submitted in self._pending.values()]
+        entries += [self._journal_entry(nm, submitted, error) for nm, submitted, error in self._failed.values()]
+        temp_path = f'{self.journal_path}.tmp'
+        with open(temp_path, 'w') as fout:
+            json.dump(entries, fout, indent=2)
+        os.replace(temp_path, self.journal_path)
+
+    def wait(self, timeout=None):
+        """Wait for outstanding teardowns, returning the names of those which did not complete"""
+        with self._lock:
+            futures = [future for _, future, _ in self._pending.values()]
+        wait(futures, timeout=timeout)
+        return self.outstanding
+
+    def _atexit(self):
+        """Wait for outstanding teardowns when the process exits"""
+        if not self._pending:
+            return
+        logger.info(f'Waiting for {len(self._pending)} deferred tempory node teardowns')
+        outstanding = self.wait(self.exit_timeout)
+        if outstanding:
+            logger.error(f'Tempory nodes left in an unknown state: {", ".join(outstanding)}')
+            if self.journal_path is not None:
+                logger.error(f'Outstanding teardowns recorded in {self.journal_path}')
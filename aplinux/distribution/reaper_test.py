@@ -0,0 +1,103 @@
+# -*- coding:utf-8 -*-
+
+from . import node_manager
+from . import reaper
+from unittest import TestCase
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+import json
+import os
+import tempfile
+import threading
+
+
+def mock_node_manager(name):
+    nm = MagicMock()
+    nm.name = name
+    nm.node.id = f'{name}-id'
+    return nm
+
+
+class TestNodeReaper(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.journal_path = os.path.join(self.temp_dir.name, 'journal.json')
+        self.reaper = reaper.NodeReaper(workers=2, journal_path=self.journal_path)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def read_journal(self):
+        with open(self.journal_path) as fin:
+            return json.load(fin)
+
+    def test_submit(self):
+        nm = mock_node_manager('node-1')
+        future = self.reaper.submit(nm)
+        self.assertIsNone(future.result(timeout=5))
+        nm.destroy.assert_called_with()
+        self.assertEqual(self.reaper.outstanding, [])
+        self.assertEqual(self.read_journal(), [])
+
+    def test_submit_no_node(self):
+        nm = mock_node_manager('node-1')
+        nm.destroy.side_effect = node_manager.NodeManagerErrorNoNode()
+        self.assertIsNone(self.reaper.submit(nm).result(timeout=5))
+        self.assertEqual(self.reaper.errors, [])
+
+    def test_outstanding_is_journaled(self):
+        release = threading.Event()
+        nm = mock_node_manager('node-1')
+        nm.destroy.side_effect = lambda: release.wait(5)
+        future = self.reaper.submit(nm)
+        self.assertEqual(self.reaper.outstanding, ['node-1'])
+        self.assertEqual(self.reaper.wait(timeout=0), ['node-1'])
+        journal = self.read_journal()
+        self.assertEqual(journal[0]['name'], 'node-1')
+        self.assertEqual(journal[0]['id'], 'node-1-id')
+        release.set()
+        future.result(timeout=5)
+        self.assertEqual(self.reaper.wait(), [])
+
+    def test_failure(self):
+        on_error = MagicMock()
+        self.reaper.on_error = on_error
+        nm = mock_node_manager('node-1')
+        error = node_manager.NodeManagerError('Node failed to terminate')
+        nm.destroy.side_effect = error
+        future = self.reaper.submit(nm)
+        self.assertEqual(future.exception(timeout=5), error)
+        on_error.assert_called_with(nm, error)
+        self.assertEqual(self.reaper.errors, [('node-1', error)])
+        journal = self.read_journal()
+        self.assertEqual(journal[0]['name'], 'node-1')
+        self.assertIn('Node failed to terminate', journal[0]['error'])
+
+    def test_atexit_waits(self):
+        nm = mock_node_manager('node-1')
+        self.reaper.submit(nm)
+        self.reaper._atexit()
+        self.assertEqual(self.reaper.outstanding, [])
+        nm.destroy.assert_called_with()
+
+    def test_exit_handler(self):
+        with patch('atexit.register') as register:
+            other = reaper.NodeReaper()
+        register.assert_not_called()  # registered once for every reaper
+        self.assertIn(other, reaper._reapers)
+        with patch.object(reaper.NodeReaper, '_atexit', autospec=True) as atexit:
+            reaper._wait_for_reapers()
+        atexit.assert_any_call(other)
+        atexit.assert_any_call(self.reaper)
+
+
+class TestDeferredDestroy(TestCase):
+
+    def test_context_exit_deferred(self):
+        nm = node_manager.TemporyNode(MagicMock(), key_pair=MagicMock(), defer_destroy=True, reaper=MagicMock())
+        nm.destroy = MagicMock()
+        nm.__exit__(None, None, None)
+        nm.reaper.submit.assert_called_with(nm)
+        nm.destroy.assert_not_called()
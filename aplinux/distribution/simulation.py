@@ -0,0 +1,295 @@
+# -*- coding:utf-8 -*-
+"""Fleet scale simulation of control plane api calls
+
+Providers rate limit their apis, so the number of calls a fleet of tempory nodes makes
+matters as much as how long it takes. A scenario is run at several fleet sizes against
+a ThrottlingDriver, which counts and times every call and can reject calls as a rate
+limited provider would. The report shows the calls per node and how each kind of call
+scales with the fleet size, flagging any which grow faster than linearly::
+
+    $ python -m aplinux.distribution.simulation --scenario lifecycle --fleet-sizes 1 10 50
+    $ python -m aplinux.distribution.simulation --scenario lifecycle --shared-poller --rate-limit 20
+
+Nodes are never connected to over ssh, only the control plane is simulated.
+"""
+
+from .instance_group import gce_cycle_instance_group
+from .key_provider import Ed25519KeyProvider
+from .node_manager import NodeManagerError
+from .node_manager import TemporyEC2Node
+from .node_manager import TemporyGCENode
+from .node_manager import TemporyNode
+from .node_poller import NodeStatePoller
+from .node_pool import TemporyNodePool
+from .single_node import gce_cycle_node
+from .testing import FakeNodeDriver
+from libcloud.common.exceptions import RateLimitReachedError
+from libcloud.compute.base import NodeImage
+
+import argparse
+import logging
+import math
+import random
+import sys
+import threading
+import time
+
+
+logger = logging.getLogger('aplinux.distribution')
+
+
+NODE_CLASSES = {'TemporyNode': TemporyNode, 'TemporyGCENode': TemporyGCENode, 'TemporyEC2Node': TemporyEC2Node}
+
+LISTED = 'list_nodes results'
+
+
+class ThrottlingDriver(FakeNodeDriver):
+    """A FakeNodeDriver which can reject calls with RateLimitReachedError
+
+    Rejected calls are still counted since they still reach the provider.
+
+    Attributes:
+        rate_limit: The calls per second allowed, with bursts of up to rate_limit calls. None for no limit
+        throttle_probability: The fraction of calls which are randomly rejected
+        throttled: A dict of driver method name to the number of rejected calls
+        listed: The total number of nodes returned by list_nodes calls
+    """
+
+    def __init__(self, rate_limit=None, throttle_probability=0, seed=None, **kwargs):
+        super().__init__(**kwargs)
+        self.rate_limit = rate_limit
+        self.throttle_probability = throttle_probability
+        self.throttled = {}
+        self.listed = 0
+        self._random = random.Random(seed)
+        self._tokens = rate_limit
+        self._refilled = time.monotonic()
+        self._throttle_lock = threading.Lock()
+
+    def _allowed(self):
+        with self._throttle_lock:
+            if self._random.random() < self.throttle_probability:
+                return False
+            if self.rate_limit is None:
+                return True
+            now = time.monotonic()
+            self._tokens = min(self.rate_limit, self._tokens + (now - self._refilled) * self.rate_limit)
+            self._refilled = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def _call(self, method, latency=0):
+        super()._call(method, latency)
+        if not self._allowed():
+            with self._throttle_lock:
+                self.throttled[method] = self.throttled.get(method, 0) + 1
+            raise RateLimitReachedError(headers={'retry-after': '1'})
+
+    def list_nodes(self):
+        nodes = super().list_nodes()
+        with self._throttle_lock:
+            self.listed += len(nodes)
+        return nodes
+
+
+class FleetReport(object):
+    """The api calls made by a scenario at one fleet size
+
+    Attributes:
+        fleet_size: The number of nodes
+        calls: A dict of driver method name to the number of calls
+        call_seconds: A dict of driver method name to the seconds spent in the calls
+        throttled: A dict of driver method name to the number of rejected calls
+        listed: The total number of nodes returned by list_nodes calls
+        errors: The reprs of the errors raised by the scenario
+        seconds: The wall clock seconds the scenario took
+    """
+
+    def __init__(self, fleet_size, driver, errors, seconds):
+        self.fleet_size = fleet_size
+        self.calls = dict(driver.calls)
+        self.call_seconds = dict(driver.call_seconds)
+        self.throttled = dict(driver.throttled)
+        self.listed = driver.listed
+        self.errors = errors
+        self.seconds = seconds
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    @property
+    def per_node(self):
+        """A dict of driver method name to the calls per node lifecycle"""
+        return {method: calls / self.fleet_size for method, calls in self.calls.items()}
+
+    def counts(self):
+        """The call counts along with the number of nodes returned by list_nodes"""
+        return {**self.calls, LISTED: self.listed}
+
+
+class ScalingReport(object):
+    """FleetReports at increasing fleet sizes
+
+    Attributes:
+        scenario: The scenario name
+        reports: A list of FleetReport ordered by fleet size
+    """
+
+    def __init__(self, scenario, reports):
+        self.scenario = scenario
+        self.reports = sorted(reports, key=lambda report: report.fleet_size)
+
+    def exponents(self):
+        """Return a dict of call name to k where the number of calls grows as fleet_size ** k
+
+        k is estimated from the smallest and largest fleets. Roughly 1 is linear, 2 is quadratic.
+        """
+        smallest, largest = self.reports[0], self.reports[-1]
+        if largest.fleet_size <= smallest.fleet_size:
+            return {}
+        growth = math.log(largest.fleet_size / smallest.fleet_size)
+        exponents = {}
+        for name, count in largest.counts().items():
+            base = smallest.counts().get(name, 0)
+            if count:
+                exponents[name] = math.log(count / base) / growth if base else math.inf
+        return exponents
+
+    def superlinear(self, threshold=1.5):
+        """Return a dict of the call names whose exponent exceeds threshold"""
+        return {name: exponent for name, exponent in self.exponents().items() if exponent > threshold}
+
+    def __str__(self):
+        names = sorted(set(name for report in self.reports for name in report.counts()))
+        exponents = self.exponents()
+        width = max([len(name) for name in names] + [24])
+        lines = [f'Scenario: {self.scenario}',
+                 f'{"calls per node":<{width}} ' + ' '.join(f'{f"n={report.fleet_size}":>9}'
+                                                           for report in self.reports) + f' {"growth":>7}']
+        for name in names:
+            counts = ' '.join(f'{report.counts().get(name, 0) / report.fleet_size:>9.2f}' for report in self.reports)
+            lines.append(f'{name:<{width}} {counts} {exponents.get(name, 0):>7.2f}')
+        lines.append(f'{"total calls":<{width}} ' + ' '.join(f'{report.total_calls:>9}' for report in self.reports))
+        lines.append(f'{"throttled calls":<{width}} ' +
+                     ' '.join(f'{sum(report.throttled.values()):>9}' for report in self.reports))
+        lines.append(f'{"errors":<{width}} ' + ' '.join(f'{len(report.errors):>9}' for report in self.reports))
+        for name, exponent in sorted(self.superlinear().items()):
+            lines.append(f'WARNING {name} grows as fleet_size ** {exponent:.2f}')
+        return '\n'.join(lines)
+
+
+def _describe(err):
+    """Return the repr of an error followed by the repr of its cause, if any"""
+    return f'{err!r} from {err.__cause__!r}' if err.__cause__ is not None else repr(err)
+
+
+def _without_ssh(node_class):
+    """Return a subclass of node_class which skips the ssh readiness check"""
+    return type(f'Simulated{node_class.__name__}', (node_class,), {'wait_until_ready': lambda self, **kwargs: None})
+
+
+def simulate_lifecycle(driver, fleet_size, node_class=TemporyGCENode, shared_poller=False):
+    """Create and destroy a pool of fleet_size node managers, returning the errors raised"""
+    node_poller = NodeStatePoller(driver, interval=0.5) if shared_poller else None
+    image = NodeImage(id='simulation', name='simulation', driver=driver)
+    key_provider = Ed25519KeyProvider()
+    managers = [_without_ssh(node_class)(driver,
+                                         name_prefix='simulation-',
+                                         size=driver.list_sizes()[0],
+                                         image=image,
+                                         key_provider=key_provider,
+                                         node_poller=node_poller)
+                for i in range(fleet_size)]
+    pool = TemporyNodePool(managers, consistency_delay=0)
+    try:
+        pool.create()
+    except NodeManagerError as err:
+        return [_describe(err)]  # a failed create destroys the pool
+    try:
+        pool.destroy()
+    except NodeManagerError as err:
+        return [_describe(err)]
+    return []
+
+
+def simulate_cycle_node(driver, fleet_size):
+    """Cycle fleet_size nodes twice with gce_cycle_node, returning the errors raised"""
+    errors = []
+    for cycle in range(2):
+        for index in range(fleet_size):
+            try:
+                gce_cycle_node(driver, f'simulation-node-{index}', size='small', image='debian', location='zone')
+            except Exception as err:
+                errors.append(repr(err))
+    return errors
+
+
+def simulate_cycle_instance_group(driver, fleet_size):
+    """Cycle fleet_size instance groups with gce_cycle_instance_group, returning the errors raised"""
+    errors = []
+    for index in range(fleet_size):
+        try:
+            gce_cycle_instance_group(driver, f'simulation-group-{index}', size='small', image='debian')
+        except Exception as err:
+            errors.append(repr(err))
+    return errors
+
+
+SCENARIOS = {'lifecycle': simulate_lifecycle,
+             'cycle_node': simulate_cycle_node,
+             'cycle_instance_group': simulate_cycle_instance_group}
+
+
+def simulate(scenario, fleet_sizes=(1, 10, 50), driver_kwargs=None, **scenario_kwargs):
+    """Run a scenario at each fleet size against a fresh ThrottlingDriver
+
+    Args:
+        scenario: A key of SCENARIOS
+        fleet_sizes: The fleet sizes to run the scenario at
+        driver_kwargs: The ThrottlingDriver keyword arguments
+        scenario_kwargs: Passed to the scenario function
+
+    Returns:
+        ScalingReport
+    """
+    reports = []
+    for fleet_size in fleet_sizes:
+        driver = ThrottlingDriver(**(driver_kwargs or {}))
+        start = time.monotonic()
+        errors = SCENARIOS[scenario](driver, fleet_size, **scenario_kwargs)
+        reports.append(FleetReport(fleet_size, driver, errors, time.monotonic() - start))
+        logger.info(f'Simulated {scenario} with {fleet_size} nodes: {reports[-1].total_calls} api calls')
+    return ScalingReport(scenario, reports)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simulate the control plane api calls of a fleet of nodes')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='lifecycle')
+    parser.add_argument('--fleet-sizes', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--node-class', choices=sorted(NODE_CLASSES), default='TemporyGCENode')
+    parser.add_argument('--shared-poller', action='store_true', help='Share a NodeStatePoller between node managers')
+    parser.add_argument('--boot-latency', type=float, default=0.2)
+    parser.add_argument('--terminate-latency', type=float, default=1.0)
+    parser.add_argument('--rate-limit', type=float, default=None, help='Api calls per second before throttling')
+    parser.add_argument('--throttle-probability', type=float, default=0)
+    parser.add_argument('--threshold', type=float, default=1.5, help='The growth exponent reported as superlinear')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    driver_kwargs = {'boot_latency': args.boot_latency,
+                     'terminate_latency': args.terminate_latency,
+                     'rate_limit': args.rate_limit,
+                     'throttle_probability': args.throttle_probability}
+    scenario_kwargs = {}
+    if args.scenario == 'lifecycle':
+        scenario_kwargs = {'node_class': NODE_CLASSES[args.node_class], 'shared_poller': args.shared_poller}
+    report = simulate(args.scenario, args.fleet_sizes, driver_kwargs, **scenario_kwargs)
+    print(report)
+    return 1 if report.superlinear(args.threshold) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
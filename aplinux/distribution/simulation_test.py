@@ -0,0 +1,98 @@
+# -*- coding:utf-8 -*-
+
+from . import simulation
+from libcloud.common.exceptions import RateLimitReachedError
+from unittest import TestCase
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+import math
+
+
+def fleet_report(fleet_size, calls, listed=0):
+    driver = MagicMock()
+    driver.calls = calls
+    driver.call_seconds = {}
+    driver.throttled = {}
+    driver.listed = listed
+    return simulation.FleetReport(fleet_size, driver, [], 1.0)
+
+
+class TestThrottlingDriver(TestCase):
+
+    def test_rate_limit(self):
+        driver = simulation.ThrottlingDriver(rate_limit=2)
+        driver.list_nodes()
+        driver.list_nodes()
+        with self.assertRaises(RateLimitReachedError):
+            driver.list_nodes()
+        self.assertEqual(driver.calls, {'list_nodes': 3})
+        self.assertEqual(driver.throttled, {'list_nodes': 1})
+
+    def test_throttle_probability(self):
+        driver = simulation.ThrottlingDriver(throttle_probability=1)
+        with self.assertRaises(RateLimitReachedError):
+            driver.create_node('node-1', 'small', 'debian')
+        self.assertEqual(driver.throttled, {'create_node': 1})
+
+    def test_listed(self):
+        driver = simulation.ThrottlingDriver()
+        driver.create_node('node-1', 'small', 'debian')
+        driver.create_node('node-2', 'small', 'debian')
+        driver.list_nodes()
+        driver.list_nodes()
+        self.assertEqual(driver.listed, 4)
+
+
+class TestScalingReport(TestCase):
+
+    def test_exponents(self):
+        report = simulation.ScalingReport('lifecycle', [
+            fleet_report(100, {'create_node': 100, 'list_nodes': 400}, listed=20000),
+            fleet_report(1, {'create_node': 1, 'list_nodes': 4, 'ex_get_image': 1}, listed=2),
+        ])
+        self.assertEqual([fleet.fleet_size for fleet in report.reports], [1, 100])
+        exponents = report.exponents()
+        self.assertAlmostEqual(exponents['create_node'], 1)
+        self.assertAlmostEqual(exponents[simulation.LISTED], 2)
+        self.assertNotIn('ex_get_image', exponents)
+        self.assertEqual(list(report.superlinear()), [simulation.LISTED])
+        self.assertEqual(report.reports[1].per_node, {'create_node': 1, 'list_nodes': 4})
+        self.assertIn('WARNING list_nodes results grows as fleet_size ** 2.00', str(report))
+
+    def test_exponents_new_call(self):
+        report = simulation.ScalingReport('lifecycle', [fleet_report(1, {}), fleet_report(10, {'list_nodes': 3})])
+        self.assertEqual(report.exponents(), {'list_nodes': math.inf})
+
+
+class TestSimulate(TestCase):
+
+    def test_lifecycle(self):
+        report = simulation.simulate('lifecycle', fleet_sizes=(1, 3))
+        for fleet in report.reports:
+            self.assertEqual(fleet.errors, [])
+            self.assertEqual(fleet.per_node['create_node'], 1)
+            self.assertEqual(fleet.per_node['destroy_node'], 1)
+
+    def test_lifecycle_throttled(self):
+        report = simulation.simulate('lifecycle', fleet_sizes=(2,), driver_kwargs={'throttle_probability': 1})
+        self.assertEqual(len(report.reports[0].errors), 1)
+        self.assertIn('RateLimitReachedError', report.reports[0].errors[0])
+
+    def test_cycle_node(self):
+        report = simulation.simulate('cycle_node', fleet_sizes=(1, 4))
+        fleet = report.reports[1]
+        self.assertEqual(fleet.errors, [])
+        self.assertEqual(fleet.calls, {'ex_get_node': 8, 'create_node': 8, 'destroy_node': 4})
+
+    def test_cycle_instance_group(self):
+        report = simulation.simulate('cycle_instance_group', fleet_sizes=(2,))
+        self.assertEqual(report.reports[0].per_node, {'ex_create_instancetemplate': 1,
+                                                      'ex_get_instancetemplate': 1,
+                                                      'ex_get_instancegroupmanager': 1,
+                                                      'ex_instancegroupmanager_set_instancetemplate': 1})
+
+    def test_main(self):
+        with patch('builtins.print') as print_:
+            self.assertEqual(simulation.main(['--scenario', 'cycle_node', '--fleet-sizes', '1', '2']), 0)
+        self.assertIn('Scenario: cycle_node', str(print_.call_args[0][0]))
@@ -0,0 +1,310 @@
+# -*- coding:utf-8 -*-
+"""Offline stand ins for a cloud provider and a node's ssh server
+
+A FakeNodeDriver simulates provider latencies and a LocalSSHServer accepts the node
+managers' fabric connections so that the whole node lifecycle can be run without
+credentials::
+
+    >>> with LocalSSHServer() as server:
+    >>>     driver = FakeNodeDriver(boot_latency=2, ip_address=server.host)
+    >>>     with TemporyGCENode(driver, size=driver.list_sizes()[0], image='debian',
+    >>>                         fabric_config_defaults={'port': server.port}) as nm:
+    >>>         nm.fabric.run('echo hello')
+
+The ssh server does not run commands. Each command is passed to a handler which
+returns the stdout, stderr and exit status, by default an empty successful result.
+"""
+
+from libcloud.common.google import ResourceNotFoundError
+from libcloud.compute.base import Node
+from libcloud.compute.base import NodeImage
+from libcloud.compute.drivers.dummy import DummyNodeDriver
+from libcloud.compute.types import NodeState
+
+import itertools
+import logging
+import paramiko
+import socket
+import threading
+import time
+import types
+
+
+logger = logging.getLogger('aplinux.distribution')
+
+
+class FakeNodeDriver(DummyNodeDriver):
+    """A libcloud driver with in memory nodes and simulated latencies
+
+    It implements the driver methods used by TemporyNode, TemporyGCENode, TemporyEC2Node,
+    gce_cycle_node and gce_cycle_instance_group.
+
+    Attributes:
+        api_latency: The seconds every api call takes
+        create_latency: The extra seconds create_node takes
+        boot_latency: The seconds after create_node until the node is running
+        terminate_latency: The seconds after destroy_node until the node is terminated
+        ip_address: The public ip address given to every node
+        calls: A dict of driver method name to the number of calls
+        call_seconds: A dict of driver method name to the total seconds spent in the calls
+    """
+
+    name = 'Fake'
+
+    def __init__(self, api_latency=0, create_latency=0, boot_latency=0, terminate_latency=0, ip_address='127.0.0.1'):
+        super().__init__(0)
+        self.nl = []
+        self.api_latency = api_latency
+        self.create_latency = create_latency
+        self.boot_latency = boot_latency
+        self.terminate_latency = terminate_latency
+        self.ip_address = ip_address
+        self.calls = {}
+        self.call_seconds = {}
+        self.images = {}
+        self.key_pairs = {}
+        self.instance_templates = {}
+        self.instance_groups = {}
+        self._ids = itertools.count(1)
+        self._running_at = {}
+        self._terminated_at = {}
+        self._lock = threading.Lock()
+
+    def _call(self, method, latency=0):
+        """Count an api call and sleep for its latency"""
+        latency += self.api_latency
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            self.call_seconds[method] = self.call_seconds.get(method, 0) + latency
+        time.sleep(latency)
+
+    def _update_states(self):
+        """Move nodes along their lifecycle. Must be called with the lock held"""
+        now = time.monotonic()
+        for node in list(self.nl):
+            if node.id in self._terminated_at:
+                if now >= self._terminated_at[node.id] + self.terminate_latency:
+                    self.nl.remove(node)
+                    node.state = NodeState.TERMINATED
+            elif now >= self._running_at[node.id]:
+                node.state = NodeState.RUNNING
+                node.public_ips = [self.ip_address]
+
+    def create_node(self, name, size, image, **kwargs):
+        self._call('create_node', self.create_latency)
+        node = Node(id=str(next(self._ids)), name=name, state=NodeState.PENDING, public_ips=[], private_ips=[],
+                    driver=self, size=size, image=image, extra=kwargs)
+        with self._lock:
+            self.nl.append(node)
+            self._running_at[node.id] = time.monotonic() + self.boot_latency
+        return node
+
+    def list_nodes(self):
+        self._call('list_nodes')
+        with self._lock:
+            self._update_states()
+            return list(self.nl)
+
+    def destroy_node(self, node):
+        self._call('destroy_node')
+        with self._lock:
+            if node.id not in self._running_at:
+                return False
+            self._terminated_at.setdefault(node.id, time.monotonic())
+            for existing_node in self.nl:
+                if existing_node.id == node.id:
+                    existing_node.state = NodeState.STOPPING
+        return True
+
+    def wait_until_running(self, nodes, wait_period=0.1, timeout=600, **kwargs):
+        """As NodeDriver.wait_until_running but polling every wait_period seconds"""
+        self._call('wait_until_running')
+        ids = set(node.id for node in nodes)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                self._update_states()
+                running = [node for node in self.nl if node.id in ids and node.state == NodeState.RUNNING]
+            if len(running) == len(ids):
+                return [(node, node.public_ips) for node in running]
+            time.sleep(wait_period)
+        raise TimeoutError('Timed out waiting for the nodes to be running')
+
+    def ex_get_node(self, name, zone=None):
+        self._call('ex_get_node')
+        with self._lock:
+            self._update_states()
+            for node in self.nl:
+                if node.name == name:
+                    return node
+        raise ResourceNotFoundError(f"The resource '{name}' was not found", None, None)
+
+    def ex_get_address(self, name, region=None):
+        self._call('ex_get_address')
+        return name
+
+    def ex_create_instancetemplate(self, name, **kwargs):
+        self._call('ex_create_instancetemplate')
+        template = self.instance_templates[name] = types.SimpleNamespace(name=name, extra=kwargs)
+        return template
+
+    def ex_get_instancetemplate(self, name):
+        self._call('ex_get_instancetemplate')
+        try:
+            return self.instance_templates[name]
+        except KeyError:
+            raise ResourceNotFoundError(f"The resource '{name}' was not found", None, None) from None
+
+    def ex_get_instancegroupmanager(self, name, zone=None):
+        self._call('ex_get_instancegroupmanager')
+        return self.instance_groups.setdefault(name, types.SimpleNamespace(name=name, template=None))
+
+    def ex_instancegroupmanager_set_instancetemplate(self, manager, instancetemplate):
+        self._call('ex_instancegroupmanager_set_instancetemplate')
+        manager.template = instancetemplate
+        return True
+
+    def get_image(self, image_id):
+        self._call('get_image')
+        return self.images.get(image_id) or NodeImage(id=image_id, name=image_id, driver=self)
+
+    def ex_get_image(self, name):
+        self._call('ex_get_image')
+        return self.images.get(name) or NodeImage(id=name, name=name, driver=self)
+
+    def import_key_pair_from_string(self, name, key_material):
+        self._call('import_key_pair_from_string')
+        self.key_pairs[name] = key_material
+
+    def delete_key_pair(self, key_pair):
+        self._call('delete_key_pair')
+        self.key_pairs.pop(key_pair.name, None)
+        return True
+
+    def ex_stop_node(self, node):
+        self._call('ex_stop_node')
+        node.state = NodeState.STOPPED
+        return True
+
+    def ex_get_volume(self, name):
+        self._call('ex_get_volume')
+        return name
+
+    def ex_create_image(self, name, volume, wait_for_completion=True, **kwargs):
+        self._call('ex_create_image')
+        image = self.images[name] = NodeImage(id=name, name=name, driver=self, extra=kwargs)
+        return image
+
+
+def _default_handler(command):
+    return b'', b'', 0
+
+
+class _ServerInterface(paramiko.ServerInterface):
+    """Accept any public key and pass exec requests to the command handler"""
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def get_allowed_auths(self, username):
+        return 'publickey'
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, *args):
+        return True
+
+    def check_channel_env_request(self, channel, name, value):
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self._exec, args=(channel, command), daemon=True).start()
+        return True
+
+    def _exec(self, channel, command):
+        # the channel is left for the client to close, closing it here could race with the
+        # reply to the exec request which is sent after check_channel_exec_request returns
+        try:
+            stdout, stderr, exited = self.handler(command.decode('utf-8', 'replace'))
+            channel.sendall(stdout)
+            channel.sendall_stderr(stderr)
+        except Exception:
+            logger.exception('Local ssh server command handler failed')
+            exited = 255
+        channel.send_exit_status(exited)
+        channel.shutdown_write()
+
+
+class LocalSSHServer(object):
+    """An in process ssh server listening on a local port
+
+    Attributes:
+        host: The address the server listens on
+        port: The port the server listens on, chosen by the operating system if 0
+        handler: A callable taking the command string and returning (stdout, stderr, exit status)
+        connections: The number of ssh connections accepted
+    """
+
+    _host_key = None
+    _host_key_lock = threading.Lock()
+
+    @classmethod
+    def host_key(cls):
+        """A host key shared by every server in the process since generating one is slow"""
+        with cls._host_key_lock:
+            if cls._host_key is None:
+                cls._host_key = paramiko.RSAKey.generate(2048)
+            return cls._host_key
+
+    def __init__(self, host='127.0.0.1', port=0, handler=None):
+        self.host = host
+        self.handler = handler or _default_handler
+        self.connections = 0
+        self._socket = socket.create_server((host, port), backlog=256)
+        self.port = self._socket.getsockname()[1]
+        self._transports = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._accept, name='local-ssh-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def _accept(self):
+        while True:
+            try:
+                sock, address = self._socket.accept()
+            except OSError:
+                return  # the server socket was closed
+            threading.Thread(target=self._serve, args=(sock,), daemon=True).start()
+
+    def _serve(self, sock):
+        transport = paramiko.Transport(sock)
+        transport.add_server_key(self.host_key())
+        with self._lock:
+            self.connections += 1
+            self._transports.append(transport)
+        try:
+            transport.start_server(server=_ServerInterface(self.handler))
+        except (paramiko.SSHException, EOFError, OSError):
+            transport.close()  # readiness probes disconnect once they have read the banner
+
+    def stop(self):
+        self._socket.close()
+        with self._lock:
+            transports, self._transports = self._transports, []
+        for transport in transports:
+            transport.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, ex_value, ex_tb):
+        self.stop()
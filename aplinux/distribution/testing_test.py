@@ -0,0 +1,84 @@
+# -*- coding:utf-8 -*-
+
+from . import fabric
+from . import testing
+from .key_provider import Ed25519KeyProvider
+from .key_provider import load_private_key
+from libcloud.common.google import ResourceNotFoundError
+from libcloud.compute.types import NodeState
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+import time
+
+
+class TestFakeNodeDriver(TestCase):
+
+    def test_lifecycle(self):
+        driver = testing.FakeNodeDriver(boot_latency=0.05, terminate_latency=0.05, ip_address='10.0.0.1')
+        node = driver.create_node('node-1', driver.list_sizes()[0], driver.get_image('debian'), ex_colour='red')
+        self.assertEqual(node.state, NodeState.PENDING)
+        self.assertEqual(node.extra, {'ex_colour': 'red'})
+        self.assertEqual(driver.list_nodes(), [node])
+
+        driver.wait_until_running([node], wait_period=0.01)
+        self.assertEqual(node.state, NodeState.RUNNING)
+        self.assertEqual(node.public_ips, ['10.0.0.1'])
+
+        self.assertTrue(node.destroy())
+        self.assertEqual(node.state, NodeState.STOPPING)
+        self.assertEqual(driver.list_nodes(), [node])
+        time.sleep(0.05)
+        self.assertEqual(driver.list_nodes(), [])
+        self.assertEqual(node.state, NodeState.TERMINATED)
+        self.assertEqual(driver.calls, {'create_node': 1, 'get_image': 1, 'list_nodes': 3, 'wait_until_running': 1,
+                                        'destroy_node': 1})
+
+    def test_images_and_key_pairs(self):
+        driver = testing.FakeNodeDriver()
+        image = driver.ex_create_image('image-1', driver.ex_get_volume('node-1'), ex_labels={'a': 'b'})
+        self.assertIs(driver.ex_get_image('image-1'), image)
+        self.assertEqual(image.extra, {'ex_labels': {'a': 'b'}})
+        driver.import_key_pair_from_string('key-1', 'ssh-ed25519 AAAA')
+        self.assertEqual(driver.key_pairs, {'key-1': 'ssh-ed25519 AAAA'})
+        key_pair = MagicMock()
+        key_pair.name = 'key-1'
+        driver.delete_key_pair(key_pair)
+        self.assertEqual(driver.key_pairs, {})
+
+    def test_gce_cycle_methods(self):
+        driver = testing.FakeNodeDriver()
+        with self.assertRaises(ResourceNotFoundError):
+            driver.ex_get_node('node-1')
+        node = driver.create_node('node-1', 'small', 'debian')
+        self.assertIs(driver.ex_get_node('node-1', 'zone'), node)
+
+        template = driver.ex_create_instancetemplate('template-1', size='small')
+        self.assertIs(driver.ex_get_instancetemplate('template-1'), template)
+        with self.assertRaises(ResourceNotFoundError):
+            driver.ex_get_instancetemplate('template-2')
+        manager = driver.ex_get_instancegroupmanager('group-1')
+        driver.ex_instancegroupmanager_set_instancetemplate(manager, template)
+        self.assertIs(driver.ex_get_instancegroupmanager('group-1').template, template)
+
+
+class TestLocalSSHServer(TestCase):
+
+    def test_commands(self):
+        def handler(command):
+            if command == 'fail':
+                return b'', b'failed\n', 3
+            return command.encode('utf-8'), b'', 0
+
+        pkey = load_private_key(Ed25519KeyProvider().generate().private_key)
+        with testing.LocalSSHServer(handler=handler) as server:
+            connection = fabric.ConnectionWithSCP(server.host, port=server.port, user='admin',
+                                                  connect_kwargs={'pkey': pkey, 'look_for_keys': False})
+            try:
+                self.assertEqual(connection.run('hello', hide=True, in_stream=False).stdout, 'hello')
+                self.assertEqual(connection.run('again', hide=True, in_stream=False).stdout, 'again')
+                result = connection.exec_command('fail', warn=True)
+                self.assertEqual((result.stderr, result.exited), ('failed\n', 3))
+            finally:
+                connection.close()
+            self.assertEqual(server.connections, 1)
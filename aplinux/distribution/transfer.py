@@ -0,0 +1,257 @@
+# -*- coding:utf-8 -*-
+"""Concurrent scp transfers to and from one or more nodes
+
+Each file is copied on its own scp channel, with a limited number of channels open
+on each connection at once. Failed files are retried and throughput is reported::
+
+    >>> scheduler = TransferScheduler(channels_per_connection=4)
+    >>> for nm in pool:
+    >>>     scheduler.get(nm.fabric, '/build/output.deb', f'artifacts/{nm.name}/')
+    >>> report = scheduler.run()
+    >>> report.throughput
+    48234496.0
+
+"""
+
+from collections import defaultdict
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from itertools import zip_longest
+
+import logging
+import os
+import posixpath
+import threading
+import time
+
+
+logger = logging.getLogger('aplinux.distribution')
+
+
+Transfer = namedtuple('Transfer', ['connection', 'direction', 'src', 'dest'])
+
+
+class TransferResult(object):
+    """The outcome of a single file transfer
+
+    Attributes:
+        transfer: The Transfer
+        size: The number of bytes transferred
+        seconds: The time taken by the successful attempt
+        attempts: The number of attempts made
+        error: The error of the last attempt if every attempt failed
+    """
+
+    def __init__(self, transfer, size=0, seconds=0, attempts=0, error=None):
+        self.transfer = transfer
+        self.size = size
+        self.seconds = seconds
+        self.attempts = attempts
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return (f'<TransferResult {self.transfer.direction} {self.transfer.src} -> {self.transfer.dest} '
+                f'size={self.size} attempts={self.attempts} ok={self.ok}>')
+
+
+class TransferReport(object):
+    """The results of a TransferScheduler run
+
+    Attributes:
+        results: A list of TransferResult in the order the transfers were added
+        elapsed: The wall clock seconds the run took
+    """
+
+    def __init__(self, results, elapsed):
+        self.results = results
+        self.elapsed = elapsed
+
+    @property
+    def total_bytes(self):
+        return sum(result.size for result in self.results if result.ok)
+
+    @property
+    def failed(self):
+        return [result for result in self.results if not result.ok]
+
+    @property
+    def throughput(self):
+        """The bytes per second transferred over the whole run"""
+        return self.total_bytes / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __str__(self):
+        return (f'{len(self.results) - len(self.failed)}/{len(self.results)} files, '
+                f'{self.total_bytes / 2 ** 20:.1f} MiB in {self.elapsed:.1f}s '
+                f'({self.throughput / 2 ** 20:.1f} MiB/s)')
+
+
+class TransferError(Exception):
+    """One or more transfers failed after every retry"""
+
+    def __init__(self, report):
+        super().__init__(f'{len(report.failed)} transfers failed: '
+                         + ', '.join(f'{result.transfer.src}: {result.error!r}' for result in report.failed))
+        self.report = report
+
+
+class TransferScheduler(object):
+    """Queue uploads and downloads across connections and run them concurrently
+
+    Connections are expected to be ConnectionWithSCP instances, which open a new scp channel
+    on their transport for each put and get.
+
+    Attributes:
+        channels_per_connection: The maximum number of transfers running at once on one connection.
+            The ssh server limits the sessions per connection (MaxSessions is 10 by default in OpenSSH)
+        max_workers: The maximum number of transfers running at once over all connections
+        retries: The number of times a failed transfer is retried
+        retry_delay: The seconds waited before the first retry, doubled for each later retry
+        on_progress: An optional callable called with each TransferResult as it completes
+    """
+
+    def __init__(self, channels_per_connection=4, max_workers=16, retries=2, retry_delay=1, on_progress=None):
+        self.channels_per_connection = channels_per_connection
+        self.max_workers = max_workers
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.on_progress = on_progress
+        self.transfers = []
+
+    def put(self, connection, src, dest):
+        """Queue the upload of a local path or binary file object to dest
+
+        A file object is sent from its start and is read by the transfer's worker thread, so the
+        same file object must not be queued more than once.
+        """
+        self.transfers.append(Transfer(connection, 'put', src, dest))
+
+    def get(self, connection, src, dest):
+        """Queue the download of a remote file to a local path or directory"""
+        self.transfers.append(Transfer(connection, 'get', src, dest))
+
+    def _attempt(self, transfer):
+        """Make one attempt at a transfer, returning the number of bytes moved"""
+        if transfer.direction == 'put':
+            if hasattr(transfer.src, 'read'):
+                size = transfer.src.seek(0, os.SEEK_END)
+                transfer.src.seek(0)  # a retry must resend the whole file object
+                transfer.connection.put(transfer.src, transfer.dest)
+                return size
+            transfer.connection.put(transfer.src, transfer.dest)
+            return os.path.getsize(transfer.src)
+        transfer.connection.get(transfer.src, transfer.dest)
+        path = transfer.dest
+        if os.path.isdir(path):
+            path = os.path.join(path, posixpath.basename(transfer.src))
+        return os.path.getsize(path)
+
+    def _transfer(self, transfer, slots):
+        result = TransferResult(transfer)
+        with slots:
+            while True:
+                result.attempts += 1
+                start = time.monotonic()
+                try:
+                    result.size = self._attempt(transfer)
+                    result.seconds = time.monotonic() - start
+                    result.error = None
+                    break
+                except Exception as err:
+                    result.error = err
+                    if result.attempts > self.retries:
+                        logger.error(f'Failed to {transfer.direction} {transfer.src}: {err!r}')
+                        break
+                    delay = self.retry_delay * 2 ** (result.attempts - 1)
+                    logger.warning(f'Retrying {transfer.direction} of {transfer.src} in {delay}s: {err!r}')
+                    time.sleep(delay)
+        if self.on_progress is not None:
+            self.on_progress(result)
+        return result
+
+    def run(self, raise_on_error=True):
+        """Run every queued transfer and clear the queue
+
+        Transfers are interleaved across connections so that every node is kept busy.
+
+        Args:
+            raise_on_error: If True then raise a TransferError if any transfer failed
+
+        Returns:
+            TransferReport
+        """
+        transfers, self.transfers = self.transfers, []
+        by_connection = defaultdict(list)
+        for index, transfer in enumerate(transfers):
+            by_connection[id(transfer.connection)].append((index, transfer))
+        slots = {}
+        for key, queued in by_connection.items():
+            queued[0][1].connection.open()  # open each connection once rather than racing in the workers
+            slots[key] = threading.Semaphore(self.channels_per_connection)
+        interleaved = [item for items in zip_longest(*by_connection.values()) for item in items if item is not None]
+
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [(index, executor.submit(self._transfer, transfer, slots[id(transfer.connection)]))
+                       for index, transfer in interleaved]
+        results = [future.result() for index, future in sorted(futures, key=lambda item: item[0])]
+        report = TransferReport(results, time.monotonic() - start)
+        logger.info(f'Transferred {report}')
+        if raise_on_error and report.failed:
+            raise TransferError(report)
+        return report
+
+
+def upload(connections, files, **kwargs):
+    """Upload the same files to every connection concurrently
+
+    Args:
+        connections: The connections of the nodes, for example [nm.fabric for nm in pool]
+        files: An iterable of (local path or binary file object, remote path). A file object is
+            read once and each upload is given its own buffer of the content
+        kwargs: Passed to TransferScheduler
+
+    Returns:
+        TransferReport
+    """
+    files = list(files)
+    contents = {}
+    for index, (src, dest) in enumerate(files):
+        if hasattr(src, 'read'):
+            src.seek(0)
+            contents[index] = src.read()
+    scheduler = TransferScheduler(**kwargs)
+    for connection in connections:
+        for index, (src, dest) in enumerate(files):
+            if index in contents:
+                src = BytesIO(contents[index])
+            scheduler.put(connection, src, dest)
+    return scheduler.run()
+
+
+def collect(connections, remote_paths, local_dir, **kwargs):
+    """Download the same remote files from every connection concurrently
+
+    The files of each node are written to a directory under local_dir named after the node's host.
+
+    Args:
+        connections: The connections of the nodes, for example [nm.fabric for nm in pool]
+        remote_paths: The remote files to download
+        local_dir: The local directory
+        kwargs: Passed to TransferScheduler
+
+    Returns:
+        TransferReport
+    """
+    remote_paths = list(remote_paths)
+    scheduler = TransferScheduler(**kwargs)
+    for connection in connections:
+        node_dir = os.path.join(local_dir, connection.host)
+        os.makedirs(node_dir, exist_ok=True)
+        for remote_path in remote_paths:
+            scheduler.get(connection, remote_path, node_dir)
+    return scheduler.run()
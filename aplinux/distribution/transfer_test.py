@@ -0,0 +1,134 @@
+# -*- coding:utf-8 -*-
+
+from . import transfer
+from io import BytesIO
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+
+class LocalCopyConnection(object):
+    """A connection whose put and get copy local files, counting the transfers running at once"""
+
+    def __init__(self, host, failures=0):
+        self.host = host
+        self.failures = failures
+        self.open = MagicMock()
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def _copy(self, src, dest):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            failed = self.failures > 0
+            self.failures -= 1
+        try:
+            time.sleep(0.01)
+            if failed:
+                raise OSError('channel closed')
+            if hasattr(src, 'read'):
+                with open(dest, 'wb') as fout:
+                    fout.write(src.read())
+            else:
+                shutil.copy(src, dest)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+    put = _copy
+    get = _copy
+
+
+class TestTransferScheduler(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.base = self.temp_dir.name
+        self.sources = []
+        for i in range(6):
+            path = os.path.join(self.base, f'file-{i}')
+            with open(path, 'wb') as fout:
+                fout.write(b'x' * 100)
+            self.sources.append(path)
+
+    def test_run(self):
+        connections = [LocalCopyConnection('node-0'), LocalCopyConnection('node-1')]
+        progress = []
+        scheduler = transfer.TransferScheduler(channels_per_connection=2, on_progress=progress.append)
+        for connection in connections:
+            os.makedirs(os.path.join(self.base, connection.host))
+            for path in self.sources:
+                scheduler.put(connection, path, os.path.join(self.base, connection.host, os.path.basename(path)))
+        report = scheduler.run()
+        self.assertEqual(scheduler.transfers, [])
+        self.assertEqual(len(report.results), 12)
+        self.assertEqual(len(progress), 12)
+        self.assertEqual(report.failed, [])
+        self.assertEqual(report.total_bytes, 1200)
+        self.assertGreater(report.throughput, 0)
+        self.assertEqual([result.transfer.src for result in report.results[:6]], self.sources)
+        for connection in connections:
+            connection.open.assert_called_once_with()
+            self.assertLessEqual(connection.max_running, 2)
+            self.assertEqual(len(os.listdir(os.path.join(self.base, connection.host))), 6)
+
+    def test_retry(self):
+        connection = LocalCopyConnection('node-0', failures=2)
+        scheduler = transfer.TransferScheduler(channels_per_connection=1, retries=2, retry_delay=0)
+        source = BytesIO(b'y' * 10)
+        scheduler.put(connection, source, os.path.join(self.base, 'out'))
+        report = scheduler.run()
+        self.assertEqual(report.results[0].attempts, 3)
+        self.assertEqual(report.results[0].size, 10)
+        with open(os.path.join(self.base, 'out'), 'rb') as fin:
+            self.assertEqual(fin.read(), b'y' * 10)
+
+    def test_failure(self):
+        connection = LocalCopyConnection('node-0', failures=5)
+        scheduler = transfer.TransferScheduler(retries=1, retry_delay=0)
+        scheduler.put(connection, self.sources[0], os.path.join(self.base, 'out'))
+        with self.assertRaises(transfer.TransferError) as cm:
+            scheduler.run()
+        report = cm.exception.report
+        self.assertEqual(report.results[0].attempts, 2)
+        self.assertIsInstance(report.results[0].error, OSError)
+        self.assertEqual(report.total_bytes, 0)
+
+        scheduler.put(connection, self.sources[0], os.path.join(self.base, 'out'))
+        report = scheduler.run(raise_on_error=False)
+        self.assertEqual(len(report.failed), 1)
+
+    def test_collect(self):
+        connections = [LocalCopyConnection('node-0'), LocalCopyConnection('node-1')]
+        local_dir = os.path.join(self.base, 'artifacts')
+        report = transfer.collect(connections, self.sources[:2], local_dir)
+        self.assertEqual(report.total_bytes, 400)
+        for connection in connections:
+            self.assertCountEqual(os.listdir(os.path.join(local_dir, connection.host)), ['file-0', 'file-1'])
+
+    def test_upload(self):
+        connections = [MagicMock(), MagicMock()]
+        report = transfer.upload(connections, [(self.sources[0], '/tmp/file-0')])
+        self.assertEqual(report.total_bytes, 200)
+        for connection in connections:
+            connection.put.assert_called_once_with(self.sources[0], '/tmp/file-0')
+
+    def test_upload_file_object(self):
+        received = []
+        connections = [MagicMock() for i in range(4)]
+        for connection in connections:
+            connection.put.side_effect = lambda src, dest: received.append(src.read())
+        source = BytesIO(b'z' * 1000)
+        source.seek(600)
+        report = transfer.upload(connections, [(source, '/tmp/upload.bin')])
+        self.assertEqual(received, [b'z' * 1000] * 4)
+        self.assertEqual([result.size for result in report.results], [1000] * 4)
+        self.assertEqual(len(set(id(result.transfer.src) for result in report.results)), 4)
@@ -0,0 +1,92 @@
+# -*- coding:utf-8 -*-
+"""Deadline based polling schedules
+
+A BackoffPolicy polls quickly a few times, then backs off exponentially with
+jitter until an overall deadline is reached::
+
+    >>> policy = BackoffPolicy(deadline=60)
+    >>> policy.wait(lambda: node_is_gone())
+    True
+
+"""
+
+import logging
+import random
+import time
+
+
+logger = logging.getLogger('aplinux.distribution')
+
+
+class BackoffPolicy(object):
+    """A polling schedule of fast first polls followed by exponential backoff with jitter
+
+    Attributes:
+        deadline: The total number of seconds to poll for
+        fast_polls: The number of polls made at fast_interval before backing off
+        fast_interval: The number of seconds between the fast polls
+        initial_delay: The first delay after the fast polls
+        factor: The multiplier applied to the delay after each backed off poll
+        max_delay: The upper bound of a single delay
+        jitter: The fraction by which each backed off delay is randomly varied
+        on_progress: An optional callable called with (attempt, elapsed, remaining) before each delay
+    """
+
+    def __init__(self, deadline=180, fast_polls=3, fast_interval=0.5, initial_delay=1, factor=2, max_delay=10,
+                 jitter=0.2, on_progress=None):
+        self.deadline = deadline
+        self.fast_polls = fast_polls
+        self.fast_interval = fast_interval
+        self.initial_delay = initial_delay
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.on_progress = on_progress
+
+    @classmethod
+    def from_retry(cls, tries=10, delay=0.5, backoff=1.5):
+        """Return a policy of the delays of the retry decorator's tries, delay and backoff
+
+        The deadline is the sum of the delays between the tries, so attempts which take a while
+        leave time for fewer tries.
+        """
+        delays = [delay * backoff ** attempt for attempt in range(max(tries - 1, 0))]
+        return cls(deadline=sum(delays), fast_polls=0, initial_delay=delay, factor=backoff,
+                   max_delay=max(delays, default=delay), jitter=0)
+
+    def delay(self, attempt):
+        """Return the delay before the poll following the given zero based attempt"""
+        if attempt < self.fast_polls:
+            return self.fast_interval
+        exponent = min(attempt - self.fast_polls, 64)  # the delay has long since reached max_delay
+        delay = min(self.max_delay, self.initial_delay * self.factor ** exponent)
+        return delay * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def schedule(self):
+        """Yield successive delays until the deadline has been reached"""
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            elapsed = time.monotonic() - start
+            remaining = self.deadline - elapsed
+            if remaining <= 0:
+                return
+            if self.on_progress is not None:
+                self.on_progress(attempt, elapsed, remaining)
+            yield min(self.delay(attempt), remaining)
+            attempt += 1
+
+    def wait(self, check):
+        """Call check until it returns a true value or the deadline is reached
+
+        Returns:
+            bool: True if check succeeded before the deadline
+        """
+        if check():
+            return True
+        for delay in self.schedule():
+            logger.debug(f'Polling again in {delay:.2f} seconds')
+            time.sleep(delay)
+            if check():
+                return True
+        return False
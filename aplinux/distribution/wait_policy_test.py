@@ -0,0 +1,54 @@
+# -*- coding:utf-8 -*-
+
+from . import wait_policy
+from unittest import TestCase
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+
+class TestBackoffPolicy(TestCase):
+
+    def setUp(self):
+        self.policy = wait_policy.BackoffPolicy(deadline=60, fast_polls=2, fast_interval=0.25, initial_delay=1,
+                                                factor=2, max_delay=5, jitter=0)
+
+    def test_delay(self):
+        delays = [self.policy.delay(attempt) for attempt in range(7)]
+        self.assertEqual(delays, [0.25, 0.25, 1, 2, 4, 5, 5])
+
+    def test_from_retry(self):
+        policy = wait_policy.BackoffPolicy.from_retry(tries=4, delay=0.5, backoff=2)
+        self.assertEqual([policy.delay(attempt) for attempt in range(3)], [0.5, 1, 2])
+        self.assertEqual(policy.deadline, 3.5)
+        self.assertEqual(wait_policy.BackoffPolicy.from_retry(tries=1).deadline, 0)
+
+    def test_delay_jitter(self):
+        self.policy.jitter = 0.5
+        for i in range(20):
+            delay = self.policy.delay(3)
+            self.assertGreaterEqual(delay, 1)
+            self.assertLessEqual(delay, 3)
+
+    @patch('time.monotonic')
+    def test_schedule_deadline(self, monotonic):
+        monotonic.side_effect = [0, 0, 10, 59.5, 60]
+        on_progress = MagicMock()
+        self.policy.on_progress = on_progress
+        self.assertEqual(list(self.policy.schedule()), [0.25, 0.25, 0.5])
+        on_progress.assert_called_with(2, 59.5, 0.5)
+
+    @patch('time.sleep')
+    def test_wait(self, sleep):
+        check = MagicMock(side_effect=[False, False, True])
+        self.assertTrue(self.policy.wait(check))
+        self.assertEqual(check.call_count, 3)
+        sleep.assert_called_with(0.25)
+
+    @patch('time.sleep')
+    def test_wait_immediate(self, sleep):
+        self.assertTrue(self.policy.wait(lambda: True))
+        sleep.assert_not_called()
+
+    def test_wait_timeout(self):
+        self.policy.deadline = 0
+        self.assertFalse(self.policy.wait(lambda: False))
@@ -0,0 +1,331 @@
+# -*- coding:utf-8 -*-
+"""A warm standby pool of pre booted tempory nodes
+
+For short jobs booting a node and waiting for ssh costs far more than the work. A
+WarmPool keeps size ready nodes for each profile, such as an image and size, hands
+one out immediately and creates a replacement in the background::
+
+    >>> profiles = {'debian': {'image': 'debian-9', 'size': 'n1-standard-1'}}
+    >>> with WarmPool(TemporyGCENode, driver, profiles, size=2, poison_pill_minutes=60) as pool:
+    >>>     with pool.lease('debian') as nm:
+    >>>         nm.fabric.run('make test')
+
+The poison pill is the hard time to live of every node, a node is not handed out or
+recycled once it has less than the RecyclePolicy's min_remaining seconds left to live.
+Used nodes are destroyed unless the policy allows them to be recycled.
+"""
+
+from .node_manager import NodeManagerError
+from .reaper import NodeReaper
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from contextlib import contextmanager
+
+import logging
+import math
+import threading
+import time
+
+
+logger = logging.getLogger('aplinux.distribution')
+
+
+class RecyclePolicy(object):
+    """Decides whether a used warm node is returned to the pool
+
+    Attributes:
+        max_uses: The number of leases a node may serve. The default of 1 destroys nodes after use
+        min_remaining: The seconds a node must have left to live to be handed out or recycled
+    """
+
+    def __init__(self, max_uses=1, min_remaining=600):
+        self.max_uses = max_uses
+        self.min_remaining = min_remaining
+
+    def usable(self, warm_node):
+        """Return True if the node has long enough left to live to be handed out"""
+        return warm_node.remaining() >= self.min_remaining
+
+    def recycle(self, warm_node):
+        """Return True if a node which has been released in good health should be returned to the pool"""
+        return warm_node.uses < self.max_uses and self.usable(warm_node)
+
+
+class WarmNode(object):
+    """A created node manager in a warm pool
+
+    Attributes:
+        node_manager: The created TemporyNode
+        profile: The name of the profile it was created from
+        expires: The time.monotonic() at which its poison pill shuts it down
+        uses: The number of leases it has served
+    """
+
+    def __init__(self, node_manager, profile, expires):
+        self.node_manager = node_manager
+        self.profile = profile
+        self.expires = expires
+        self.uses = 0
+
+    def remaining(self):
+        """Return the seconds left before the node shuts itself down"""
+        return self.expires - time.monotonic()
+
+
+class WarmPool(object):
+    """Keeps ready tempory nodes for each profile, replenishing them in the background
+
+    Attributes:
+        node_class: The TemporyNode class the nodes are created with
+        driver: The libcloud driver
+        profiles: A dict of profile name to the node manager keyword arguments of the profile
+        size: The number of ready nodes kept per profile
+        poison_pill_minutes: The hard time to live of the nodes
+        recycle_policy: The RecyclePolicy applied to released nodes
+        check_interval: The seconds between background checks for expired nodes
+        reaper: The NodeReaper which destroys nodes. Defaults to the process wide reaper
+        consistency_delay: The seconds waited before destroying a node manager whose create failed
+        retry_delay: The seconds before a profile whose create failed is created again, doubled for
+            each consecutive failure
+        max_retry_delay: The upper bound of retry_delay
+        hits: The number of acquires served by a ready node
+        misses: The number of acquires which waited for a node to be created
+        errors: The number of nodes which failed to be created
+    """
+
+    def __init__(self, node_class, driver, profiles, size=1, poison_pill_minutes=60, recycle_policy=None,
+                 check_interval=5, max_workers=None, reaper=None, consistency_delay=3, retry_delay=5,
+                 max_retry_delay=300, **kwargs):
+        """Initialize the pool, nodes are only created once it is started
+
+        Args:
+            node_class: The TemporyNode class to create nodes with
+            driver: The libcloud driver
+            profiles: A dict of profile name to node manager keyword arguments, such as image and size
+            size: The number of ready nodes to keep per profile
+            poison_pill_minutes: The minutes after creation at which nodes shut themselves down
+            recycle_policy: The RecyclePolicy for released nodes. Defaults to destroying them
+            check_interval: The seconds between background checks for expired nodes
+            max_workers: The maximum number of nodes created at once. Defaults to size for every profile
+            reaper: The NodeReaper used to destroy nodes
+            consistency_delay: Seconds to wait before cleaning up after a failed create, in case the
+                node was created and the provider list api is eventually consistant
+            retry_delay: Seconds before creating nodes of a profile again after a failed create,
+                doubled for each consecutive failure of the profile
+            max_retry_delay: The maximum seconds between attempts to create nodes of a failing profile
+            **kwargs: Node manager keyword arguments shared by every profile
+        """
+        assert poison_pill_minutes, 'the poison pill is the hard time to live of warm nodes'
+        self.node_class = node_class
+        self.driver = driver
+        self.profiles = profiles
+        self.size = size
+        self.poison_pill_minutes = poison_pill_minutes
+        self.recycle_policy = recycle_policy or RecyclePolicy()
+        self.check_interval = check_interval
+        self.reaper = reaper or NodeReaper.default()
+        self.consistency_delay = consistency_delay
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.node_kwargs = kwargs
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._ready = {profile: deque() for profile in profiles}
+        self._creating = {profile: 0 for profile in profiles}
+        self._errors = {profile: 0 for profile in profiles}
+        self._failures = {profile: 0 for profile in profiles}  # consecutive failed creates
+        self._retry_at = {profile: 0 for profile in profiles}  # the time.monotonic() before which none are created
+        self._leased = {}
+        self._destroying = []
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or max(1, size * len(profiles)),
+                                            thread_name_prefix='warm-pool')
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def _destroy(self, nm):
+        """Hand a node manager to the reaper, which destroys it and waits for the node to terminate"""
+        future = self.reaper.submit(nm)
+        with self._condition:
+            self._destroying.append(future)
+
+    def _create(self, profile):
+        """Create a node for the profile, run on the executor"""
+        nm = self.node_class(self.driver,
+                             poison_pill_minutes=self.poison_pill_minutes,
+                             **{**self.node_kwargs, **self.profiles[profile]})
+        try:
+            nm.create()
+        except Exception:
+            logger.exception(f'Failed to create a warm {profile} node {nm.name}')
+            with self._condition:
+                self._creating[profile] -= 1
+                self.errors += 1
+                self._errors[profile] += 1
+                self._failures[profile] += 1
+                delay = min(self.max_retry_delay, self.retry_delay * 2 ** min(self._failures[profile] - 1, 64))
+                self._retry_at[profile] = time.monotonic() + delay
+                self._condition.notify_all()
+            logger.info(f'Creating warm {profile} nodes again in {delay:.0f}s')
+            # sleep for a bit in case the failed create made a node and the list api is eventually consistant
+            time.sleep(self.consistency_delay)
+            self._destroy(nm)  # the reaper ignores a node manager without a node
+            return
+        warm_node = WarmNode(nm, profile, time.monotonic() + self.poison_pill_minutes * 60)
+        logger.info(f'Warm {profile} node ready: {nm.name}')
+        with self._condition:
+            self._creating[profile] -= 1
+            self._failures[profile] = 0
+            closed = self._closed
+            if not closed:
+                self._ready[profile].append(warm_node)
+            self._condition.notify_all()
+        if closed:
+            self._destroy(warm_node.node_manager)
+
+    def _expire(self):
+        """Remove the ready nodes which are too close to their poison pill. Called with the lock held"""
+        expired = []
+        for profile, ready in self._ready.items():
+            usable = deque(warm_node for warm_node in ready if self.recycle_policy.usable(warm_node))
+            expired += [warm_node for warm_node in ready if warm_node not in usable]
+            self._ready[profile] = usable
+        return expired
+
+    def replenish(self):
+        """Destroy expired ready nodes and start creating nodes for profiles with fewer than size
+
+        Profiles whose create failed are not created again until their retry delay has passed.
+        """
+        with self._condition:
+            if self._closed:
+                return
+            expired = self._expire()
+            for profile in self.profiles:
+                if time.monotonic() < self._retry_at[profile]:
+                    continue
+                missing = self.size - len(self._ready[profile]) - self._creating[profile]
+                for i in range(missing):
+                    self._creating[profile] += 1
+                    self._executor.submit(self._create, profile)
+        for warm_node in expired:
+            logger.info(f'Destroying the expired warm node {warm_node.node_manager.name}')
+            self._destroy(warm_node.node_manager)
+
+    def _run(self):
+        """Background thread loop"""
+        while True:
+            with self._condition:
+                if self._closed:
+                    return
+            try:
+                self.replenish()
+            except Exception:
+                logger.exception('Failed to replenish the warm pool')
+            with self._condition:
+                self._condition.wait(self.check_interval)
+
+    def start(self):
+        """Start creating nodes and checking for expired nodes in the background"""
+        self._thread = threading.Thread(target=self._run, name='warm-pool', daemon=True)
+        self._thread.start()
+        return self
+
+    def acquire(self, profile, timeout=600):
+        """Return a ready node manager of the profile, waiting for one to be created if there is none
+
+        Raises:
+            NodeManagerError: If no node is ready within timeout seconds or creating one of the profile failed
+        """
+        deadline = time.monotonic() + (math.inf if timeout is None else timeout)
+        expired = []
+        waited = False
+        with self._condition:
+            errors = self._errors[profile]
+            while True:
+                if self._closed:
+                    raise NodeManagerError('The warm pool is closed')
+                expired += self._expire()
+                if self._ready[profile]:
+                    warm_node = self._ready[profile].popleft()
+                    self._leased[warm_node.node_manager] = warm_node
+                    if waited:
+                        self.misses += 1
+                    else:
+                        self.hits += 1
+                    break
+                if self._creating[profile] == 0:
+                    if self._errors[profile] > errors:
+                        raise NodeManagerError(f'Failed to create a warm {profile} node')
+                    if time.monotonic() >= self._retry_at[profile]:
+                        self._condition.release()
+                        try:
+                            self.replenish()
+                        finally:
+                            self._condition.acquire()
+                        continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise NodeManagerError(f'Timed out waiting for a warm {profile} node')
+                if self._creating[profile] == 0:  # wait for the retry delay of a failing profile
+                    remaining = min(remaining, self._retry_at[profile] - time.monotonic())
+                waited = True
+                self._condition.wait(max(0, remaining))
+        for warm_node in expired:
+            self._destroy(warm_node.node_manager)
+        logger.info(f'Acquired warm {profile} node {warm_node.node_manager.name}')
+        self.replenish()
+        return warm_node.node_manager
+
+    def release(self, nm, healthy=True):
+        """Return a node manager from acquire, it is recycled if healthy and the policy allows it"""
+        with self._condition:
+            warm_node = self._leased.pop(nm)
+            warm_node.uses += 1
+            recycle = healthy and not self._closed and self.recycle_policy.recycle(warm_node)
+            if recycle:
+                self._ready[warm_node.profile].append(warm_node)
+                self._condition.notify_all()
+        if recycle:
+            logger.info(f'Recycled warm node {nm.name}')
+        else:
+            self._destroy(warm_node.node_manager)
+        self.replenish()
+
+    @contextmanager
+    def lease(self, profile, timeout=600):
+        """Acquire a node manager for the body of the context, releasing it as unhealthy on an exception"""
+        nm = self.acquire(profile, timeout=timeout)
+        try:
+            yield nm
+        except BaseException:  # we can use BaseException since we are re-raising it
+            self.release(nm, healthy=False)
+            raise
+        self.release(nm)
+
+    def close(self, timeout=None):
+        """Stop replenishing and destroy the ready nodes, waiting for nodes being created and destroyed
+
+        Leased nodes are destroyed when they are released.
+        """
+        with self._condition:
+            self._closed = True
+            ready = [warm_node for profile_ready in self._ready.values() for warm_node in profile_ready]
+            self._ready = {profile: deque() for profile in self.profiles}
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        for warm_node in ready:
+            self._destroy(warm_node.node_manager)
+        self._executor.shutdown(wait=True)
+        with self._condition:
+            destroying = list(self._destroying)
+        wait(destroying, timeout=timeout)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, ex_value, ex_tb):
+        self.close()
@@ -0,0 +1,163 @@
+# -*- coding:utf-8 -*-
+
+from . import warm_pool
+from .node_manager import NodeManagerError
+from concurrent.futures import Future
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+import itertools
+import threading
+import time
+
+
+class FakeNodeManager(object):
+
+    names = itertools.count()
+    fail = False
+
+    def __init__(self, driver, poison_pill_minutes=None, image=None, size=None, delay=0.01):
+        self.name = f'warm-{next(self.names)}'
+        self.poison_pill_minutes = poison_pill_minutes
+        self.image = image
+        self.size = size
+        self.delay = delay
+        self.created = False
+        self.destroyed = threading.Event()
+
+    def create(self):
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError('no capacity')
+        self.created = True
+
+    def destroy(self):
+        self.destroyed.set()
+
+
+class FailingNodeManager(FakeNodeManager):
+
+    fail = True
+
+
+class FailingCentOSNodeManager(FakeNodeManager):
+    """Fails to create centos nodes at once while debian nodes take a while"""
+
+    def __init__(self, driver, image=None, **kwargs):
+        super().__init__(driver, image=image, delay=0.01 if image == 'centos-7' else 0.2, **kwargs)
+        self.fail = image == 'centos-7'
+
+
+def reap(nm):
+    nm.destroy()
+    future = Future()
+    future.set_result(None)
+    return future
+
+
+class TestRecyclePolicy(TestCase):
+
+    def test_recycle(self):
+        policy = warm_pool.RecyclePolicy(max_uses=2, min_remaining=60)
+        warm_node = warm_pool.WarmNode(MagicMock(), 'debian', time.monotonic() + 120)
+        self.assertTrue(policy.usable(warm_node))
+        warm_node.uses = 1
+        self.assertTrue(policy.recycle(warm_node))
+        warm_node.uses = 2
+        self.assertFalse(policy.recycle(warm_node))
+        warm_node.uses = 0
+        warm_node.expires = time.monotonic() + 30
+        self.assertFalse(policy.usable(warm_node))
+        self.assertFalse(policy.recycle(warm_node))
+
+
+class TestWarmPool(TestCase):
+
+    def make_pool(self, node_class=FakeNodeManager, **kwargs):
+        self.reaper = MagicMock()
+        self.reaper.submit.side_effect = reap
+        profiles = {'debian': {'image': 'debian-9', 'size': 'small'}, 'centos': {'image': 'centos-7'}}
+        return warm_pool.WarmPool(node_class, MagicMock(), profiles, size=2, check_interval=0.01, reaper=self.reaper,
+                                  **kwargs)
+
+    def wait_ready(self, pool, count):
+        deadline = time.monotonic() + 5
+        while sum(len(ready) for ready in pool._ready.values()) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_acquire(self):
+        with self.make_pool() as pool:
+            self.wait_ready(pool, 4)
+            nm = pool.acquire('debian')
+            self.assertTrue(nm.created)
+            self.assertEqual((nm.image, nm.size, nm.poison_pill_minutes), ('debian-9', 'small', 60))
+            self.assertEqual((pool.hits, pool.misses), (1, 0))
+            self.wait_ready(pool, 4)  # replenished in the background
+            self.assertEqual(len(pool._ready['debian']), 2)
+            pool.release(nm)
+            self.assertTrue(nm.destroyed.is_set())
+        for ready in pool._ready.values():
+            self.assertEqual(len(ready), 0)
+        self.assertEqual(self.reaper.submit.call_count, 5)
+
+    def test_acquire_waits(self):
+        pool = self.make_pool()
+        nm = pool.acquire('centos', timeout=5)
+        self.assertTrue(nm.created)
+        self.assertEqual((pool.hits, pool.misses), (0, 1))
+        pool.release(nm)
+        pool.close()
+
+    def test_recycle(self):
+        with self.make_pool(recycle_policy=warm_pool.RecyclePolicy(max_uses=2)) as pool:
+            with pool.lease('debian') as nm:
+                pass
+            self.assertFalse(nm.destroyed.is_set())
+            self.assertIn(nm, [warm_node.node_manager for warm_node in pool._ready['debian']])
+            with self.assertRaises(ValueError):
+                with pool.lease('debian') as nm:
+                    raise ValueError()
+            self.assertTrue(nm.destroyed.is_set())
+
+    def test_expire(self):
+        with self.make_pool(poison_pill_minutes=1) as pool:  # less than the policy's min_remaining
+            time.sleep(0.1)
+            self.assertGreater(self.reaper.submit.call_count, 0)
+            with self.assertRaises(NodeManagerError):
+                pool.acquire('debian', timeout=0.1)
+
+    def test_create_failure(self):
+        pool = self.make_pool(node_class=FailingNodeManager, consistency_delay=0.1)
+        start = time.monotonic()
+        with self.assertRaises(NodeManagerError):
+            pool.acquire('debian', timeout=5)
+        self.assertGreater(pool.errors, 0)
+        pool.close()
+        failed = self.reaper.submit.call_args[0][0]
+        self.assertIsInstance(failed, FailingNodeManager)  # cleaned up by the reaper
+        self.assertTrue(failed.destroyed.is_set())
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)  # in case the failed create made a node after all
+        with self.assertRaises(NodeManagerError):
+            pool.acquire('debian')
+
+    def test_create_failure_backoff(self):
+        with self.make_pool(node_class=FailingNodeManager, consistency_delay=0, retry_delay=0.25) as pool:
+            time.sleep(0.3)  # 30 check intervals, while 2 consecutive failures back off for 0.5s
+            self.assertEqual(pool.errors, 4)  # the first size nodes of each profile
+            self.assertEqual(self.reaper.submit.call_count, 4)
+            with self.assertRaisesRegex(NodeManagerError, 'Timed out'):
+                pool.acquire('debian', timeout=0.1)
+            time.sleep(0.4)
+            self.assertEqual(pool.errors, 8)
+            self.assertEqual(pool._failures['debian'], 4)
+
+    def test_create_failure_other_profile(self):
+        pool = self.make_pool(node_class=FailingCentOSNodeManager, consistency_delay=0, retry_delay=0.1)
+        nm = pool.acquire('debian', timeout=5)  # the centos failures do not fail the debian waiter
+        self.assertTrue(nm.created)
+        self.assertGreater(pool.errors, 0)
+        self.assertEqual(pool._errors['debian'], 0)
+        with self.assertRaises(NodeManagerError):
+            pool.acquire('centos', timeout=5)
+        pool.release(nm)
+        pool.close()
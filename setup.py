@@ -22,9 +22,9 @@ setup(name='aplinux.distribution',
 
           # Other deps
           'apache-libcloud',
+          'cryptography',
           'paramiko',
           'fabric',
-          'retry',
           'scp',
 
       ],